@@ -0,0 +1,260 @@
+"""Safe extraction of ZIP and tar archives into a site directory.
+
+Archives are extracted into a staging directory and only moved into place
+once every member has been written, so a failed or rejected archive leaves
+the site untouched. The caller picks the staging directory: one on the
+target's filesystem but outside any served tree (see app.datadirs), so
+moving is a rename per top-level entry, merging into directories that
+already exist. Files that would be replaced are listed in the result, or
+refused with overwrite=False.
+
+ZIP members are decompressed and written by a thread pool (zlib releases
+the GIL); tar archives are streamed in a single pass since compressed tar
+streams cannot be read out of order. `.tar.zst` needs the optional
+`zstandard` package.
+"""
+import errno
+import logging
+import os
+import shutil
+import stat
+import tarfile
+import threading
+import uuid
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+from app import metrics
+from app.utils import merge_tree
+
+logger = logging.getLogger(__name__)
+
+COPY_BUFFER = 1024 * 1024
+# How many replaced files an extraction result names.
+REPLACED_LIMIT = 100
+# Members smaller than this are not subject to the compression ratio check.
+RATIO_FLOOR = 1024 * 1024
+
+ARCHIVE_SUFFIXES = (".zip", ".tar", ".tar.gz", ".tgz", ".tar.zst", ".tzst")
+
+
+class ArchiveError(ValueError):
+    """Raised when an archive is invalid or breaks one of the limits."""
+
+
+class ExtractLimits:
+    """Limits applied to every archive; see `from_config` for the config.json keys."""
+
+    def __init__(self, max_bytes=10 * 1024 ** 3, max_members=100000, max_ratio=200, workers=None):
+        self.max_bytes = max_bytes
+        self.max_members = max_members
+        self.max_ratio = max_ratio
+        self.workers = workers or min(8, os.cpu_count() or 1)
+
+    @classmethod
+    def from_config(cls, config):
+        defaults = cls()
+        return cls(
+            max_bytes=int(config.get("extract_max_bytes", defaults.max_bytes)),
+            max_members=int(config.get("extract_max_members", defaults.max_members)),
+            max_ratio=float(config.get("extract_max_ratio", defaults.max_ratio)),
+            workers=int(config.get("extract_workers", defaults.workers)),
+        )
+
+
+def is_archive(filename):
+    return filename.lower().endswith(ARCHIVE_SUFFIXES)
+
+
+def extract_archive(archive_path, target_dir, limits=None, job=None, name=None, staging_dir=None,
+                    overwrite=True):
+    """Extract the archive at `archive_path` into `target_dir`.
+
+    `name` is the original file name, used to tell the format apart.
+    Members are written to a new directory under `staging_dir` (by default
+    the directory of the archive) first. Progress is reported through
+    `job.update()` when a job is given. Returns {"files": ..., "bytes": ...,
+    "replaced": ..., "replaced_files": [...]}, naming up to REPLACED_LIMIT of
+    the files that were overwritten. With overwrite=False an archive that
+    would replace any file raises ArchiveError and nothing is moved.
+    """
+    limits = limits or ExtractLimits()
+    name = (name or archive_path).lower()
+    os.makedirs(target_dir, exist_ok=True)
+    staging_dir = staging_dir or os.path.dirname(os.path.abspath(archive_path))
+    os.makedirs(staging_dir, exist_ok=True)
+    staging = os.path.join(staging_dir, f".extract-{uuid.uuid4().hex}")
+    os.mkdir(staging, 0o700)
+    try:
+        if name.endswith(".zip"):
+            result = _extract_zip(archive_path, staging, limits, job)
+        elif name.endswith((".tar.zst", ".tzst")):
+            result = _extract_tar_zst(archive_path, staging, limits, job)
+        elif name.endswith((".tar", ".tar.gz", ".tgz")):
+            with tarfile.open(archive_path, "r|*") as tar:
+                result = _extract_tar(tar, os.path.getsize(archive_path), staging, limits, job)
+        else:
+            raise ArchiveError("Unsupported archive type")
+        try:
+            replaced = merge_tree(staging, target_dir, overwrite=overwrite)
+        except FileExistsError as e:
+            raise ArchiveError(f"Archive would overwrite existing files: {e}") from e
+        except OSError as e:
+            if e.errno != errno.EXDEV:
+                raise
+            # No staging directory on the target's filesystem: copy instead.
+            replaced = _copy_tree(staging, target_dir, overwrite)
+        if replaced:
+            logger.info(f"Extracting {name} into {target_dir} replaced {len(replaced)} file(s)")
+        result.update(replaced=len(replaced), replaced_files=replaced[:REPLACED_LIMIT])
+        metrics.extract_files.inc(result["files"])
+        metrics.extract_bytes.inc(result["bytes"])
+        return result
+    except (zipfile.BadZipFile, tarfile.TarError, EOFError) as e:
+        metrics.extract_failures.inc()
+        raise ArchiveError(f"Invalid archive: {e}") from e
+    except Exception:
+        metrics.extract_failures.inc()
+        raise
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
+
+
+def _copy_tree(staging, target_dir, overwrite):
+    replaced = []
+    for directory, dirnames, filenames in os.walk(staging):
+        relative = os.path.relpath(directory, staging)
+        destination = os.path.normpath(os.path.join(target_dir, relative))
+        for filename in filenames:
+            if os.path.lexists(os.path.join(destination, filename)):
+                replaced.append(os.path.normpath(os.path.join(relative, filename)).replace(os.sep, "/"))
+    if replaced and not overwrite:
+        raise ArchiveError(f"Archive would overwrite existing files: {len(replaced)} file(s) already exist, "
+                           f"e.g. '{replaced[0]}'")
+    shutil.copytree(staging, target_dir, dirs_exist_ok=True)
+    return replaced
+
+
+def _member_path(staging, member_name):
+    """Map an archive member name to a path inside staging, rejecting traversal."""
+    parts = [part for part in member_name.replace("\\", "/").split("/") if part not in ("", ".")]
+    if not parts or member_name.startswith(("/", "\\")) or ":" in parts[0] or ".." in parts:
+        raise ArchiveError(f"Unsafe path in archive: {member_name!r}")
+    return os.path.join(staging, *parts)
+
+
+def _check_ratio(size, compressed, limits, member_name):
+    if size > RATIO_FLOOR and size > limits.max_ratio * max(compressed, 1):
+        raise ArchiveError(f"Compression ratio of {member_name!r} exceeds {limits.max_ratio:g}")
+
+
+def _extract_zip(archive_path, staging, limits, job):
+    with zipfile.ZipFile(archive_path) as archive:
+        members = archive.infolist()
+    if len(members) > limits.max_members:
+        raise ArchiveError(f"Archive has more than {limits.max_members} members")
+
+    files = []
+    paths = set()
+    total = 0
+    for info in members:
+        path = _member_path(staging, info.filename)
+        if stat.S_ISLNK(info.external_attr >> 16):
+            raise ArchiveError(f"Links are not allowed in archives: {info.filename!r}")
+        if info.is_dir():
+            os.makedirs(path, exist_ok=True)
+            continue
+        # Members are written concurrently, so two with one path would race.
+        if path in paths:
+            raise ArchiveError(f"Duplicate member in archive: {info.filename!r}")
+        paths.add(path)
+        _check_ratio(info.file_size, info.compress_size, limits, info.filename)
+        total += info.file_size
+        if total > limits.max_bytes:
+            raise ArchiveError(f"Archive expands to more than {limits.max_bytes} bytes")
+        files.append((info, path))
+
+    progress = _Progress(job, len(files), total)
+    local = threading.local()
+    handles = []
+
+    def write(member):
+        info, path = member
+        # zipfile reads never go past a member's declared file_size, so the
+        # limits checked above hold for the data actually written.
+        archive = getattr(local, "archive", None)
+        if archive is None:
+            archive = local.archive = zipfile.ZipFile(archive_path)
+            handles.append(archive)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with archive.open(info) as source, open(path, "wb") as target:
+            shutil.copyfileobj(source, target, COPY_BUFFER)
+        progress.add(info.file_size)
+
+    try:
+        with ThreadPoolExecutor(max_workers=limits.workers, thread_name_prefix="extract") as pool:
+            # list() re-raises the first error from a worker.
+            list(pool.map(write, files))
+    finally:
+        for archive in handles:
+            archive.close()
+    return progress.result()
+
+
+def _extract_tar_zst(archive_path, staging, limits, job):
+    try:
+        import zstandard
+    except ImportError:
+        raise ArchiveError("Extracting .tar.zst archives requires the zstandard package")
+    with open(archive_path, "rb") as file:
+        with zstandard.ZstdDecompressor().stream_reader(file) as stream:
+            with tarfile.open(fileobj=stream, mode="r|") as tar:
+                return _extract_tar(tar, os.path.getsize(archive_path), staging, limits, job)
+
+
+def _extract_tar(tar, archive_size, staging, limits, job):
+    # Member sizes are not known up front in streaming mode, so the limits
+    # are checked as members arrive.
+    progress = _Progress(job, None, None)
+    count = 0
+    for member in tar:
+        count += 1
+        if count > limits.max_members:
+            raise ArchiveError(f"Archive has more than {limits.max_members} members")
+        path = _member_path(staging, member.name)
+        if member.isdir():
+            os.makedirs(path, exist_ok=True)
+            continue
+        if not member.isfile():
+            raise ArchiveError(f"Only files and directories are allowed in archives: {member.name!r}")
+        if progress.bytes + member.size > limits.max_bytes:
+            raise ArchiveError(f"Archive expands to more than {limits.max_bytes} bytes")
+        _check_ratio(progress.bytes + member.size, archive_size, limits, member.name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with tar.extractfile(member) as source, open(path, "wb") as target:
+            shutil.copyfileobj(source, target, COPY_BUFFER)
+        os.utime(path, (member.mtime, member.mtime))
+        progress.add(member.size)
+    return progress.result()
+
+
+class _Progress:
+    """Thread-safe counters forwarded to a job."""
+
+    def __init__(self, job, total_files, total_bytes):
+        self.job = job
+        self.files = 0
+        self.bytes = 0
+        self._lock = threading.Lock()
+        if job is not None:
+            job.update(files=0, bytes=0, total_files=total_files, total_bytes=total_bytes)
+
+    def add(self, size):
+        with self._lock:
+            self.files += 1
+            self.bytes += size
+            if self.job is not None:
+                self.job.update(files=self.files, bytes=self.bytes)
+
+    def result(self):
+        return {"files": self.files, "bytes": self.bytes}
@@ -0,0 +1,269 @@
+"""Serve the Flask app from an ASGI server such as uvicorn.
+
+The routes stay synchronous; this adapter decides where their time is
+spent. A small request body is received on the event loop before the app
+sees it, and a response is sent on the event loop one chunk at a time, so
+a slow client does not hold a thread for either. A larger body is handed
+to the app as it arrives, without being copied to a temporary file first;
+the app's thread waits on the client while it reads, as it would have to
+while writing the body out anyway. Bodies over `max_body` are refused
+with 413, before the app runs when Content-Length says so, otherwise as
+soon as the limit is passed. The app itself runs on a bounded thread
+pool, which caps how many requests touch the disk at once; requests
+beyond that wait on the event loop instead of piling up in the kernel.
+
+asgiref's WsgiToAsgi is not used because it runs every request on a
+single thread.
+"""
+import asyncio
+import io
+import json
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.exceptions import ClientDisconnected, RequestEntityTooLarge
+
+# Request bodies up to this size are received before the app runs; larger ones are read by the app as they arrive.
+BUFFER_SIZE = 1024 * 1024
+# Block size for files sent with send_file().
+FILE_BLOCK_SIZE = 256 * 1024
+# Set by the ASGI server itself; forwarding the app's copies would send them twice.
+SERVER_HEADERS = ("date", "server")
+
+
+class AsgiAdapter:
+    """Wrap a WSGI application as an ASGI 3 application.
+
+    `max_body` is the largest request body accepted, in bytes; None for no limit.
+    """
+
+    def __init__(self, wsgi_app, max_threads=32, max_body=None):
+        self.wsgi_app = wsgi_app
+        self.max_threads = max_threads
+        self.max_body = max_body
+        self._executor = None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self._lifespan(receive, send)
+        elif scope["type"] == "http":
+            await self._http(scope, receive, send)
+        else:
+            raise ValueError(f"Unsupported ASGI scope type {scope['type']!r}")
+
+    @property
+    def executor(self):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_threads, thread_name_prefix="asgi")
+        return self._executor
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                if self._executor is not None:
+                    self._executor.shutdown(wait=False)
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def _http(self, scope, receive, send):
+        loop = asyncio.get_running_loop()
+        length = _content_length(scope)
+        if self.max_body is not None and length is not None and length > self.max_body:
+            await self._too_large(send)
+            return
+        if length is not None and length <= BUFFER_SIZE:
+            parts = []
+            received = 0
+            while True:
+                message = await receive()
+                if message["type"] == "http.disconnect":
+                    return
+                parts.append(message.get("body", b""))
+                received += len(parts[-1])
+                if self.max_body is not None and received > self.max_body:
+                    await self._too_large(send)
+                    return
+                if not message.get("more_body"):
+                    break
+            body = io.BytesIO(b"".join(parts))
+        else:
+            body = RequestBody(receive, loop, self.max_body)
+
+        # Bytes passed to the legacy write() callable, sent before the next chunk of the iterable.
+        written = []
+        response = {}
+
+        def start_response(status, headers, exc_info=None):
+            if exc_info and response.get("sent"):
+                raise exc_info[1].with_traceback(exc_info[2])
+            response["status"] = int(status.split(" ", 1)[0])
+            response["headers"] = [
+                (name.lower().encode("latin-1"), value.encode("latin-1")) for name, value in headers
+                if name.lower() not in SERVER_HEADERS
+            ]
+            return written.append
+
+        environ = build_environ(scope, body)
+        result = await loop.run_in_executor(self.executor, self.wsgi_app, environ, start_response)
+        chunks = iter(result)
+        try:
+            while True:
+                chunk = await loop.run_in_executor(self.executor, next, chunks, None)
+                if written:
+                    chunk = b"".join(written) + (chunk or b"")
+                    written.clear()
+                elif chunk is None:
+                    break
+                if not chunk:
+                    continue
+                if not response.get("sent"):
+                    await self._start(send, response)
+                await send({"type": "http.response.body", "body": chunk, "more_body": True})
+            if not response.get("sent"):
+                await self._start(send, response)
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+        finally:
+            close = getattr(result, "close", None)
+            if close is not None:
+                await loop.run_in_executor(self.executor, close)
+
+    async def _start(self, send, response):
+        response["sent"] = True
+        await send({"type": "http.response.start", "status": response["status"], "headers": response["headers"]})
+
+    async def _too_large(self, send):
+        body = json.dumps({"success": False, "error": f"Request body is larger than {self.max_body} bytes"}).encode()
+        await send({"type": "http.response.start", "status": 413, "headers": [
+            (b"content-type", b"application/json"), (b"content-length", str(len(body)).encode()),
+            (b"connection", b"close")]})
+        await send({"type": "http.response.body", "body": body, "more_body": False})
+
+
+class RequestBody(io.RawIOBase):
+    """wsgi.input that receives the body from the event loop as the app reads it.
+
+    Reads block the app's thread, never the loop. Raises ClientDisconnected
+    if the client goes away and RequestEntityTooLarge past `max_body`; both
+    are answered by Flask like any other HTTP error.
+    """
+
+    def __init__(self, receive, loop, max_body=None):
+        self._receive = receive
+        self._loop = loop
+        self.max_body = max_body
+        self.received = 0
+        self._chunk = memoryview(b"")
+        self._more = True
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        if not self._chunk and self._more:
+            self._next_chunk()
+        size = min(len(buffer), len(self._chunk))
+        buffer[:size] = self._chunk[:size]
+        self._chunk = self._chunk[size:]
+        return size
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            return self.readall()
+        if not self._chunk and self._more:
+            self._next_chunk()
+        # Whole chunks are passed on as they are, without a copy.
+        if size >= len(self._chunk):
+            data, self._chunk = self._chunk, memoryview(b"")
+            return data.obj if len(data) == len(data.obj) else data.tobytes()
+        data, self._chunk = self._chunk[:size].tobytes(), self._chunk[size:]
+        return data
+
+    def readall(self):
+        parts = []
+        while True:
+            data = self.read(BUFFER_SIZE)
+            if not data:
+                return b"".join(parts)
+            parts.append(data)
+
+    def _next_chunk(self):
+        while self._more and not self._chunk:
+            message = asyncio.run_coroutine_threadsafe(self._receive(), self._loop).result()
+            if message["type"] == "http.disconnect":
+                self._more = False
+                raise ClientDisconnected()
+            chunk = message.get("body", b"")
+            self.received += len(chunk)
+            if self.max_body is not None and self.received > self.max_body:
+                self._more = False
+                raise RequestEntityTooLarge()
+            self._chunk = memoryview(chunk)
+            self._more = message.get("more_body", False)
+
+
+class FileWrapper:
+    """wsgi.file_wrapper that reads in larger blocks, since every block costs a thread hop."""
+
+    def __init__(self, file, block_size=FILE_BLOCK_SIZE):
+        self.file = file
+        self.block_size = max(block_size, FILE_BLOCK_SIZE)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        data = self.file.read(self.block_size)
+        if not data:
+            raise StopIteration
+        return data
+
+    def close(self):
+        self.file.close()
+
+
+def _content_length(scope):
+    for name, value in scope.get("headers", []):
+        if name.lower() == b"content-length":
+            try:
+                return int(value)
+            except ValueError:
+                return None
+    return None
+
+
+def build_environ(scope, body):
+    """Return the PEP 3333 environ for an ASGI HTTP scope."""
+    server = scope.get("server") or ("localhost", 80)
+    client = scope.get("client") or ("", 0)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", "").encode("utf-8").decode("latin-1"),
+        "PATH_INFO": scope["path"].encode("utf-8").decode("latin-1"),
+        "QUERY_STRING": scope.get("query_string", b"").decode("latin-1"),
+        "SERVER_NAME": server[0],
+        "SERVER_PORT": str(server[1]),
+        "SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+        "REMOTE_ADDR": client[0],
+        "REMOTE_PORT": str(client[1]),
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": body,
+        "wsgi.input_terminated": True,
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": True,
+        "wsgi.run_once": False,
+        "wsgi.file_wrapper": FileWrapper,
+    }
+    for name, value in scope.get("headers", []):
+        name = name.decode("latin-1").upper().replace("-", "_")
+        value = value.decode("latin-1")
+        if name in ("CONTENT_TYPE", "CONTENT_LENGTH"):
+            environ[name] = value
+            continue
+        key = f"HTTP_{name}"
+        environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
@@ -0,0 +1,196 @@
+"""Password checks and login rate limiting.
+
+bcrypt is deliberately slow, so a burst of login attempts can keep every
+request thread busy hashing. Attempts are therefore rate limited per
+client address and per user name before any hashing happens, and the
+hashing itself runs on a small thread pool (bcrypt releases the GIL) with
+a bounded queue; when the queue is full the attempt is rejected at once
+instead of waiting.
+
+The buckets are kept in a small SQLite database shared by every worker,
+so the configured rate holds however many workers there are. Each bucket
+is updated by a single statement, which SQLite applies atomically across
+processes.
+"""
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import bcrypt
+
+_dummy_hash = None
+
+
+class LoginThrottled(Exception):
+    """Raised when an attempt is refused before checking the password."""
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = max(1, int(retry_after + 0.999))
+
+
+class RateLimiter:
+    """Token buckets holding up to `burst` attempts, refilled at `rate` per minute."""
+
+    def __init__(self, rate, burst=None, max_keys=100000):
+        self.rate = rate / 60.0
+        self.burst = float(burst or rate)
+        self.max_keys = max_keys
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def _tokens(self, key, now):
+        tokens, updated = self._buckets.get(key, (self.burst, now))
+        return min(self.burst, tokens + (now - updated) * self.rate)
+
+    def retry_after(self, key):
+        """Seconds until `key` may try again; 0 if it may try now."""
+        if not self.rate:
+            return 0
+        with self._lock:
+            tokens = self._tokens(key, time.monotonic())
+        return 0 if tokens >= 1 else (1 - tokens) / self.rate
+
+    def consume(self, key):
+        if not self.rate:
+            return
+        now = time.monotonic()
+        with self._lock:
+            self._buckets[key] = (self._tokens(key, now) - 1, now)
+            if len(self._buckets) > self.max_keys:
+                self._prune(now)
+
+    def _prune(self, now):
+        # Full buckets carry no state worth keeping.
+        for key in [key for key in self._buckets if self._tokens(key, now) >= self.burst]:
+            del self._buckets[key]
+        while len(self._buckets) > self.max_keys:
+            self._buckets.pop(next(iter(self._buckets)))
+
+
+class SharedRateLimiter(RateLimiter):
+    """RateLimiter whose buckets live in the SQLite database at `db_path`, under `scope`."""
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS buckets (
+        scope TEXT NOT NULL,
+        key TEXT NOT NULL,
+        tokens REAL NOT NULL,
+        updated REAL NOT NULL,
+        PRIMARY KEY (scope, key)
+    );
+    """
+    # Full buckets are dropped every this many attempts.
+    PRUNE_EVERY = 1000
+
+    def __init__(self, db_path, scope, rate, burst=None, max_keys=100000):
+        super().__init__(rate, burst, max_keys)
+        self.db_path = db_path
+        self.scope = scope
+        self._local = threading.local()
+        self._consumed = 0
+        self._connect().executescript(self.SCHEMA)
+
+    def _connect(self):
+        # Connections do not survive a fork, and each thread needs its own.
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = self._local.conn = sqlite3.connect(self.db_path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.pid = os.getpid()
+        return conn
+
+    def retry_after(self, key):
+        if not self.rate:
+            return 0
+        # Wall-clock time, since the buckets are shared with other processes.
+        now = time.time()
+        row = self._connect().execute("SELECT tokens, updated FROM buckets WHERE scope = ? AND key = ?",
+                                      (self.scope, key)).fetchone()
+        tokens = self.burst if row is None else min(self.burst, row[0] + (now - row[1]) * self.rate)
+        return 0 if tokens >= 1 else (1 - tokens) / self.rate
+
+    def consume(self, key):
+        if not self.rate:
+            return
+        conn = self._connect()
+        conn.execute(
+            "INSERT INTO buckets (scope, key, tokens, updated) VALUES (?, ?, ? - 1, ?) "
+            "ON CONFLICT (scope, key) DO UPDATE SET "
+            "tokens = MIN(?, tokens + (excluded.updated - updated) * ?) - 1, updated = excluded.updated",
+            (self.scope, key, self.burst, time.time(), self.burst, self.rate))
+        self._consumed += 1
+        if self._consumed % self.PRUNE_EVERY == 0:
+            self._prune(time.time())
+
+    def _prune(self, now):
+        conn = self._connect()
+        conn.execute("DELETE FROM buckets WHERE scope = ? AND tokens + (? - updated) * ? >= ?",
+                     (self.scope, now, self.rate, self.burst))
+        conn.execute("DELETE FROM buckets WHERE scope = ? AND key IN (SELECT key FROM buckets WHERE scope = ? "
+                     "ORDER BY updated DESC LIMIT -1 OFFSET ?)", (self.scope, self.scope, self.max_keys))
+
+
+class PasswordChecker:
+    """Verify passwords on a bounded thread pool, applying the login rate limits.
+
+    Every attempt counts against its client address; only failed attempts
+    count against the user name, so a user locked out by someone else's
+    guesses gets back in once the guessing stops.
+    """
+
+    def __init__(self, workers=2, queue=16, per_ip=10, per_user=5, db_path=None):
+        self.workers = workers
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bcrypt")
+        self._slots = threading.BoundedSemaphore(workers + queue)
+        if db_path:
+            self.by_ip = SharedRateLimiter(db_path, "ip", per_ip)
+            self.by_user = SharedRateLimiter(db_path, "user", per_user)
+        else:
+            self.by_ip = RateLimiter(per_ip)
+            self.by_user = RateLimiter(per_user)
+
+    @classmethod
+    def from_config(cls, config, db_path=None):
+        """`db_path` is the SQLite database the rate limits are shared through; None keeps them in memory."""
+        return cls(
+            workers=int(config.get("bcrypt_workers", 2)),
+            queue=int(config.get("bcrypt_queue", 16)),
+            per_ip=float(config.get("login_rate_per_ip", 10)),
+            per_user=float(config.get("login_rate_per_user", 5)),
+            db_path=db_path,
+        )
+
+    def check(self, users, username, password, client):
+        """Return True if the password matches; raise LoginThrottled when refused."""
+        wait = max(self.by_ip.retry_after(client), self.by_user.retry_after(username))
+        if wait:
+            raise LoginThrottled("Too many login attempts; try again later", wait)
+        self.by_ip.consume(client)
+        if not self._slots.acquire(blocking=False):
+            raise LoginThrottled("Too many logins in progress; try again shortly", 1)
+        try:
+            hashed = users.get(username) or _unknown_user_hash()
+            valid = self._executor.submit(
+                bcrypt.checkpw, password.encode("utf-8"), hashed.encode("utf-8")).result()
+        finally:
+            self._slots.release()
+        valid = valid and username in users
+        if not valid:
+            self.by_user.consume(username)
+        return valid
+
+    def hash(self, password):
+        """Hash a new password on the pool."""
+        return self._executor.submit(bcrypt.hashpw, password.encode("utf-8"), bcrypt.gensalt()).result().decode("utf-8")
+
+
+def _unknown_user_hash():
+    """A hash checked for unknown users, so that they take as long as known ones."""
+    global _dummy_hash
+    if _dummy_hash is None:
+        _dummy_hash = bcrypt.hashpw(b"caddy-web-ui", bcrypt.gensalt()).decode("utf-8")
+    return _dummy_hash
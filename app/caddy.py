@@ -0,0 +1,441 @@
+"""Backends that push a Caddyfile to the running Caddy server.
+
+AdminApiBackend talks to Caddy's admin endpoint over a pooled HTTP session:
+the Caddyfile is adapted by Caddy itself, compared with the running config
+and, when only one site route changed, just that route is PATCHed (or
+inserted / deleted). Anything else is sent as a full /load. When the admin
+endpoint cannot be reached it falls back to the `caddy` command line.
+Relative imports are made absolute before the text is sent, because
+/adapt does not know where the Caddyfile lives.
+
+FleetBackend wraps the local backend for a fleet of Caddy servers: the
+Caddyfile is adapted once and the result is pushed to every remote admin
+endpoint at the same time, with each node's outcome and latency reported.
+"""
+import copy
+import hashlib
+import json
+import logging
+import os
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from app import metrics
+from app.caddyfile import absolute_imports
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_ADMIN_URL = "http://localhost:2019"
+
+
+class CaddyError(RuntimeError):
+    """Raised when Caddy rejects a config or cannot be reached at all."""
+
+
+class FleetError(CaddyError):
+    """Raised when some Caddy nodes did not take a config; `result` has every node's outcome."""
+
+    def __init__(self, message, result):
+        super().__init__(message)
+        self.result = result
+
+
+class CliBackend:
+    """Run the `caddy` binary for every operation."""
+
+    name = "cli"
+
+    def __init__(self, caddy_bin="caddy", timeout=60):
+        self.caddy_bin = caddy_bin
+        self.timeout = timeout
+
+    def _run(self, *args, input=None):
+        try:
+            result = subprocess.run([self.caddy_bin, *args], input=input, capture_output=True, text=True,
+                                    timeout=self.timeout)
+        except (OSError, subprocess.TimeoutExpired) as e:
+            raise CaddyError(f"Could not run {self.caddy_bin} {args[0]}: {e}") from e
+        if result.returncode != 0:
+            output = (result.stderr or result.stdout).strip()
+            raise CaddyError(f"{self.caddy_bin} {args[0]} exited with status {result.returncode}: {output}")
+        return result
+
+    def format(self, text):
+        """Return Caddyfile text as `caddy fmt` lays it out."""
+        return self._run("fmt", "-", input=text).stdout
+
+    def validate(self, caddyfile_path):
+        self._run("validate", "--config", caddyfile_path, "--adapter", "caddyfile")
+
+    def adapt_file(self, caddyfile_path):
+        """Convert a Caddyfile to Caddy's JSON config."""
+        result = self._run("adapt", "--config", caddyfile_path, "--adapter", "caddyfile")
+        try:
+            return json.loads(result.stdout)
+        except ValueError as e:
+            raise CaddyError(f"{self.caddy_bin} adapt printed invalid JSON: {e}") from e
+
+    def reload(self, caddyfile_path):
+        self._run("reload", "--config", caddyfile_path, "--adapter", "caddyfile")
+        return {"backend": self.name, "method": "reload"}
+
+
+class AdminApiBackend:
+    """Push config through Caddy's admin API, falling back to the CLI."""
+
+    name = "admin"
+
+    def __init__(self, admin_url=DEFAULT_ADMIN_URL, timeout=10, fallback=None):
+        self.admin_url = admin_url.rstrip("/")
+        self.timeout = timeout
+        self.fallback = fallback or CliBackend()
+        self.session = requests.Session()
+        self.session.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=8))
+        self.session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=8))
+
+    def _request(self, method, path, **kwargs):
+        response = self.session.request(method, self.admin_url + path, timeout=self.timeout, **kwargs)
+        if response.status_code >= 400:
+            try:
+                message = response.json().get("error", response.text)
+            except ValueError:
+                message = response.text
+            raise CaddyError(f"{method} {path} failed with {response.status_code}: {message.strip()}")
+        return response
+
+    def adapt(self, caddyfile_text, directory=None):
+        """Let Caddy convert Caddyfile text to its JSON config.
+
+        `directory` is where the Caddyfile lives; relative imports are
+        resolved against it, since /adapt never sees the file's path.
+        """
+        if directory is not None:
+            caddyfile_text = absolute_imports(caddyfile_text, directory)
+        response = self._request("POST", "/adapt", data=caddyfile_text.encode("utf-8"),
+                                 headers={"Content-Type": "text/caddyfile"})
+        body = response.json()
+        for warning in body.get("warnings") or []:
+            logger.warning("Caddyfile warning: %s", warning)
+        return body["result"]
+
+    def running_config(self):
+        return self._request("GET", "/config/").json() or {}
+
+    def format(self, text):
+        return self.fallback.format(text)
+
+    def validate(self, caddyfile_path):
+        # /adapt and /load validate the config themselves, and Caddy keeps
+        # the running config when a load fails.
+        pass
+
+    def reload(self, caddyfile_path):
+        with open(caddyfile_path, "r", encoding="utf-8") as file:
+            text = file.read()
+        try:
+            return self.push(self.adapt(text, os.path.dirname(os.path.abspath(caddyfile_path))))
+        except requests.ConnectionError as e:
+            logger.warning(f"Caddy admin API at {self.admin_url} unreachable, using the CLI: {e}")
+            return self.fallback.reload(caddyfile_path)
+        except requests.RequestException as e:
+            raise CaddyError(f"Caddy admin API request failed: {e}") from e
+
+
+    def push(self, adapted):
+        """Make the running config equal `adapted`, patching a single route when that is enough."""
+        running = self.running_config()
+        if running == adapted:
+            return {"backend": self.name, "method": "unchanged"}
+        change = route_change(running, adapted)
+        if change is None:
+            self._request("POST", "/load", json=adapted)
+            return {"backend": self.name, "method": "load"}
+        method, path, value = change
+        if method == "DELETE":
+            self._request(method, path)
+        else:
+            self._request(method, path, json=value)
+        return {"backend": self.name, "method": method.lower(), "path": path}
+
+
+class FleetBackend:
+    """Reload the local Caddy and push the same config to remote Caddy nodes concurrently.
+
+    `local` is the backend for the Caddy on this machine, or None when there
+    is none; `nodes` is a list of (name, AdminApiBackend). A reload only
+    succeeds when every node took the config; otherwise FleetError lists
+    which ones did not. Nodes that missed a reload catch up on the next
+    one, since every push sends the whole adapted config.
+    """
+
+    name = "fleet"
+
+    def __init__(self, local, nodes, workers=8):
+        self.local = local
+        self.nodes = nodes
+        self.workers = max(1, min(workers, len(nodes) + 1))
+        self._executor = None
+        self._pid = None
+
+    def _pool(self):
+        # Threads do not survive a fork, so a gunicorn worker starts its own.
+        if self._executor is None or self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="caddy-node")
+        return self._executor
+
+    def format(self, text):
+        return self.local.format(text) if self.local is not None else text
+
+    def validate(self, caddyfile_path):
+        if self.local is not None:
+            self.local.validate(caddyfile_path)
+
+    def adapt(self, caddyfile_path, text):
+        """Adapt the Caddyfile once, with the local Caddy or else the first node that answers."""
+        directory = os.path.dirname(os.path.abspath(caddyfile_path))
+        if isinstance(self.local, AdminApiBackend):
+            try:
+                return self.local.adapt(text, directory)
+            except requests.ConnectionError:
+                return self.local.fallback.adapt_file(caddyfile_path)
+        if self.local is not None:
+            return self.local.adapt_file(caddyfile_path)
+        unreachable = []
+        for name, node in self.nodes:
+            try:
+                return node.adapt(text, directory)
+            except requests.ConnectionError as e:
+                unreachable.append(f"{name}: {e}")
+        raise CaddyError("No Caddy node could adapt the Caddyfile: " + "; ".join(unreachable))
+
+    def reload(self, caddyfile_path):
+        with open(caddyfile_path, "r", encoding="utf-8") as file:
+            text = file.read()
+        try:
+            adapted = self.adapt(caddyfile_path, text)
+        except requests.RequestException as e:
+            raise CaddyError(f"Adapting the Caddyfile failed: {e}") from e
+
+        pool = self._pool()
+        futures = []
+        if self.local is not None:
+            futures.append(pool.submit(_timed_push, "local", self.local.reload, caddyfile_path))
+        for name, node in self.nodes:
+            futures.append(pool.submit(_timed_push, name, node.push, adapted))
+        nodes = [future.result() for future in futures]
+
+        result = {"backend": self.name, "nodes": nodes}
+        failed = [node for node in nodes if node["status"] == "failed"]
+        if failed:
+            raise FleetError(f"{len(failed)} of {len(nodes)} Caddy nodes failed: " +
+                             "; ".join(f"{node['node']}: {node['error']}" for node in failed), result)
+        return result
+
+    def status(self):
+        """Reachability, latency and a digest of the running config of every node."""
+        def probe(name, backend):
+            started = time.perf_counter()
+            try:
+                config = backend.running_config()
+                digest = hashlib.sha256(json.dumps(config, sort_keys=True).encode("utf-8")).hexdigest()
+                return {"node": name, "url": backend.admin_url, "reachable": True, "config_sha256": digest,
+                        "seconds": round(time.perf_counter() - started, 4)}
+            except (CaddyError, requests.RequestException) as e:
+                return {"node": name, "url": backend.admin_url, "reachable": False, "error": str(e),
+                        "seconds": round(time.perf_counter() - started, 4)}
+
+        targets = list(self.nodes)
+        if isinstance(self.local, AdminApiBackend):
+            targets.insert(0, ("local", self.local))
+        pool = self._pool()
+        return [future.result() for future in [pool.submit(probe, name, backend) for name, backend in targets]]
+
+
+def _timed_push(name, push, argument):
+    started = time.perf_counter()
+    try:
+        outcome = {"node": name, "status": "succeeded", "result": push(argument)}
+    except (CaddyError, requests.RequestException) as e:
+        logger.warning(f"Pushing config to Caddy node {name} failed: {e}")
+        outcome = {"node": name, "status": "failed", "error": str(e)}
+    seconds = time.perf_counter() - started
+    metrics.node_push_duration.observe(seconds, node=name, outcome=outcome["status"])
+    outcome["seconds"] = round(seconds, 4)
+    return outcome
+
+
+def _servers(config):
+    return ((config or {}).get("apps") or {}).get("http", {}).get("servers") or {}
+
+
+def _without_routes(config):
+    config = copy.deepcopy(config or {})
+    for server in _servers(config).values():
+        server.pop("routes", None)
+    return config
+
+
+def _list_change(old, new):
+    """Describe the difference between two route lists as one PATCH, PUT or DELETE."""
+    prefix = 0
+    while prefix < min(len(old), len(new)) and old[prefix] == new[prefix]:
+        prefix += 1
+    if len(new) == len(old) and old[prefix + 1:] == new[prefix + 1:]:
+        return "PATCH", prefix, new[prefix]
+    if len(new) == len(old) + 1 and old[prefix:] == new[prefix + 1:]:
+        return "PUT", prefix, new[prefix]
+    if len(new) == len(old) - 1 and old[prefix + 1:] == new[prefix:]:
+        return "DELETE", prefix, None
+    return None
+
+
+def route_change(running, adapted):
+    """Return (method, path, value) when `adapted` differs from `running` in a single route.
+
+    Returns None when anything else differs and the whole config has to be
+    loaded.
+    """
+    running_servers, adapted_servers = _servers(running), _servers(adapted)
+    if not running_servers or running_servers.keys() != adapted_servers.keys():
+        return None
+    if _without_routes(running) != _without_routes(adapted):
+        return None
+    change = None
+    for name, server in adapted_servers.items():
+        old = running_servers[name].get("routes") or []
+        new = server.get("routes") or []
+        if old == new:
+            continue
+        if change is not None:
+            return None
+        diff = _list_change(old, new)
+        if diff is None:
+            return None
+        method, index, value = diff
+        change = (method, f"/config/apps/http/servers/{name}/routes/{index}", value)
+    return change
+
+
+class ReloadQueue:
+    """Coalesce reload requests into a single background validate + reload.
+
+    A request joins the reload already waiting for the same Caddyfile and
+    pushes it back by `window` seconds, but never past `max_delay` seconds
+    after the first request, so a steady stream of edits still reloads.
+    The file is not touched here; `caddy fmt` only runs when a reload is
+    asked for explicitly (see app.utils.format_caddyfile).
+    """
+
+    def __init__(self, jobs, get_backend, window=0.5, max_delay=5.0):
+        self.jobs = jobs
+        self.get_backend = get_backend
+        self.window = window
+        self.max_delay = max_delay
+        self._pending = {}
+        self._cond = threading.Condition()
+        self._thread = None
+        self._pid = None
+
+    def request(self, caddyfile_path, delay=None):
+        """Schedule a reload and return its Job; `delay=0` runs it as soon as possible."""
+        delay = self.window if delay is None else delay
+        now = time.monotonic()
+        with self._cond:
+            self._ensure_worker()
+            entry = self._pending.get(caddyfile_path)
+            if entry is None:
+                job = self.jobs.create("reload", caddyfile=caddyfile_path, requests=0)
+                entry = self._pending[caddyfile_path] = {"job": job, "first": now, "deadline": now + delay}
+            if delay == 0:
+                entry["deadline"] = now
+            elif entry["deadline"] > now:
+                entry["deadline"] = min(max(entry["deadline"], now + delay), entry["first"] + self.max_delay)
+            entry["job"].info["requests"] += 1
+            self._cond.notify()
+            return entry["job"]
+
+    def _ensure_worker(self):
+        # Threads do not survive a fork, so a gunicorn worker starts its own.
+        if self._thread is None or not self._thread.is_alive() or self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name="caddy-reload", daemon=True)
+            self._thread.start()
+
+    def _next(self):
+        with self._cond:
+            while True:
+                if not self._pending:
+                    self._cond.wait()
+                    continue
+                path, entry = min(self._pending.items(), key=lambda item: item[1]["deadline"])
+                remaining = entry["deadline"] - time.monotonic()
+                if remaining <= 0:
+                    del self._pending[path]
+                    return path, entry["job"]
+                self._cond.wait(remaining)
+
+    def _run(self):
+        while True:
+            path, job = self._next()
+            self._execute(path, job)
+
+    def _execute(self, caddyfile_path, job):
+        job.start()
+        started = time.perf_counter()
+        try:
+            backend = self.get_backend()
+            backend.validate(caddyfile_path)
+            result = backend.reload(caddyfile_path)
+            metrics.reload_duration.observe(time.perf_counter() - started, outcome="success")
+            job.succeed(result)
+        except Exception as e:
+            metrics.reload_duration.observe(time.perf_counter() - started, outcome="failure")
+            logger.error(f"Reloading Caddy failed: {e}")
+            job.fail(e, result=getattr(e, "result", None))
+
+
+_backends = {}
+_backends_lock = threading.Lock()
+
+
+def reload_backend(config):
+    """Return the shared backend selected by config.json.
+
+    `reload_backend` is "admin" (default) or "cli"; `caddy_admin` is the
+    admin endpoint and `caddy_bin` the binary used by the CLI backend.
+    `caddy_nodes` lists remote admin endpoints (URLs, or objects with
+    "name" and "admin") that every reload is also pushed to, by up to
+    `node_workers` threads; set `local_caddy` to false when no Caddy runs
+    on this machine.
+    """
+    kind = config.get("reload_backend", "admin")
+    admin_url = config.get("caddy_admin", DEFAULT_ADMIN_URL)
+    caddy_bin = config.get("caddy_bin", "caddy")
+    nodes = tuple(_node_spec(node) for node in config.get("caddy_nodes") or ())
+    local = bool(config.get("local_caddy", True))
+    workers = int(config.get("node_workers", 8))
+    key = (kind, admin_url, caddy_bin, nodes, local, workers)
+    with _backends_lock:
+        backend = _backends.get(key)
+        if backend is None:
+            cli = CliBackend(caddy_bin)
+            backend = AdminApiBackend(admin_url, fallback=cli) if kind == "admin" else cli
+            if nodes:
+                backend = FleetBackend(backend if local else None,
+                                       [(name, AdminApiBackend(url)) for name, url in nodes], workers)
+            _backends[key] = backend
+        return backend
+
+
+def _node_spec(node):
+    """Return (name, admin URL) for an entry of `caddy_nodes`."""
+    if isinstance(node, str):
+        return urlsplit(node).netloc or node, node
+    return node.get("name") or urlsplit(node["admin"]).netloc, node["admin"]
@@ -0,0 +1,734 @@
+"""Caddyfile tokenizer, parser and span-based editor.
+
+Parsing happens in two passes. The top-level pass only looks for the
+characters that can change the structure of the file (standalone braces,
+quotes, heredocs and comments) and records the span of every top-level
+block: global options, snippets, named routes, imports and sites. That is
+enough to list sites and to splice edits into the original text, so the
+rest of the file is never re-serialized. The directive tree of a block is
+tokenized on demand from its span.
+
+Spans are character offsets into the decoded file text.
+"""
+import gc
+import glob
+import os
+import re
+from contextlib import contextmanager
+
+# Each alternative starts with its character and checks what precedes it
+# afterwards, so the regex engine can skip ahead to the next candidate
+# character instead of trying a match at every position.
+_STRUCTURE_RE = re.compile(r"""
+    \{(?<!\S\{)(?!\S)(?P<open>)
+  | \}(?<!\S\})(?!\S)(?P<close>)
+  | \#(?<!\S\#)(?P<comment>[^\n]*)
+  | "(?<!\S")(?P<quote>(?:[^"\\]|\\.)*")
+  | `(?<!\S`)(?P<backtick>[^`]*`)
+  | <(?<!\S<)<(?P<heredoc>[A-Za-z0-9_-]+)(?=\r?\n)
+""", re.X | re.S)
+
+_TOKEN_RE = re.compile(r"""
+    (?P<nl>\n)
+  | (?P<ws>[ \t\r]+|\\\r?\n)
+  | (?P<comment>\#[^\n]*)
+  | <<(?P<heredoc>[A-Za-z0-9_-]+)(?=\r?\n)
+  | "(?P<quote>(?:[^"\\]|\\.)*)"
+  | `(?P<backtick>[^`]*)`
+  | (?P<word>\S+)
+""", re.X | re.S)
+
+# An unindented line that might open or close a block: it has a brace, quote or comment.
+_COLUMN0_RE = re.compile(r"\n(?:[{}\"\#]|[^\s][^\n{}\"\#]*[{}\"\#])")
+
+_INDENT_RE = re.compile(r"\n([ \t]+)\S")
+
+# `import <pattern>` at the start of a line; the pattern may be quoted.
+_IMPORT_RE = re.compile(r"""^[ \t]*import[ \t]+(?P<arg>"(?:[^"\\\n]|\\.)*"|[^\s"`]+)""", re.M)
+
+_HEREDOC_OPEN_RE = re.compile(r"(?<!\S)<<([A-Za-z0-9_-]+)$")
+
+
+@contextmanager
+def gc_paused():
+    """Hold off the cyclic garbage collector while building many small objects.
+
+    Parsing a large file allocates a few objects per block; every few
+    hundred of them would otherwise start a collection that walks
+    everything else the process keeps alive, including the previously
+    cached parse.
+    """
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+
+class CaddyfileError(ValueError):
+    """Raised when a Caddyfile cannot be parsed or an edit is invalid."""
+
+    def __init__(self, message, line=None):
+        if line is not None:
+            message = f"{message} (line {line})"
+        super().__init__(message)
+        self.line = line
+
+
+class Token:
+    __slots__ = ("text", "line", "start", "end", "quoted")
+
+    def __init__(self, text, line, start, end, quoted=False):
+        self.text = text
+        self.line = line
+        self.start = start
+        self.end = end
+        self.quoted = quoted
+
+    def __repr__(self):
+        return f"Token({self.text!r}, line={self.line})"
+
+
+class Directive:
+    """A directive line with its arguments and an optional nested block."""
+
+    __slots__ = ("name", "args", "line", "start", "end", "children")
+
+    def __init__(self, tokens, children=None, end=None):
+        self.name = tokens[0].text
+        self.args = [t.text for t in tokens[1:]]
+        self.line = tokens[0].line
+        self.start = tokens[0].start
+        self.end = end if end is not None else tokens[-1].end
+        self.children = children
+
+    def __repr__(self):
+        return f"Directive({self.name!r}, {self.args!r}, children={self.children!r})"
+
+
+def _heredoc_end(text, pos, marker):
+    """Match the line closing the heredoc `marker` that starts at pos, or None."""
+    return re.compile(rf"^([ \t]*){re.escape(marker)}(?!\S)", re.M).search(text, pos)
+
+
+def tokenize(text, start=0, end=None, line=1):
+    """Split text[start:end] into tokens.
+
+    Newlines are yielded as None so callers can group tokens into lines.
+    """
+    end = len(text) if end is None else end
+    pos = start
+    match_token = _TOKEN_RE.match
+    while pos < end:
+        m = match_token(text, pos, end)
+        kind = m.lastgroup
+        if kind == "nl":
+            yield None
+            line += 1
+        elif kind == "ws":
+            if m.group().startswith("\\"):
+                line += 1
+        elif kind == "comment":
+            pass
+        elif kind == "heredoc":
+            marker = m.group(kind)
+            body_start = text.index("\n", m.end()) + 1
+            closing = _heredoc_end(text, body_start, marker)
+            if closing is None:
+                raise CaddyfileError(f"Unterminated heredoc <<{marker}", line)
+            indent = closing.group(1)
+            body = text[body_start:closing.start()].splitlines()
+            value = "\n".join(l[len(indent):] if l.startswith(indent) else l for l in body)
+            yield Token(value, line, m.start(), closing.end(), quoted=True)
+            line += text.count("\n", m.start(), closing.end())
+            pos = closing.end()
+            continue
+        elif kind == "quote":
+            yield Token(m.group(kind).replace('\\"', '"'), line, m.start(), m.end(), quoted=True)
+            line += m.group().count("\n")
+        elif kind == "backtick":
+            yield Token(m.group(kind), line, m.start(), m.end(), quoted=True)
+            line += m.group().count("\n")
+        else:
+            yield Token(m.group(), line, m.start(), m.end())
+        pos = m.end()
+
+
+def parse_directives(text, start=0, end=None, line=1):
+    """Parse text[start:end] into a tree of Directive objects."""
+    tokens = tokenize(text, start, end, line)
+    directives, closed = _parse_lines(tokens)
+    if closed is not None:
+        raise CaddyfileError("Unexpected '}'", closed.line)
+    return directives
+
+
+def _parse_lines(tokens):
+    directives = []
+    current = []
+    for token in tokens:
+        if token is not None:
+            if not token.quoted and token.text == "}" and not current:
+                return directives, token
+            current.append(token)
+            continue
+        if not current:
+            continue
+        if not current[-1].quoted and current[-1].text == "{":
+            opener = current.pop()
+            children, closed = _parse_lines(tokens)
+            if closed is None:
+                raise CaddyfileError("Unclosed '{'", opener.line)
+            if current:
+                directives.append(Directive(current, children, closed.end))
+            else:
+                raise CaddyfileError("Block without a directive", opener.line)
+        else:
+            directives.append(Directive(current))
+        current = []
+    if current:
+        directives.append(Directive(current))
+    return directives, None
+
+
+class Block:
+    """A top-level block of the Caddyfile and its location in the source.
+
+    `kind` is one of "global", "snippet", "named_route", "site", "import"
+    or "directive". `lead` is where the comment lines directly above the
+    block start, `start` is the start of its first key line and `end` is
+    just past its closing brace (or the end of its line for blocks
+    without a body).
+    """
+
+    __slots__ = ("doc", "kind", "keys", "lead", "start", "open", "end", "_line")
+
+    def __init__(self, doc, kind, keys, lead, start, open_, end):
+        self.doc = doc
+        self.kind = kind
+        self.keys = keys
+        self.lead = lead
+        self.start = start
+        self.open = open_
+        self.end = end
+        self._line = None
+
+    @property
+    def line(self):
+        if self._line is None:
+            self.doc._number_lines()
+        return self._line
+
+    @property
+    def domain(self):
+        return " ".join(self.keys)
+
+    @property
+    def addresses(self):
+        if len(self.keys) == 1 and "," not in self.keys[0]:
+            return list(self.keys)
+        return [address for key in self.keys for address in key.split(",") if address]
+
+    @property
+    def key_text(self):
+        if self.open is None:
+            return self.doc.text[self.start:_line_end(self.doc.text, self.start)].strip()
+        return self.doc.text[self.start:self.open].rstrip()
+
+    @property
+    def body_span(self):
+        if self.open is None:
+            if self.kind != "site":
+                return self.end, self.end
+            # A braceless site runs from the line after its address to the end of the file.
+            return _line_end(self.doc.text, self.start), self.end
+        return self.open + 1, self.end - 1
+
+    @property
+    def body(self):
+        start, end = self.body_span
+        return self.doc.text[start:end]
+
+    @property
+    def config(self):
+        """Non-empty body lines with surrounding whitespace stripped."""
+        return [line for line in map(str.strip, self.body.splitlines()) if line]
+
+    @property
+    def source(self):
+        return self.doc.text[self.start:self.end]
+
+    @property
+    def directives(self):
+        start, end = self.body_span
+        line = self.line + self.doc.text.count("\n", self.start, start)
+        return parse_directives(self.doc.text, start, end, line)
+
+    def check(self):
+        """Raise CaddyfileError if the body is not a balanced directive tree."""
+        parse_directives(self.doc.text, *self.body_span)
+
+    def as_dict(self):
+        """A plain dict copy of the site: "domain", "config", "addresses" and "line"."""
+        return {"domain": self.domain, "config": self.config, "addresses": self.addresses, "line": self.line}
+
+    def __repr__(self):
+        return f"Block({self.kind!r}, {self.domain!r}, line={self.line})"
+
+
+class Caddyfile:
+    """A parsed Caddyfile that can produce edited copies of its text."""
+
+    def __init__(self, text):
+        self.text = text
+        self.blocks = _Scanner(self).scan()
+
+    def _number_lines(self):
+        line, pos = 1, 0
+        for block in self.blocks:
+            line += self.text.count("\n", pos, block.start)
+            pos = block.start
+            block._line = line
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "r", encoding="utf-8") as file:
+            return cls(file.read())
+
+    @property
+    def sites(self):
+        return [b for b in self.blocks if b.kind == "site"]
+
+    @property
+    def indent(self):
+        """One level of indentation as the file uses it; a tab, like `caddy fmt`, if nothing is indented."""
+        match = _INDENT_RE.search(self.text)
+        if match is None or match.group(1).startswith("\t"):
+            return "\t"
+        return match.group(1)
+
+    def find_site(self, domain):
+        """Return the first site block whose key text or one of its addresses is `domain`."""
+        fallback = None
+        for block in self.blocks:
+            if block.kind != "site":
+                continue
+            if block.domain == domain:
+                return block
+            if fallback is None and domain in block.addresses:
+                fallback = block
+        return fallback
+
+    def rewrite(self, changes=None, additions=()):
+        """Return the file text with site blocks replaced, removed or appended.
+
+        `changes` maps a site domain to its new config lines, or to None to
+        remove every block of that domain. `additions` is a list of
+        (domain, config) pairs appended at the end of the file. Text outside
+        the affected spans is copied through unchanged.
+        """
+        changes = dict(changes or {})
+        text = self.text
+        indent = self.indent
+        pieces = []
+        pos = 0
+        replaced = set()
+        for block in self.blocks:
+            if block.kind != "site" or block.domain not in changes:
+                continue
+            # The fast scan trusts indentation; make sure the span really is one block.
+            block.check()
+            config = changes[block.domain]
+            if config is None:
+                start, end = block.lead, _line_end(text, block.end)
+                if _is_blank_before(text, start) and _is_blank_after(text, end):
+                    end = _line_end(text, end)
+                pieces.append(text[pos:start])
+                pos = end
+            elif block.domain not in replaced:
+                pieces.append(text[pos:block.start])
+                pieces.append(render_block(block.key_text, config, indent))
+                pos = block.end
+                replaced.add(block.domain)
+        pieces.append(text[pos:])
+
+        missing = set(changes) - {b.domain for b in self.blocks if b.kind == "site"}
+        if missing:
+            raise CaddyfileError(f"Site '{sorted(missing)[0]}' not found")
+
+        result = "".join(pieces)
+        if not additions:
+            return result
+        out = [result.rstrip("\n")] if result.strip() else []
+        out.extend(render_block(domain, config, indent) for domain, config in additions)
+        return "\n\n".join(out) + "\n"
+
+    def add_site(self, domain, config):
+        return self.rewrite(additions=[(domain, config)])
+
+    def replace_site(self, domain, config):
+        return self.rewrite({domain: config})
+
+    def remove_site(self, domain):
+        return self.rewrite({domain: None})
+
+
+def render_block(key_text, config, indent="\t"):
+    """Render a block from its key text and config lines, indenting nested blocks.
+
+    Tabs by default, as `caddy fmt` writes, so a formatted file stays formatted.
+    """
+    lines = [f"{key_text} {{"]
+    depth = 1
+    heredoc = None
+    for line in config:
+        line = line.strip()
+        if not line:
+            continue
+        if heredoc is not None:
+            lines.append(indent * depth + line)
+            if line.split()[0] == heredoc:
+                heredoc = None
+            continue
+        marker = _HEREDOC_OPEN_RE.search(line)
+        if marker:
+            heredoc = marker.group(1)
+        if line == "}":
+            depth -= 1
+            if depth < 1:
+                raise CaddyfileError(f"Unbalanced '}}' in config for '{key_text}'")
+        lines.append(indent * depth + line)
+        if not line.startswith("#") and (line == "{" or line.endswith((" {", "\t{"))):
+            depth += 1
+    if depth != 1:
+        raise CaddyfileError(f"Unclosed '{{' in config for '{key_text}'")
+    lines.append("}")
+    rendered = "\n".join(lines)
+    blocks = Caddyfile(rendered).blocks
+    if len(blocks) != 1 or blocks[0].open is None:
+        raise CaddyfileError(f"Config for '{key_text}' does not form a single block")
+    return rendered
+
+
+def absolute_imports(text, directory):
+    """Return text with relative file imports made absolute against `directory`.
+
+    Caddy resolves `import some/file` relative to the file that holds it,
+    but Caddyfile text sent to the admin API's /adapt has no file, so the
+    paths would resolve against Caddy's working directory instead. Snippet
+    names and patterns that match no file under `directory` are left alone.
+    Files that use heredocs or backticks are tokenized in full, so an
+    `import` line inside a string is never rewritten.
+    """
+    if "import" not in text:
+        return text
+    if "<<" in text or "`" in text:
+        spans = []
+        first = True
+        tokens = tokenize(text)
+        for token in tokens:
+            if token is None:
+                first = True
+                continue
+            if first and token.text == "import" and not token.quoted:
+                arg = next(tokens, None)
+                if arg is None:
+                    # The import has no argument; the line has ended.
+                    continue
+                spans.append((arg.start, arg.end, arg.text))
+            first = False
+    else:
+        spans = []
+        for m in _IMPORT_RE.finditer(text):
+            arg = m.group("arg")
+            if arg[0] == '"':
+                arg = arg[1:-1].replace('\\"', '"')
+            spans.append((m.start("arg"), m.end("arg"), arg))
+
+    pieces = []
+    pos = 0
+    for start, end, arg in spans:
+        if not arg or os.path.isabs(arg) or "{" in arg or f"({arg})" in text:
+            continue
+        path = os.path.join(directory, arg)
+        if not glob.glob(path):
+            continue
+        pieces.append(text[pos:start])
+        pieces.append('"' + path.replace('"', '\\"') + '"' if any(c.isspace() or c == '"' for c in path) else path)
+        pos = end
+    if not pieces:
+        return text
+    pieces.append(text[pos:])
+    return "".join(pieces)
+
+
+def _line_end(text, pos):
+    """Return the position just past the newline ending the line at pos."""
+    newline = text.find("\n", pos)
+    return len(text) if newline == -1 else newline + 1
+
+
+def _is_blank_before(text, pos):
+    return pos == 0 or text.endswith("\n\n", 0, pos) or text.endswith("\n\r\n", 0, pos)
+
+
+def _is_blank_after(text, pos):
+    newline = text.find("\n", pos)
+    segment = text[pos:] if newline == -1 else text[pos:newline]
+    return pos < len(text) and not segment.strip()
+
+
+class _Scanner:
+    """Top-level pass: find block boundaries without tokenizing directives."""
+
+    def __init__(self, doc):
+        self.doc = doc
+        self.text = doc.text
+        self.blocks = []
+
+    def scan(self):
+        with gc_paused():
+            if not self._scan_formatted():
+                self.blocks = []
+                self._scan_exact()
+                self._braceless_site()
+        return self.blocks
+
+    def _scan_formatted(self):
+        """Fast path for files laid out the way `caddy fmt` writes them.
+
+        Top-level keys and closing braces sit in column 0 and everything
+        inside a block is indented, so the file can be cut at every "\\n}\\n"
+        without looking at the directives. Unindented lines inside a block
+        are fine as long as they hold no braces, quotes or comments; a
+        block with such a line, a heredoc or a backtick string is checked
+        with the exact scanner on its own. Returns False when the file does
+        not follow that layout or uses mixed line endings, so the exact
+        scanner runs on the whole file instead.
+        """
+        text = self.text
+        newline = "\n"
+        if "\r" in text:
+            if text.count("\r") != text.count("\r\n"):
+                return False
+            newline = "\r\n"
+        source = text if text.endswith("\n") else text + newline
+        separator = f"{newline}}}{newline}"
+        step = len(newline)
+        opener = "{" + newline
+        blocks = self.blocks
+        doc = self.doc
+        find = source.find
+        rfind = source.rfind
+        find_column0 = _COLUMN0_RE.search
+        unusual = "<<" in text or "`" in text
+        offset = 0
+        cut = find(separator)
+        while cut != -1:
+            end = cut + step + 1
+            brace = find(opener, offset, cut)
+            if brace == -1 and source.endswith("{", offset, cut):
+                brace = cut - 1
+            if brace == -1 or find_column0(source, brace + 1, cut) or (
+                    unusual and (find("<<", offset, cut) != -1 or find("`", offset, cut) != -1)):
+                # Unindented lines or strings that may span them: the cut is
+                # right only if the braces balance before it.
+                if not self._scan_exact(offset, end):
+                    return False
+                offset = end + step
+                cut = find(separator, offset)
+                continue
+            start = lead = rfind("\n", offset, brace) + 1 or offset
+            keys = source[start:brace]
+            if keys:
+                if keys[0] in " \t#" or keys[-1] not in " \t" or "#" in keys or '"' in keys:
+                    return False
+                keys = keys.split()
+                kind = "site" if keys[0][0] not in "(&" else _block_kind(keys)
+            else:
+                keys = []
+                kind = "global"
+            if start > offset:
+                gap = source[offset:start].strip()
+                if not gap:
+                    pass
+                elif gap[0] == "#" and "\n" not in gap:
+                    # A single comment line, usually directly above the block.
+                    comment = rfind("\n", offset, start - 1) + 1 or offset
+                    if source[comment:start].strip():
+                        lead = comment
+                elif self._formatted_gap(offset, start):
+                    lead = self._lead(offset, start)
+                else:
+                    return False
+            blocks.append(Block(doc, kind, keys, lead, start, brace, end))
+            offset = end + step
+            cut = find(separator, offset)
+        return self._formatted_gap(offset, len(text))
+
+    def _formatted_gap(self, start, end):
+        """Accept the text between two blocks if it only holds blanks, comments and imports."""
+        gap = self.text[start:end]
+        if not gap.strip():
+            return True
+        offset = start
+        for raw in gap.split("\n"):
+            line = raw.strip()
+            if line.startswith("import") and line[6:7] in (" ", "\t"):
+                if "`" in line or "<<" in line:
+                    return False
+                line_start = offset + raw.index("i")
+                self.blocks.append(Block(self.doc, "import", line.split(), self._lead(start, line_start),
+                                         line_start, None, line_start + len(line)))
+            elif line and line[0] != "#":
+                return False
+            offset += len(raw) + 1
+        return True
+
+    def _scan_exact(self, start=0, end=None):
+        """Find the blocks in text[start:end] by following every structural character.
+
+        For the whole file, raises CaddyfileError on unbalanced braces. For
+        a part of it (see `_scan_formatted`), returns False instead unless
+        the part ends with the brace closing its last block.
+        """
+        text = self.text
+        whole = end is None
+        end = len(text) if whole else end
+        depth = 0
+        segment = start
+        open_pos = None
+        comments = []
+        skip = start
+        for m in _STRUCTURE_RE.finditer(text, start, end):
+            if m.start() < skip:
+                # Inside a heredoc body.
+                continue
+            kind = m.lastgroup
+            if kind == "open":
+                if depth == 0:
+                    open_pos = m.start()
+                depth += 1
+            elif kind == "close":
+                depth -= 1
+                if depth < 0:
+                    if not whole:
+                        return False
+                    raise CaddyfileError("Unexpected '}'", text.count("\n", 0, m.start()) + 1)
+                if depth == 0:
+                    segment_end = m.end()
+                    self._add_segment(segment, open_pos, segment_end, comments)
+                    segment = segment_end
+                    comments = []
+            elif kind == "heredoc":
+                closing = _heredoc_end(text, m.end(), m.group(kind))
+                if closing is None:
+                    raise CaddyfileError(f"Unterminated heredoc <<{m.group(kind)}", text.count("\n", 0, m.start()) + 1)
+                skip = closing.end()
+                if skip > end:
+                    break
+            elif kind == "comment" and depth == 0:
+                comments.append((m.start(), m.end()))
+        if not whole:
+            return depth == 0 and segment == end
+        if depth:
+            raise CaddyfileError("Unclosed '{'", text.count("\n", 0, open_pos) + 1)
+        self._add_segment(segment, None, len(text), comments)
+        return True
+
+    def _add_segment(self, seg_start, open_pos, seg_end, comments):
+        """Split the text between two blocks into top-level lines and the next block's keys."""
+        text = self.text
+        if open_pos is not None:
+            # The common case: blank and comment lines, then the key line of the next block.
+            line_start = text.rfind("\n", seg_start, open_pos) + 1 or seg_start
+            keys = text[line_start:open_pos].split()
+            if keys and (not comments or comments[-1][1] < line_start) and _only_comments(text[seg_start:line_start]):
+                start = text.index(keys[0], line_start)
+                if comments:
+                    lead = self._lead(seg_start, start)
+                elif line_start > seg_start:
+                    lead = line_start
+                else:
+                    lead = text.rfind("\n", 0, start) + 1
+                self.blocks.append(Block(self.doc, _block_kind(keys), keys, lead, start, open_pos, seg_end))
+                return
+        header_end = open_pos if open_pos is not None else seg_end
+        header = text[seg_start:header_end]
+        for c_start, c_end in comments:
+            if c_start < header_end:
+                header = header[:c_start - seg_start] + " " * (c_end - c_start) + header[c_end - seg_start:]
+
+        lines = []
+        offset = seg_start
+        for raw in header.splitlines(keepends=True):
+            lines.append((offset, raw))
+            offset += len(raw)
+        if open_pos is not None and (not lines or lines[-1][1].endswith("\n")):
+            # The brace opens a keyless block on its own line.
+            lines.append((header_end, ""))
+
+        key_index = len(lines)
+        if open_pos is not None:
+            key_index -= 1
+            while key_index > 0 and lines[key_index - 1][1].strip().endswith(","):
+                key_index -= 1
+
+        for line_start, raw in lines[:key_index]:
+            words = raw.split()
+            if not words:
+                continue
+            kind = "import" if words[0] == "import" else "directive"
+            start = line_start + len(raw) - len(raw.lstrip())
+            end = line_start + len(raw.rstrip())
+            self.blocks.append(Block(self.doc, kind, words, self._lead(seg_start, start), start, None, end))
+
+        if open_pos is None:
+            return
+        key_start = lines[key_index][0]
+        keys = header[key_start - seg_start:].split()
+        start = key_start + len(text[key_start:header_end]) - len(text[key_start:header_end].lstrip())
+        self.blocks.append(Block(self.doc, _block_kind(keys), keys, self._lead(seg_start, start),
+                                 start, open_pos, seg_end))
+
+    def _lead(self, seg_start, start):
+        """Extend a block start upwards over the comment lines directly above it."""
+        text = self.text
+        lead = text.rfind("\n", 0, start) + 1
+        while lead > seg_start:
+            prev = text.rfind("\n", 0, lead - 1) + 1
+            if prev < seg_start or not text[prev:lead].strip().startswith("#"):
+                break
+            lead = prev
+        return lead
+
+    def _braceless_site(self):
+        """A Caddyfile with a single site may omit the braces around it."""
+        if any(b.kind in ("site", "snippet", "named_route") for b in self.blocks):
+            return
+        rest = [b for b in self.blocks if b.kind == "directive"]
+        if not rest:
+            return
+        first = rest[0]
+        index = self.blocks.index(first)
+        end = self.blocks[-1].end
+        self.blocks[index:] = [Block(self.doc, "site", first.keys, first.lead, first.start, None, end)]
+
+
+def _only_comments(text):
+    """True if every line of text is blank or a comment."""
+    if not text or text.isspace():
+        return True
+    return all(not line or line.isspace() or line.lstrip().startswith("#") for line in text.split("\n"))
+
+
+def _block_kind(keys):
+    if not keys:
+        return "global"
+    if keys[0].startswith("(") and keys[0].endswith(")"):
+        return "snippet"
+    if keys[0].startswith("&("):
+        return "named_route"
+    return "site"
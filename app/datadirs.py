@@ -0,0 +1,69 @@
+"""App-owned working directories, one per filesystem.
+
+Archives are extracted into a staging directory and then renamed into the
+site, and deleted files are renamed into the trash. A rename only works
+within one filesystem, so both need a directory on the same filesystem as
+the site files, and it must not be inside a tree Caddy serves: staged or
+deleted files there could be fetched by anyone.
+
+The app's own data directory (under app/config) is used when it shares the
+filesystem. Other filesystems use a directory listed in "data_dirs" in
+config.json, or else a `.caddy-web-ui` directory at their mount point.
+"""
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+DIR_NAME = ".caddy-web-ui"
+
+
+def data_dir(path, candidates=(), exclude=()):
+    """Return an app-owned directory on the filesystem of `path`, or None if there is none.
+
+    `candidates` are tried in order, then DIR_NAME at the mount point of
+    `path`. Directories inside any of `exclude` (the site roots) are
+    skipped. The directory is created when it does not exist yet.
+    """
+    device = _device(path)
+    for directory in (*candidates, os.path.join(mount_point(path), DIR_NAME)):
+        directory = os.path.abspath(directory)
+        if any(inside(directory, os.path.abspath(root)) for root in exclude):
+            continue
+        if _device(directory) != device:
+            continue
+        try:
+            os.makedirs(directory, mode=0o700, exist_ok=True)
+        except OSError as e:
+            logger.debug("Cannot use %s as a data directory: %s", directory, e)
+            continue
+        if os.stat(directory).st_dev == device:
+            return directory
+    return None
+
+
+def mount_point(path):
+    """The top directory of the filesystem holding `path` (or its nearest existing parent)."""
+    path = _existing(os.path.abspath(path))
+    device = os.lstat(path).st_dev
+    while True:
+        parent = os.path.dirname(path)
+        if parent == path or os.stat(parent).st_dev != device:
+            return path
+        path = parent
+
+
+def inside(path, directory):
+    """True if `path` is `directory` or below it; both must be absolute and normalised."""
+    return path == directory or path.startswith(directory.rstrip(os.sep) + os.sep)
+
+
+def _existing(path):
+    while not os.path.lexists(path):
+        path = os.path.dirname(path)
+    return path
+
+
+def _device(path):
+    # lstat: a symlink is renamed itself, not what it points to.
+    return os.lstat(_existing(os.path.abspath(path))).st_dev
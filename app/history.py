@@ -0,0 +1,261 @@
+"""Versioned history of the Caddyfile with content-addressed storage.
+
+Every write of the Caddyfile is recorded as a version. The text is cut at
+top-level block boundaries (sites, snippets, global options and the text
+between them) and each piece is stored once, zlib-compressed, under the
+SHA-256 of its contents, so an edit to one site adds one small object
+however large the file is.
+
+A version lists its pieces in order. The list is itself split into pages
+at content-defined boundaries (where a piece's hash happens to end a page),
+so inserting or removing a site only changes the page around it and the
+short list of page hashes; unchanged pages are shared between versions.
+The hash of that list is the version id, so identical files have the same
+id.
+
+`versions.jsonl` is an append-only log of when each version was written
+and which sites it added, removed or changed.
+"""
+import difflib
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+import zlib
+
+from app.caddyfile import Caddyfile
+
+logger = logging.getLogger(__name__)
+
+# A page ends after a piece whose hash is 0 modulo this; pages average this many pieces.
+PAGE_SPLIT = 32
+# Longest list of domains kept per version in the log.
+LOG_DOMAINS = 100
+LOG_NAME = "versions.jsonl"
+# Log entries are far shorter than this.
+TAIL_BYTES = 64 * 1024
+
+
+class HistoryError(ValueError):
+    """Raised for unknown versions or damaged history data."""
+
+
+class CaddyfileHistory:
+    """Snapshots of one Caddyfile under `directory`."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._last = None
+
+    def record(self, text, file_key, source="edit"):
+        """Store `text` as the newest version and return its log entry."""
+        pieces = split_pieces(text)
+        # Pieces of the last version this process recorded are known to be stored.
+        stored = {digest for _, _, digest in self._last[1]} if self._last else set()
+        for _, _, digest, content in pieces:
+            if digest not in stored:
+                self._put(digest, content.encode("utf-8"))
+        entries = [[kind, name, digest] for kind, name, digest, _ in pieces]
+        version = self._store_entries(entries)
+
+        with self._lock:
+            parent = self._latest()
+            changes = diff_entries(self._entries_of(parent) if parent else [], entries)
+            entry = {
+                "id": version,
+                "parent": parent["id"] if parent else None,
+                "time": time.time(),
+                "source": source,
+                "size": len(text.encode("utf-8")),
+                "file_key": list(file_key) if file_key else None,
+            }
+            for status in ("added", "removed", "changed"):
+                domains = changes[status]
+                entry[status] = domains[:LOG_DOMAINS]
+                entry[f"{status}_count"] = len(domains)
+            os.makedirs(self.directory, exist_ok=True)
+            # One write() per line, so lines appended by other workers do not interleave.
+            with open(os.path.join(self.directory, LOG_NAME), "a", encoding="utf-8") as log:
+                log.write(json.dumps(entry) + "\n")
+            self._last = (version, entries)
+        logger.debug("Recorded Caddyfile version %s (%s)", version[:12], source)
+        return entry
+
+    def recorded_key(self):
+        """The (mtime_ns, size, inode) of the file when the newest version was recorded."""
+        latest = self._latest()
+        return tuple(latest["file_key"]) if latest and latest.get("file_key") else None
+
+    def versions(self, offset=0, limit=50):
+        """Return (entries, total), newest first."""
+        log = self._read_log()
+        log.reverse()
+        return log[offset:offset + limit], len(log)
+
+    def text(self, version):
+        """Return the Caddyfile text of a version."""
+        return "".join(self._get(digest).decode("utf-8") for _, _, digest in self.entries(version))
+
+    def entries(self, version):
+        """Return the [kind, name, hash] pieces of a version."""
+        manifest = json.loads(self._get(version))
+        entries = []
+        for page in manifest["pages"]:
+            entries.extend(json.loads(self._get(page)))
+        return entries
+
+    def diff(self, version, against=None, context=3):
+        """Per-site unified diffs between `against` (default: the parent) and `version`."""
+        if against is None:
+            for entry in self._read_log():
+                if entry["id"] == version:
+                    against = entry["parent"]
+                    break
+            else:
+                self._get(version)
+        old = self.entries(against) if against else []
+        new = self.entries(version)
+        old_blocks = _named_blocks(old)
+        new_blocks = _named_blocks(new)
+        sites = []
+        for status, domains in diff_entries(old, new).items():
+            for domain in domains:
+                before = self._get(old_blocks[domain]).decode("utf-8") if domain in old_blocks else ""
+                after = self._get(new_blocks[domain]).decode("utf-8") if domain in new_blocks else ""
+                sites.append({
+                    "domain": domain,
+                    "status": status,
+                    "diff": "".join(difflib.unified_diff(
+                        before.splitlines(True), after.splitlines(True),
+                        f"{against[:12] if against else 'empty'}/{domain}", f"{version[:12]}/{domain}", n=context)),
+                })
+        return {"version": version, "against": against, "sites": sites}
+
+    def _store_entries(self, entries):
+        pages = []
+        page = []
+        for entry in entries:
+            page.append(entry)
+            if int(entry[2][:8], 16) % PAGE_SPLIT == 0:
+                pages.append(self._put_json(page))
+                page = []
+        if page or not pages:
+            pages.append(self._put_json(page))
+        return self._put_json({"pages": pages})
+
+    def _put_json(self, value):
+        data = json.dumps(value, separators=(",", ":")).encode("utf-8")
+        digest = hashlib.sha256(data).hexdigest()
+        self._put(digest, data)
+        return digest
+
+    def _object_path(self, digest):
+        return os.path.join(self.directory, "objects", digest[:2], digest[2:])
+
+    def _put(self, digest, data):
+        path = self._object_path(digest)
+        if os.path.exists(path):
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as file:
+            file.write(zlib.compress(data))
+        os.replace(tmp_path, path)
+
+    def _get(self, digest):
+        if not digest or not all(c in "0123456789abcdef" for c in digest) or len(digest) != 64:
+            raise HistoryError(f"Unknown version {digest!r}")
+        try:
+            with open(self._object_path(digest), "rb") as file:
+                return zlib.decompress(file.read())
+        except FileNotFoundError:
+            raise HistoryError(f"Unknown version {digest[:12]}")
+        except zlib.error as e:
+            raise HistoryError(f"Damaged history object {digest[:12]}: {e}")
+
+    def _read_log(self):
+        try:
+            with open(os.path.join(self.directory, LOG_NAME), "r", encoding="utf-8") as log:
+                lines = log.readlines()
+        except FileNotFoundError:
+            return []
+        entries = []
+        for line in lines:
+            try:
+                entries.append(json.loads(line))
+            except ValueError:
+                # A line cut short by a crash.
+                continue
+        return entries
+
+    def _latest(self):
+        """The newest log entry, read from the end of the log."""
+        try:
+            with open(os.path.join(self.directory, LOG_NAME), "rb") as log:
+                size = log.seek(0, os.SEEK_END)
+                log.seek(max(0, size - TAIL_BYTES))
+                lines = log.read().splitlines()
+        except FileNotFoundError:
+            return None
+        for line in reversed(lines):
+            try:
+                return json.loads(line)
+            except ValueError:
+                continue
+        return None
+
+    def _entries_of(self, entry):
+        if self._last is not None and self._last[0] == entry["id"]:
+            return self._last[1]
+        try:
+            return self.entries(entry["id"])
+        except HistoryError as e:
+            logger.warning(f"Ignoring the newest Caddyfile version: {e}")
+            return []
+
+
+def split_pieces(text):
+    """Cut Caddyfile text at top-level block boundaries.
+
+    Returns (kind, name, sha256, content) tuples whose contents add up to
+    `text`; text between blocks has kind "text".
+    """
+    pieces = []
+    pos = 0
+
+    def add(kind, name, content):
+        if content:
+            pieces.append((kind, name, hashlib.sha256(content.encode("utf-8")).hexdigest(), content))
+
+    for block in sorted(Caddyfile(text).blocks, key=lambda block: block.lead):
+        add("text", "", text[pos:block.lead])
+        add(block.kind, block.domain, text[block.lead:block.end])
+        pos = block.end
+    add("text", "", text[pos:])
+    return pieces
+
+
+def _named_blocks(entries):
+    """Map each site's domain, or "(kind name)" for other blocks, to its hash."""
+    blocks = {}
+    for kind, name, digest in entries:
+        if kind == "site":
+            blocks.setdefault(name, digest)
+        elif kind != "text":
+            blocks.setdefault(f"({kind} {name})" if name else f"({kind})", digest)
+    return blocks
+
+
+def diff_entries(old, new):
+    """Sites (and other named blocks) added, removed and changed between two piece lists."""
+    old_blocks = _named_blocks(old)
+    new_blocks = _named_blocks(new)
+    return {
+        "added": [domain for domain in new_blocks if domain not in old_blocks],
+        "removed": [domain for domain in old_blocks if domain not in new_blocks],
+        "changed": [domain for domain, digest in new_blocks.items()
+                    if domain in old_blocks and old_blocks[domain] != digest],
+    }
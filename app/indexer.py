@@ -0,0 +1,587 @@
+"""Optional metadata index of the files under every site root.
+
+When `file_index` is enabled in config.json, a background thread records
+path, type, size, mtime and recursive directory size of everything under
+each site root in an SQLite database. On Linux the index is kept current
+with inotify; everywhere, and as a safety net for missed events, every
+root is rescanned after `file_index_rescan` seconds. The database
+survives restarts: known roots are watched again from the directories
+already in the index instead of being rescanned.
+
+Entries are classified like listing.py sees them: a symlink is listed as
+what it points to (a broken one as a file), but the index never descends
+into a symlinked directory.
+
+Only one process (the one holding `<db>.lock`) updates the index; every
+gunicorn worker reads it. Listings are served from the index only while
+inotify is watching the root and the directory's mtime still matches, so
+they are never staler than a directory read; otherwise callers fall back
+to the filesystem.
+"""
+import ctypes
+import ctypes.util
+import errno
+import logging
+import os
+import select
+import sqlite3
+import stat
+import struct
+import threading
+import time
+
+from app.listing import DEFAULT_LIMIT, MAX_LIMIT, SORT_FIELDS, decode_cursor, encode_cursor
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# The indexing process refreshes its heartbeat this often; readers stop
+# trusting inotify-backed listings when it is older than HEARTBEAT_TIMEOUT.
+HEARTBEAT = 5.0
+HEARTBEAT_TIMEOUT = 30.0
+# Events arriving within this window are handled in one transaction.
+EVENT_BATCH_WINDOW = 0.05
+
+# Bumped when the tables change; an index built with another version is dropped and rebuilt.
+SCHEMA_VERSION = 2
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS roots (
+    root TEXT PRIMARY KEY,
+    scanned REAL,
+    live INTEGER NOT NULL DEFAULT 0,
+    heartbeat REAL
+);
+CREATE TABLE IF NOT EXISTS entries (
+    root TEXT NOT NULL,
+    path TEXT NOT NULL,
+    parent TEXT,
+    name TEXT NOT NULL,
+    sort_name TEXT NOT NULL,
+    is_dir INTEGER NOT NULL,
+    is_link INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    total_size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    PRIMARY KEY (root, path)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS entries_parent ON entries (root, parent, sort_name);
+"""
+
+_SORT_COLUMNS = {"name": "sort_name", "size": "size", "modified": "mtime_ns"}
+
+
+class FileIndex:
+    """Build and query the metadata index; `get_roots` returns the site roots to index."""
+
+    def __init__(self, db_path, get_roots, rescan_interval=600):
+        self.db_path = db_path
+        self.get_roots = get_roots
+        self.rescan_interval = rescan_interval
+        self.indexing = False
+        self._local = threading.local()
+        self._thread = None
+        self._pid = None
+        self._inotify = None
+        self._wd_paths = {}
+        self._path_wds = {}
+        self._roots = set()
+        conn = self._connect()
+        if conn.execute("PRAGMA user_version").fetchone()[0] != SCHEMA_VERSION:
+            conn.executescript("DROP TABLE IF EXISTS entries; DROP TABLE IF EXISTS roots;")
+        conn.executescript(SCHEMA)
+        conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        conn.close()
+
+    def start(self):
+        # Threads do not survive a fork, so a gunicorn worker starts its own.
+        if self._thread is None or not self._thread.is_alive() or self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name="file-index", daemon=True)
+            self._thread.start()
+
+    # Reading
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def _reader(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = self._local.conn = self._connect()
+            self._local.pid = os.getpid()
+        return conn
+
+    def status(self):
+        now = time.time()
+        rows = self._reader().execute(
+            "SELECT r.root, r.scanned, r.live, r.heartbeat, COUNT(e.path), "
+            "(SELECT total_size FROM entries WHERE root = r.root AND path = '') "
+            "FROM roots r LEFT JOIN entries e ON e.root = r.root GROUP BY r.root").fetchall()
+        return [{
+            "root": root,
+            "scanned": scanned,
+            "live": bool(live and heartbeat and now - heartbeat < HEARTBEAT_TIMEOUT),
+            "entries": count,
+            "total_size": total,
+        } for root, scanned, live, heartbeat, count, total in rows]
+
+    def listing(self, root, relative, sort="name", descending=False, pattern=None, cursor=None, limit=None):
+        """Return (files, next_cursor, total) like listing.list_directory, or None if the index can't answer."""
+        if sort not in SORT_FIELDS:
+            raise ValueError(f"Cannot sort by {sort!r}")
+        conn = self._reader()
+        row = conn.execute(
+            "SELECT r.live, r.heartbeat, e.is_dir AND NOT e.is_link, e.mtime_ns FROM roots r "
+            "JOIN entries e ON e.root = r.root AND e.path = ? WHERE r.root = ?", (relative, root)).fetchone()
+        if row is None or not row[0] or not row[1] or time.time() - row[1] > HEARTBEAT_TIMEOUT or not row[2]:
+            return None
+        try:
+            if os.stat(_join(root, relative)).st_mtime_ns != row[3]:
+                return None
+        except OSError:
+            return None
+
+        column = _SORT_COLUMNS[sort]
+        # Same key as listing.py: directories first, then the sort value, then the name.
+        kind = "is_dir" if descending else "1 - is_dir"
+        where = "root = ? AND parent = ?"
+        params = [root, relative]
+        if pattern:
+            pattern = pattern.casefold()
+            if any(c in pattern for c in "*?["):
+                where += " AND sort_name GLOB ?"
+            else:
+                where += " AND instr(sort_name, ?) > 0"
+            params.append(pattern)
+        total = conn.execute(f"SELECT COUNT(*) FROM entries WHERE {where}", params).fetchone()[0]
+        if cursor:
+            where += f" AND ({kind}, {column}, name) {'<' if descending else '>'} (?, ?, ?)"
+            params.extend(decode_cursor(cursor, sort, descending))
+        direction = "DESC" if descending else "ASC"
+        if limit is None and cursor is None:
+            # Unpaged, like list_directory; -1 is no limit to SQLite.
+            limit = -1
+        else:
+            limit = max(1, min(int(limit or DEFAULT_LIMIT), MAX_LIMIT))
+        rows = conn.execute(
+            f"SELECT {kind}, {column}, name, is_dir, size, total_size, mtime_ns FROM entries WHERE {where} "
+            f"ORDER BY 1 {direction}, 2 {direction}, 3 {direction} LIMIT ?",
+            params + [limit + 1 if limit > 0 else -1]).fetchall()
+        more = limit > 0 and len(rows) > limit
+        if more:
+            rows = rows[:limit]
+        files = [_describe(name, is_dir, size, total_size, mtime_ns)
+                 for _, _, name, is_dir, size, total_size, mtime_ns in rows]
+        next_cursor = encode_cursor(rows[-1][:3], sort, descending) if more else None
+        return files, next_cursor, total
+
+    def dir_size(self, root, relative):
+        """Return the recursive size of a directory, or None if it is not indexed."""
+        row = self._reader().execute(
+            "SELECT total_size FROM entries WHERE root = ? AND path = ?", (root, relative)).fetchone()
+        return row[0] if row else None
+
+    def search(self, root, query, limit=200):
+        """Find entries under root whose name contains `query` (or matches it as a glob)."""
+        row = self._reader().execute("SELECT 1 FROM roots WHERE root = ? AND scanned IS NOT NULL", (root,)).fetchone()
+        if row is None:
+            return None
+        query = query.casefold()
+        condition = "sort_name GLOB ?" if any(c in query for c in "*?[") else "instr(sort_name, ?) > 0"
+        rows = self._reader().execute(
+            f"SELECT path, name, is_dir, size, total_size, mtime_ns FROM entries "
+            f"WHERE root = ? AND path != '' AND {condition} ORDER BY path LIMIT ?", (root, query, limit)).fetchall()
+        return [{"path": path, **_describe(name, is_dir, size, total_size, mtime_ns)}
+                for path, name, is_dir, size, total_size, mtime_ns in rows]
+
+    # Indexing
+
+    def _run(self):
+        lock_file = open(self.db_path + ".lock", "a")
+        while True:
+            if fcntl is not None:
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    # Another process is indexing; try again later in case it exits.
+                    time.sleep(HEARTBEAT_TIMEOUT)
+                    continue
+            break
+        self.indexing = True
+        logger.info(f"Indexing site files into {self.db_path}")
+        conn = self._connect()
+        try:
+            self._inotify = _Inotify()
+        except OSError as e:
+            logger.info(f"inotify unavailable, rescanning every {self.rescan_interval}s: {e}")
+        conn.execute("UPDATE roots SET live = 0")
+        conn.commit()
+        while True:
+            try:
+                self._sync_roots(conn)
+                self._wait_for_events(conn)
+            except Exception as e:
+                logger.error(f"File index update failed: {e}")
+                conn.rollback()
+                time.sleep(HEARTBEAT)
+
+    def _sync_roots(self, conn):
+        try:
+            roots = {os.path.abspath(root) for root in self.get_roots() if root}
+        except Exception as e:
+            logger.debug("Could not read site roots: %s", e)
+            roots = self._roots
+        known = {root: scanned for root, scanned in conn.execute("SELECT root, scanned FROM roots")}
+        for root in set(known) - roots:
+            logger.debug("Dropping %s from the file index", root)
+            self._unwatch(root, "")
+            conn.execute("DELETE FROM entries WHERE root = ?", (root,))
+            conn.execute("DELETE FROM roots WHERE root = ?", (root,))
+        now = time.time()
+        for root in roots:
+            if not os.path.isdir(root):
+                continue
+            scanned = known.get(root)
+            if scanned is None or now - scanned > self.rescan_interval:
+                self._scan_root(conn, root)
+            elif root not in self._roots:
+                self._watch_known(conn, root)
+        self._roots = roots
+        conn.execute("UPDATE roots SET heartbeat = ?", (now,))
+        conn.commit()
+
+    def _scan_root(self, conn, root):
+        started = time.monotonic()
+        self._unwatch(root, "")
+        conn.execute("DELETE FROM entries WHERE root = ?", (root,))
+        count, total = self._scan(conn, root, "")
+        live = self._inotify is not None and (root, "") in self._path_wds
+        conn.execute("INSERT OR REPLACE INTO roots (root, scanned, live, heartbeat) VALUES (?, ?, ?, ?)",
+                      (root, time.time(), int(live), time.time()))
+        conn.commit()
+        logger.info(f"Indexed {count} entries ({total} bytes) under {root} in {time.monotonic() - started:.1f}s")
+
+    def _watch_known(self, conn, root):
+        """Watch the directories already in the index, without rescanning them.
+
+        Directories whose mtime changed while nobody was watching get their
+        entries compared with the disk; changes to file contents are only
+        picked up by the next rescan.
+        """
+        changed = []
+        for path, mtime_ns in conn.execute(
+                "SELECT path, mtime_ns FROM entries WHERE root = ? AND is_dir = 1 AND is_link = 0",
+                (root,)).fetchall():
+            if self._watch(root, path) is False:
+                changed.append(path)
+                continue
+            try:
+                if os.stat(_join(root, path)).st_mtime_ns != mtime_ns:
+                    changed.append(path)
+            except OSError:
+                changed.append(path)
+        for path in changed:
+            self._reconcile(conn, root, path)
+        live = self._inotify is not None and (root, "") in self._path_wds
+        conn.execute("UPDATE roots SET live = ? WHERE root = ?", (int(live), root))
+
+    def _scan(self, conn, root, relative):
+        """Index the tree at `relative`, replacing what was there; returns (entries, total size)."""
+        rows = {}
+        dirs = []
+        top = _entry_row(root, relative)
+        if top is None:
+            return 0, 0
+        rows[relative] = top
+        if top[5] and not top[6]:
+            dirs.append(relative)
+        i = 0
+        while i < len(dirs):
+            path = dirs[i]
+            i += 1
+            # Watch before listing so nothing created in between is missed.
+            self._watch(root, path)
+            try:
+                entries = list(os.scandir(_join(root, path)))
+            except OSError:
+                continue
+            for entry in entries:
+                child = f"{path}/{entry.name}" if path else entry.name
+                try:
+                    is_link = entry.is_symlink()
+                    info = _follow(entry.path, entry.stat(follow_symlinks=False)) if is_link \
+                        else entry.stat(follow_symlinks=False)
+                except OSError:
+                    continue
+                is_dir = stat.S_ISDIR(info.st_mode)
+                size = 0 if is_dir else info.st_size
+                rows[child] = [root, child, path, entry.name, entry.name.casefold(), int(is_dir), int(is_link),
+                               size, size, info.st_mtime_ns]
+                rows[path][8] += size
+                if is_dir and not is_link:
+                    dirs.append(child)
+        # Breadth-first order reversed: every directory is complete before it
+        # is added to its parent.
+        for path in reversed(dirs[1:]):
+            rows[rows[path][2]][8] += rows[path][8]
+        self._delete(conn, root, relative)
+        conn.executemany("INSERT INTO entries VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows.values())
+        return len(rows), top[8]
+
+    def _delete(self, conn, root, relative):
+        if relative:
+            conn.execute("DELETE FROM entries WHERE root = ? AND (path = ? OR (path >= ? AND path < ?))",
+                         (root, relative, relative + "/", relative + "0"))
+        else:
+            conn.execute("DELETE FROM entries WHERE root = ?", (root,))
+
+    def _refresh(self, conn, root, relative):
+        """Bring one path (and its subtree, if it is a new directory) up to date."""
+        old = conn.execute("SELECT is_dir AND NOT is_link, total_size FROM entries WHERE root = ? AND path = ?",
+                           (root, relative)).fetchone()
+        parent = _parent(relative)
+        if parent is not None and old is None and conn.execute(
+                "SELECT 1 FROM entries WHERE root = ? AND path = ?", (root, parent)).fetchone() is None:
+            # The parent itself is new to us; index from there instead.
+            return self._refresh(conn, root, parent)
+        try:
+            info = os.lstat(_join(root, relative))
+        except OSError:
+            info = None
+        is_link = info is not None and stat.S_ISLNK(info.st_mode)
+        if is_link:
+            info = _follow(_join(root, relative), info)
+
+        if info is None:
+            if old is None:
+                return
+            self._unwatch(root, relative)
+            self._delete(conn, root, relative)
+            delta = -old[1]
+        elif stat.S_ISDIR(info.st_mode) and not is_link and old is not None and old[0]:
+            conn.execute("UPDATE entries SET mtime_ns = ? WHERE root = ? AND path = ?",
+                         (info.st_mtime_ns, root, relative))
+            delta = 0
+        elif stat.S_ISDIR(info.st_mode) and not is_link:
+            _, total = self._scan(conn, root, relative)
+            delta = total - (old[1] if old else 0)
+        else:
+            # A file, or a symlink: listed as what it points to, never descended into.
+            if old is not None and old[0]:
+                self._unwatch(root, relative)
+                self._delete(conn, root, relative)
+            is_dir = stat.S_ISDIR(info.st_mode)
+            size = 0 if is_dir else info.st_size
+            name = relative.rsplit("/", 1)[-1]
+            conn.execute("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                         (root, relative, parent, name, name.casefold(), int(is_dir), int(is_link), size, size,
+                          info.st_mtime_ns))
+            delta = size - (old[1] if old else 0)
+
+        ancestors = _ancestors(relative)
+        if delta and ancestors:
+            conn.execute(f"UPDATE entries SET total_size = total_size + ? WHERE root = ? "
+                         f"AND path IN ({','.join('?' * len(ancestors))})", [delta, root, *ancestors])
+        if parent is not None:
+            try:
+                conn.execute("UPDATE entries SET mtime_ns = ? WHERE root = ? AND path = ?",
+                             (os.stat(_join(root, parent)).st_mtime_ns, root, parent))
+            except OSError:
+                pass
+
+    def _reconcile(self, conn, root, relative):
+        """Refresh the entries of one directory that were added or removed on disk."""
+        try:
+            on_disk = set(os.listdir(_join(root, relative)))
+        except OSError:
+            return self._refresh(conn, root, relative)
+        indexed = {name for (name,) in conn.execute("SELECT name FROM entries WHERE root = ? AND parent = ?",
+                                                     (root, relative))}
+        for name in on_disk ^ indexed:
+            self._refresh(conn, root, f"{relative}/{name}" if relative else name)
+        self._refresh(conn, root, relative)
+
+    def _watch(self, root, relative):
+        """Add an inotify watch; returns False when the directory is gone."""
+        if self._inotify is None:
+            return None
+        try:
+            wd = self._inotify.add_watch(_join(root, relative))
+        except OSError as e:
+            if e.errno in (errno.ENOENT, errno.ENOTDIR):
+                return False
+            if e.errno == errno.ENOSPC:
+                logger.warning("Out of inotify watches (see fs.inotify.max_user_watches); "
+                               f"{root} falls back to periodic rescans")
+            return None
+        previous = self._wd_paths.get(wd)
+        if previous is not None and previous != (root, relative):
+            # A watched directory was moved; its watch now belongs to the new path.
+            self._path_wds.pop(previous, None)
+        self._wd_paths[wd] = (root, relative)
+        self._path_wds[(root, relative)] = wd
+        return True
+
+    def _unwatch(self, root, relative):
+        if self._inotify is None:
+            return
+        prefix = relative + "/" if relative else ""
+        for key in [key for key in self._path_wds
+                    if key[0] == root and (key[1] == relative or key[1].startswith(prefix))]:
+            wd = self._path_wds.pop(key)
+            if self._wd_paths.get(wd) == key:
+                del self._wd_paths[wd]
+                self._inotify.rm_watch(wd)
+
+    def _wait_for_events(self, conn):
+        if self._inotify is None:
+            time.sleep(HEARTBEAT)
+            return
+        events = self._inotify.read(HEARTBEAT)
+        if not events:
+            return
+        time.sleep(EVENT_BATCH_WINDOW)
+        events += self._inotify.read(0)
+        paths = {}
+        for wd, mask, name in events:
+            if mask & _Inotify.IN_Q_OVERFLOW:
+                logger.warning("inotify queue overflowed; rescanning all site roots")
+                conn.execute("UPDATE roots SET scanned = NULL")
+                conn.commit()
+                return
+            if mask & _Inotify.IN_IGNORED:
+                key = self._wd_paths.pop(wd, None)
+                if key is not None and self._path_wds.get(key) == wd:
+                    del self._path_wds[key]
+                continue
+            key = self._wd_paths.get(wd)
+            if key is None or not name:
+                continue
+            root, relative = key
+            paths[(root, f"{relative}/{name}" if relative else name)] = True
+        # Removals first, so a moved directory's watches are released before
+        # they are claimed again under the new name.
+        for root, relative in sorted(paths, key=lambda key: os.path.lexists(_join(*key))):
+            self._refresh(conn, root, relative)
+        conn.commit()
+
+
+class _Inotify:
+    """The few inotify calls the index needs, through ctypes."""
+
+    IN_MODIFY = 0x2
+    IN_ATTRIB = 0x4
+    IN_CLOSE_WRITE = 0x8
+    IN_MOVED_FROM = 0x40
+    IN_MOVED_TO = 0x80
+    IN_CREATE = 0x100
+    IN_DELETE = 0x200
+    IN_Q_OVERFLOW = 0x4000
+    IN_IGNORED = 0x8000
+    IN_ONLYDIR = 0x1000000
+    IN_NONBLOCK = 0o4000
+    IN_CLOEXEC = 0o2000000
+    # IN_MODIFY as well as IN_CLOSE_WRITE: a file kept open while it grows
+    # (a log, a long upload) would otherwise keep its old size until closed.
+    MASK = IN_ATTRIB | IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_ONLYDIR
+    _EVENT = struct.Struct("iIII")
+
+    def __init__(self):
+        name = ctypes.util.find_library("c")
+        if name is None:
+            raise OSError(errno.ENOSYS, "libc not found")
+        self._libc = ctypes.CDLL(name, use_errno=True)
+        if not hasattr(self._libc, "inotify_init1"):
+            raise OSError(errno.ENOSYS, "inotify is not supported on this platform")
+        self.fd = self._libc.inotify_init1(self.IN_NONBLOCK | self.IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), os.strerror(ctypes.get_errno()))
+
+    def add_watch(self, path):
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(path), self.MASK)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), os.strerror(ctypes.get_errno()), path)
+        return wd
+
+    def rm_watch(self, wd):
+        self._libc.inotify_rm_watch(self.fd, wd)
+
+    def read(self, timeout):
+        """Return [(wd, mask, name)] for the events available within `timeout` seconds."""
+        if not select.select([self.fd], [], [], timeout)[0]:
+            return []
+        events = []
+        while True:
+            try:
+                data = os.read(self.fd, 1024 * 1024)
+            except BlockingIOError:
+                return events
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, length = self._EVENT.unpack_from(data, offset)
+                offset += self._EVENT.size
+                name = data[offset:offset + length].rstrip(b"\0")
+                offset += length
+                events.append((wd, mask, os.fsdecode(name)))
+
+
+def _join(root, relative):
+    return os.path.join(root, *relative.split("/")) if relative else root
+
+
+def _parent(relative):
+    if not relative:
+        return None
+    return relative.rsplit("/", 1)[0] if "/" in relative else ""
+
+
+def _ancestors(relative):
+    ancestors = []
+    parent = _parent(relative)
+    while parent is not None:
+        ancestors.append(parent)
+        parent = _parent(parent)
+    return ancestors
+
+
+def _follow(path, link_info):
+    """The stat of what the symlink at `path` points to, or of the link itself when it is broken."""
+    try:
+        return os.stat(path)
+    except OSError:
+        return link_info
+
+
+def _entry_row(root, relative):
+    try:
+        info = os.lstat(_join(root, relative))
+    except OSError:
+        return None
+    # The root itself is always followed; a site root is often a symlink.
+    is_link = bool(relative) and stat.S_ISLNK(info.st_mode)
+    if stat.S_ISLNK(info.st_mode):
+        info = _follow(_join(root, relative), info)
+    is_dir = stat.S_ISDIR(info.st_mode)
+    name = relative.rsplit("/", 1)[-1]
+    size = 0 if is_dir else info.st_size
+    return [root, relative, _parent(relative), name, name.casefold(), int(is_dir), int(is_link), size, size,
+            info.st_mtime_ns]
+
+
+def _describe(name, is_dir, size, total_size, mtime_ns):
+    item = {
+        "name": name,
+        "type": "directory" if is_dir else "file",
+        "size": "-" if is_dir else size,
+        "modified": mtime_ns / 1e9,
+    }
+    if is_dir:
+        item["total_size"] = total_size
+    return item
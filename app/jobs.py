@@ -0,0 +1,184 @@
+"""Background job bookkeeping shared by the reload queue and file operations.
+
+Jobs live in memory in the process that runs them. When the registry has a
+directory, every state change is also written there as JSON so that a
+status poll answered by another gunicorn worker still finds the job.
+"""
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+
+from app.utils import atomic_write
+
+logger = logging.getLogger(__name__)
+
+
+class Job:
+    """State of one background operation."""
+
+    def __init__(self, registry, kind, info=None):
+        self.registry = registry
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.info = dict(info or {})
+        self.status = "pending"
+        self.progress = {}
+        self.result = None
+        self.error = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self._done = threading.Event()
+        self._cancel = threading.Event()
+        self._cancel_checked = 0.0
+        self._persisted = 0.0
+
+    @property
+    def done(self):
+        return self.status in ("succeeded", "failed", "cancelled")
+
+    def start(self):
+        self.status = "running"
+        self.started = time.time()
+        self.registry._save(self)
+
+    def update(self, **progress):
+        """Record progress; persisted at most once a second."""
+        self.progress.update(progress)
+        if time.time() - self._persisted >= 1.0:
+            self.registry._save(self)
+
+    def succeed(self, result=None):
+        self._finish("succeeded", result=result)
+
+    def fail(self, error, result=None):
+        self._finish("failed", result=result, error=str(error))
+
+    def cancel(self):
+        self._finish("cancelled")
+
+    def _finish(self, status, result=None, error=None):
+        self.status = status
+        self.result = result
+        self.error = error
+        self.finished = time.time()
+        self.registry._save(self)
+        self._done.set()
+
+    def wait(self, timeout=None):
+        return self._done.wait(timeout)
+
+    def cancel_requested(self):
+        """True once someone asked to cancel; long-running work should poll this."""
+        if not self._cancel.is_set() and time.time() - self._cancel_checked >= 0.5:
+            # The request may have been answered by another worker.
+            self._cancel_checked = time.time()
+            if self.registry.directory and os.path.exists(self.registry._cancel_path(self.id)):
+                self._cancel.set()
+        return self._cancel.is_set()
+
+    def as_dict(self):
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "info": self.info,
+            "status": self.status,
+            "progress": self.progress,
+            "result": self.result,
+            "error": self.error,
+            "created": self.created,
+            "started": self.started,
+            "finished": self.finished,
+        }
+
+
+class JobRegistry:
+    """Create jobs and look them up by id.
+
+    Finished jobs are forgotten after `retention` seconds.
+    """
+
+    def __init__(self, directory=None, retention=3600):
+        self.directory = directory
+        self.retention = retention
+        self._jobs = {}
+        self._lock = threading.Lock()
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+            self._prune_directory()
+
+    def create(self, kind, **info):
+        job = Job(self, kind, info)
+        with self._lock:
+            self._prune()
+            self._jobs[job.id] = job
+        self._save(job)
+        return job
+
+    def get(self, job_id):
+        """Return the job as a dict, from memory or from the shared directory."""
+        job = self._jobs.get(job_id)
+        if job is not None:
+            return job.as_dict()
+        if not self.directory or not all(c in "0123456789abcdef" for c in job_id):
+            return None
+        try:
+            with open(self._path(job_id), "r") as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return None
+
+    def request_cancel(self, job_id):
+        """Ask a running job to stop; returns False if the job is unknown or already finished."""
+        job = self.get(job_id)
+        if job is None or job["status"] in ("succeeded", "failed", "cancelled"):
+            return False
+        if job_id in self._jobs:
+            self._jobs[job_id]._cancel.set()
+        elif self.directory:
+            open(self._cancel_path(job_id), "w").close()
+        return True
+
+    def active(self, kind=None):
+        return [job for job in list(self._jobs.values())
+                if not job.done and (kind is None or job.kind == kind)]
+
+    def _path(self, job_id):
+        return os.path.join(self.directory, f"{job_id}.json")
+
+    def _cancel_path(self, job_id):
+        return os.path.join(self.directory, f"{job_id}.cancel")
+
+    def _save(self, job):
+        if not self.directory:
+            return
+        job._persisted = time.time()
+        try:
+            atomic_write(self._path(job.id), json.dumps(job.as_dict()))
+        except OSError as e:
+            logger.warning(f"Could not persist job {job.id}: {e}")
+
+    def _prune_directory(self):
+        """Remove job files left behind by processes that have since exited."""
+        cutoff = time.time() - self.retention
+        for entry in os.scandir(self.directory):
+            try:
+                if entry.name.endswith((".json", ".cancel")) and entry.stat().st_mtime < cutoff:
+                    os.remove(entry.path)
+            except OSError:
+                pass
+
+    def _prune(self):
+        cutoff = time.time() - self.retention
+        for job_id, job in list(self._jobs.items()):
+            if job.done and job.finished < cutoff:
+                del self._jobs[job_id]
+                if self.directory:
+                    for path in (self._path(job_id), self._cancel_path(job_id)):
+                        try:
+                            os.remove(path)
+                        except OSError:
+                            pass
@@ -0,0 +1,203 @@
+"""Sorted, filtered and paged directory listings for the file browsers.
+
+A directory is read with one os.scandir() pass. Sorting by name needs no
+stat at all (DirEntry knows whether it is a directory); sorting by size or
+modification time uses the stat cached on each DirEntry, and entries of the
+returned page are stat'ed at most once. The sorted listing is kept for a
+short while, so paging through a large directory does not re-read it for
+every page.
+
+A listing is only paged when the client asks for it with a limit or a
+cursor; otherwise every entry is returned. Pages are addressed with an opaque cursor holding the sort key of the last
+entry returned, so entries added or removed between requests do not make
+the next page skip or repeat entries. The cursor also names the sort and
+order it came from; using it with another one is an error.
+"""
+import base64
+import bisect
+import fnmatch
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from app import metrics
+
+SORT_FIELDS = ("name", "size", "modified")
+# Page size for a cursor sent without a limit.
+DEFAULT_LIMIT = 1000
+MAX_LIMIT = 10000
+
+_CACHE_SIZE = 16
+_CACHE_TTL = 10.0
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+class _Listing:
+    __slots__ = ("dir_mtime", "created", "keys", "rows")
+
+    def __init__(self, dir_mtime, rows):
+        self.dir_mtime = dir_mtime
+        self.created = time.monotonic()
+        self.rows = rows
+        self.keys = [row[0] for row in rows]
+
+
+def list_directory(path, sort="name", descending=False, pattern=None, cursor=None, limit=None):
+    """Return (files, next_cursor, total) for one page of a directory.
+
+    Directories come first in either order. `pattern` is a case-insensitive
+    substring, or a glob when it contains *, ? or [. Without a limit or a
+    cursor the page holds every entry. `next_cursor` is None on the last
+    page. `files` is an iterator that stats each entry as it is consumed,
+    so a response can start before the last entry has been looked at.
+    """
+    if sort not in SORT_FIELDS:
+        raise ValueError(f"Cannot sort by {sort!r}")
+    listing = _listing(path, sort, descending, pattern or "")
+
+    position = decode_cursor(cursor, sort, descending) if cursor else None
+    total = len(listing.rows)
+    if limit is None and cursor is None:
+        limit = max(total, 1)
+    else:
+        limit = max(1, min(int(limit or DEFAULT_LIMIT), MAX_LIMIT))
+    if descending:
+        # Rows are always stored in ascending order; walk them backwards.
+        end = bisect.bisect_left(listing.keys, position) if position else total
+        start = max(0, end - limit)
+        page = listing.rows[start:end][::-1]
+        more = start > 0
+    else:
+        start = bisect.bisect_right(listing.keys, position) if position else 0
+        page = listing.rows[start:start + limit]
+        more = start + limit < total
+    files = (_describe(path, row) for row in page)
+    next_cursor = encode_cursor(page[-1][0], sort, descending) if more and page else None
+    return files, next_cursor, total
+
+
+def _listing(path, sort, descending, pattern):
+    dir_mtime = os.stat(path).st_mtime_ns
+    key = (os.path.abspath(path), sort, descending, pattern)
+    with _cache_lock:
+        listing = _cache.get(key)
+        if listing is not None and listing.dir_mtime == dir_mtime \
+                and time.monotonic() - listing.created < _CACHE_TTL:
+            _cache.move_to_end(key)
+            metrics.listing_cache.inc(result="hit")
+            return listing
+
+    metrics.listing_cache.inc(result="miss")
+    with metrics.listing_scan_duration.time():
+        rows = _read(path, sort, descending, pattern)
+    listing = _Listing(dir_mtime, rows)
+    with _cache_lock:
+        _cache[key] = listing
+        _cache.move_to_end(key)
+        while len(_cache) > _CACHE_SIZE:
+            _cache.popitem(last=False)
+    return listing
+
+
+def _read(path, sort, descending, pattern):
+    match = _matcher(pattern)
+    rows = []
+    with os.scandir(path) as entries:
+        for entry in entries:
+            if match and not match(entry.name):
+                continue
+            try:
+                is_dir = entry.is_dir()
+            except OSError:
+                is_dir = False
+            info = None
+            if sort == "name":
+                value = entry.name.casefold()
+            else:
+                info = _stat(entry)
+                if sort == "size":
+                    value = 0 if is_dir or info is None else info.st_size
+                else:
+                    value = info.st_mtime_ns if info is not None else 0
+            # Directories sort first; descending pages are read from the end.
+            kind = (1 if is_dir else 0) if descending else (0 if is_dir else 1)
+            rows.append(((kind, value, entry.name), entry.name, is_dir, info))
+    rows.sort(key=lambda row: row[0])
+    return rows
+
+
+def _matcher(pattern):
+    if not pattern:
+        return None
+    pattern = pattern.casefold()
+    if any(c in pattern for c in "*?["):
+        return lambda name: fnmatch.fnmatchcase(name.casefold(), pattern)
+    return lambda name: pattern in name.casefold()
+
+
+def _stat(entry):
+    try:
+        return entry.stat()
+    except OSError:
+        return None
+
+
+def _describe(path, row):
+    _, name, is_dir, info = row
+    if info is None:
+        try:
+            info = os.stat(os.path.join(path, name))
+        except OSError:
+            info = None
+    return {
+        "name": name,
+        "type": "directory" if is_dir else "file",
+        "size": "-" if is_dir or info is None else info.st_size,
+        "modified": info.st_mtime if info is not None else None,
+    }
+
+
+def encode_cursor(key, sort, descending):
+    """Encode the sort key of the last entry of a page, with the order it was sorted in."""
+    data = [sort, int(descending), *key]
+    return base64.urlsafe_b64encode(json.dumps(data).encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor, sort, descending):
+    """Return the (kind, value, name) key in `cursor`; ValueError unless it is for this sort and order."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        cursor_sort, cursor_descending, kind, value, name = json.loads(raw)
+    except (ValueError, TypeError):
+        raise ValueError("Invalid cursor")
+    if cursor_sort != sort or cursor_descending != int(descending):
+        raise ValueError("The cursor belongs to a listing in a different order")
+    value_type = str if sort == "name" else int
+    # bool is an int; JSON true/false is never a valid kind or value.
+    if kind not in (0, 1) or isinstance(kind, bool) or not isinstance(value, value_type) \
+            or isinstance(value, bool) or not isinstance(name, str):
+        raise ValueError("Invalid cursor")
+    return (kind, value, name)
+
+
+def stream_json(files, **fields):
+    """Yield a JSON object with `files` and `fields` in pieces, one per hundred files.
+
+    `files` may be any iterable; it is consumed as the pieces are sent.
+    """
+    head = json.dumps({"success": True, **fields})
+    yield head[:-1] + ', "files": ['
+    separator = ""
+    batch = []
+    for item in files:
+        batch.append(json.dumps(item))
+        if len(batch) == 100:
+            yield separator + ",".join(batch)
+            separator = ","
+            batch = []
+    if batch:
+        yield separator + ",".join(batch)
+    yield "]}"
@@ -0,0 +1,137 @@
+"""Counters and histograms exposed at /metrics in the Prometheus text format.
+
+Metrics are kept in memory per process; with several gunicorn or uvicorn
+workers each scrape sees the worker that answered it. Every metric is
+registered once at import time below, and the rest of the app only calls
+`inc()` or `observe()`, which take a lock and update a float.
+"""
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+PREFIX = "caddy_web_ui_"
+# Seconds; suits everything from a cached listing to a `caddy reload`.
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+_metrics = []
+
+
+class _Metric:
+    type = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = PREFIX + name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+        _metrics.append(self)
+
+    def _key(self, labels):
+        if set(labels) != set(self.labels):
+            raise ValueError(f"{self.name} takes labels {self.labels}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labels)
+
+    def _label_text(self, key, extra=""):
+        pairs = [f'{name}="{_escape(value)}"' for name, value in zip(self.labels, key)]
+        if extra:
+            pairs.append(extra)
+        return "{" + ",".join(pairs) + "}" if pairs else ""
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        with self._lock:
+            items = sorted(self._values.items())
+            lines.extend(self._render_values(items))
+        return lines
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _render_values(self, items):
+        return [f"{self.name}{self._label_text(key)} {_number(value)}" for key, value in items]
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * len(self.buckets), 0, 0.0]
+            index = bisect.bisect_left(self.buckets, value)
+            if index < len(self.buckets):
+                entry[0][index] += 1
+            entry[1] += 1
+            entry[2] += value
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def _render_values(self, items):
+        lines = []
+        for key, (counts, count, total) in items:
+            cumulative = 0
+            for bound, bucket in zip(self.buckets, counts):
+                cumulative += bucket
+                le = f'le="{_number(bound)}"'
+                lines.append(f"{self.name}_bucket{self._label_text(key, le)} {cumulative}")
+            le = 'le="+Inf"'
+            lines.append(f"{self.name}_bucket{self._label_text(key, le)} {count}")
+            lines.append(f"{self.name}_sum{self._label_text(key)} {_number(total)}")
+            lines.append(f"{self.name}_count{self._label_text(key)} {count}")
+        return lines
+
+
+def render():
+    """Return every metric in the Prometheus text exposition format."""
+    lines = []
+    for metric in _metrics:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+http_request_duration = Histogram(
+    "http_request_duration_seconds", "Time spent answering HTTP requests.", ("endpoint", "method"))
+http_requests = Counter(
+    "http_requests_total", "HTTP requests answered.", ("endpoint", "method", "status"))
+caddyfile_parses = Counter("caddyfile_parses_total", "Caddyfile parses.")
+caddyfile_parse_duration = Histogram("caddyfile_parse_duration_seconds", "Time spent parsing the Caddyfile.")
+caddyfile_writes = Counter("caddyfile_writes_total", "Caddyfile writes.")
+reload_duration = Histogram(
+    "caddy_reload_duration_seconds", "Time spent validating and reloading Caddy.", ("outcome",))
+node_push_duration = Histogram(
+    "caddy_node_push_duration_seconds", "Time spent pushing config to each Caddy node.", ("node", "outcome"))
+upload_bytes = Counter("upload_bytes_total", "Bytes received through uploads.")
+extract_files = Counter("extract_files_total", "Files extracted from archives.")
+extract_bytes = Counter("extract_bytes_total", "Bytes extracted from archives.")
+extract_failures = Counter("extract_failures_total", "Archive extractions that failed or were rejected.")
+listing_scan_duration = Histogram(
+    "listing_scan_duration_seconds", "Time spent in scandir() and stat() reading a directory listing.")
+listing_cache = Counter("listing_cache_total", "Directory listing cache lookups.", ("result",))
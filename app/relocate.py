@@ -0,0 +1,172 @@
+"""Move a site root to a new directory.
+
+On the same filesystem this is a single rename. Across filesystems the
+tree is copied by a thread pool into a hidden staging directory next to
+the destination, using a reflink (FICLONE) or copy_file_range() when the
+kernel offers them, checked against the source, and only then renamed
+into place and the source removed. A failed or cancelled copy removes the
+staging directory and leaves the source untouched.
+"""
+import errno
+import logging
+import os
+import shutil
+import stat
+import sys
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from app.utils import merge_tree
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# ioctl request number for FICLONE on Linux.
+FICLONE = 0x40049409
+COPY_CHUNK = 64 * 1024 * 1024
+
+
+class RelocationCancelled(Exception):
+    """Raised inside a relocation when its job was asked to stop."""
+
+
+def relocate_tree(source, target, job=None, workers=4):
+    """Move the directory `source` to `target`, merging into target if it exists.
+
+    Returns {"method": "rename" | "copy", "files": ..., "bytes": ...}.
+    """
+    source = os.path.abspath(source)
+    target = os.path.abspath(target)
+    if target == source or target.startswith(source + os.sep):
+        raise ValueError("Cannot move a directory into itself")
+    parent = os.path.dirname(target)
+    os.makedirs(parent, exist_ok=True)
+
+    if os.stat(source).st_dev == os.stat(parent).st_dev:
+        if os.path.exists(target):
+            merge_tree(source, target)
+            os.rmdir(source)
+        else:
+            os.rename(source, target)
+        logger.debug("Renamed %s to %s", source, target)
+        return {"method": "rename"}
+
+    staging = os.path.join(parent, f".{os.path.basename(target)}.relocate-{uuid.uuid4().hex}")
+    try:
+        files, total = _copy_tree(source, staging, job, workers)
+        _verify(files)
+        if os.path.exists(target):
+            merge_tree(staging, target)
+        else:
+            os.rename(staging, target)
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
+    shutil.rmtree(source)
+    logger.debug("Copied %d files (%d bytes) from %s to %s", len(files), total, source, target)
+    return {"method": "copy", "files": len(files), "bytes": total}
+
+
+def _copy_tree(source, staging, job, workers):
+    dirs = [(source, staging)]
+    files = []
+    links = []
+    total = 0
+    i = 0
+    while i < len(dirs):
+        src_dir, dst_dir = dirs[i]
+        i += 1
+        for entry in os.scandir(src_dir):
+            dst = os.path.join(dst_dir, entry.name)
+            if entry.is_symlink():
+                links.append((entry.path, dst))
+            elif entry.is_dir():
+                dirs.append((entry.path, dst))
+            else:
+                size = entry.stat().st_size
+                files.append((entry.path, dst, size))
+                total += size
+
+    for _, dst_dir in dirs:
+        os.makedirs(dst_dir, exist_ok=True)
+    for src, dst in links:
+        os.symlink(os.readlink(src), dst)
+
+    progress = {"files": 0, "bytes": 0}
+    lock = threading.Lock()
+    if job is not None:
+        job.update(files=0, bytes=0, total_files=len(files), total_bytes=total)
+
+    def copied(count, size):
+        with lock:
+            progress["files"] += count
+            progress["bytes"] += size
+            if job is not None:
+                job.update(**progress)
+
+    def copy(item):
+        src, dst, _ = item
+        _copy_file(src, dst, job, copied)
+        copied(1, 0)
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="relocate") as pool:
+        list(pool.map(copy, files))
+
+    # Directory times last, since creating their entries changed them.
+    for src_dir, dst_dir in reversed(dirs):
+        shutil.copystat(src_dir, dst_dir)
+    return files, total
+
+
+def _copy_file(src, dst, job, copied):
+    with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+        if not _reflink(fsrc, fdst):
+            _copy_data(fsrc, fdst, job, copied)
+        else:
+            copied(0, os.fstat(fsrc.fileno()).st_size)
+    shutil.copystat(src, dst)
+
+
+def _reflink(fsrc, fdst):
+    """Share the source's blocks with the destination (btrfs, XFS); False when unsupported."""
+    if fcntl is None or not sys.platform.startswith("linux"):
+        return False
+    try:
+        fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+        return True
+    except OSError:
+        return False
+
+
+def _copy_data(fsrc, fdst, job, copied):
+    use_range = hasattr(os, "copy_file_range")
+    while True:
+        if job is not None and job.cancel_requested():
+            raise RelocationCancelled()
+        if use_range:
+            try:
+                count = os.copy_file_range(fsrc.fileno(), fdst.fileno(), COPY_CHUNK)
+            except OSError as e:
+                if e.errno not in (errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.EPERM):
+                    raise
+                # Not supported between these filesystems; copy through user space.
+                use_range = False
+                continue
+        else:
+            data = fsrc.read(min(COPY_CHUNK, 8 * 1024 * 1024))
+            count = len(data)
+            fdst.write(data)
+        if not count:
+            return
+        copied(0, count)
+
+
+def _verify(files):
+    for src, dst, size in files:
+        st = os.lstat(dst)
+        if not stat.S_ISREG(st.st_mode) or st.st_size != size:
+            raise RuntimeError(f"Copy of {src} is incomplete ({st.st_size} of {size} bytes)")
@@ -1,76 +1,341 @@
 import os
-import json
-import bcrypt
-import zipfile
-from flask import Flask, request, jsonify, render_template, redirect, session, send_from_directory
-from flask import Flask, request, jsonify, render_template, redirect, session, send_from_directory
-from app.utils import parse_caddyfile, update_caddyfile
+import threading
+from werkzeug.middleware.proxy_fix import ProxyFix
+from flask import Flask, Response, g, request, jsonify, render_template, redirect, session, send_file, send_from_directory
+from app import metrics
+from app.auth import LoginThrottled, PasswordChecker
+from app.archives import ExtractLimits, extract_archive, is_archive
+from app.caddy import CaddyError, FleetBackend, ReloadQueue, reload_backend
+from app.caddyfile import CaddyfileError
+from app.datadirs import data_dir
+from app.history import HistoryError
+from app.indexer import FileIndex
+from app.jobs import JobRegistry
+from app.listing import list_directory, stream_json
+from app.relocate import RelocationCancelled, relocate_tree
+from app.trash import Trash, TrashError
+from app.uploads import UploadError, UploadStore
+from app.usage import QuotaExceeded, UsageScanner, check_quota, site_quota
+from app.validation import ValidationError, Validator
+from app.utils import (
+    FileChangedError,
+    JsonFileStore,
+    SiteOperationError,
+    add_site_block,
+    apply_site_operations,
+    caddyfile_history,
+    check_site_config,
+    file_etag,
+    format_caddyfile,
+    get_site_root_dir,
+    load_sites,
+    patch_file,
+    remove_site_block,
+    replace_site_block,
+    restore_caddyfile,
+    save_file,
+    set_history_dir,
+    set_validator,
+)
 from functools import wraps
-import shutil
 import secrets
+import signal
 import platform
 import logging
-import logging
+import time
 
 USERS_FILE = os.path.join("app", "config", "users.json")
 CONFIG_FILE = os.path.join("app", "config", "config.json")
-
-logging.basicConfig(level=logging.DEBUG)
+JOBS_DIR = os.path.join("app", "config", "jobs")
+UPLOADS_DIR = os.path.join("app", "config", "uploads")
+FILE_INDEX_DB = os.path.join("app", "config", "file-index.sqlite3")
+LOGIN_LIMITS_DB = os.path.join("app", "config", "login-limits.sqlite3")
+TRASH_INDEX = os.path.join("app", "config", "trash.json")
+HISTORY_DIR = os.path.join("app", "config", "history")
+DATA_DIR = os.path.join("app", "config", "data")
+UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+RELOAD_WAIT_SECONDS = 60
+EXTRACT_WAIT_SECONDS = 60
+# Files larger than this are opened in the editor one page at a time.
+EDITOR_INLINE_LIMIT = 2 * 1024 * 1024
+EDITOR_PAGE_SIZE = 512 * 1024
+SITES_PAGE_SIZE = 100
+SITES_MAX_PAGE_SIZE = 1000
+HISTORY_PAGE_SIZE = 50
+
+logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 def create_app():
     app = Flask(__name__)
 
-    if not os.path.exists(CONFIG_FILE):
-        with open(CONFIG_FILE, "w") as file:
-            json.dump({"first_run": True}, file)
+    config_store = JsonFileStore(CONFIG_FILE, default={"first_run": True})
+    config = config_store.get()
 
-    with open(CONFIG_FILE) as file:
-        config = json.load(file)
+    if not os.path.exists(CONFIG_FILE) or "secret_key" not in config:
+        config = config_store.update({"secret_key": config.get("secret_key") or secrets.token_hex(32)})
 
-    if "secret_key" not in config:
-        config["secret_key"] = secrets.token_hex(32)
-        with open(CONFIG_FILE, "w") as file:
-            json.dump(config, file, indent=4)
+    # Debug logging is off unless asked for; messages below the level are never formatted.
+    logging.getLogger().setLevel(str(config.get("log_level", "INFO")).upper())
 
     app.secret_key = config["secret_key"]
+    if config.get("proxy_count"):
+        # Behind Caddy, the client address comes from X-Forwarded-For.
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=int(config["proxy_count"]), x_proto=int(config["proxy_count"]))
     app.config['CADDYFILE'] = config.get("caddyfile", "")
+    # Larger files go through the chunked upload endpoints.
+    app.config['MAX_CONTENT_LENGTH'] = int(config.get("max_request_bytes", 2 * 1024 ** 3))
+
+    if hasattr(signal, "SIGHUP"):
+        try:
+            signal.signal(signal.SIGHUP, lambda signum, frame: config_store.reload())
+        except ValueError:
+            # Signal handlers can only be installed from the main thread.
+            pass
+
+    jobs = JobRegistry(JOBS_DIR)
+    reload_queue = ReloadQueue(
+        jobs,
+        lambda: reload_backend(config_store.get()),
+        window=float(config.get("reload_debounce", 0.5)),
+        max_delay=float(config.get("reload_max_delay", 5)),
+    )
+
+    # Every Caddyfile write is kept as a version that can be rolled back to.
+    set_history_dir(HISTORY_DIR if config.get("caddyfile_history", True) else None)
+    # New Caddyfile text is checked before it is written; see app/validation.py.
+    set_validator(lambda: Validator.from_config(config_store.get())
+                  if config_store.get().get("validate", True) else None)
+
+    uploads = UploadStore(UPLOADS_DIR)
+    trash = Trash(
+        jobs,
+        TRASH_INDEX,
+        lambda path, boundary: work_dir(path, "trash", exclude=[boundary] if boundary else []),
+        retention=float(config.get("trash_retention", 3600)),
+        rate=float(config.get("trash_purge_rate", 2000)),
+    )
+
+    usage_scanner = UsageScanner.from_config(config)
+
+    file_index = None
+    if config.get("file_index"):
+        file_index = FileIndex(
+            FILE_INDEX_DB,
+            lambda: load_sites(config_store.get().get("caddyfile", "")).roots.values(),
+            rescan_interval=float(config.get("file_index_rescan", 600)),
+        )
 
     @app.before_request
     def before_request():
-        with open(CONFIG_FILE) as file:
-            app.config['CURRENT_CONFIG'] = json.load(file)
-            app.config['CADDYFILE'] = app.config['CURRENT_CONFIG'].get("caddyfile", "")
+        g.request_started = time.perf_counter()
+        app.config['CURRENT_CONFIG'] = config_store.get()
+        app.config['CADDYFILE'] = app.config['CURRENT_CONFIG'].get("caddyfile", "")
+        if file_index:
+            file_index.start()
+        # Purges items left in the trash by earlier runs.
+        trash.start()
 
         if app.config['CURRENT_CONFIG'].get("first_run", True):
-            allowed_endpoints = {"setup", "static", "list-root-directories"}
+            allowed_endpoints = {"setup", "static", "list-root-directories", "metrics"}
             if request.endpoint not in allowed_endpoints:
                 return redirect("/setup")
-        elif "username" not in session and request.endpoint not in {"login", "static", "list-root-directories"}:
+        elif "username" not in session and request.endpoint not in {"login", "static", "list-root-directories", "metrics"}:
             return redirect("/login")
+
+    @app.after_request
+    def record_request(response):
+        started = g.get("request_started")
+        if started is not None:
+            # Unmatched URLs share one label so scanners cannot grow the metrics.
+            endpoint = request.endpoint or "unmatched"
+            method = request.method
+            metrics.http_requests.inc(endpoint=endpoint, method=method, status=response.status_code)
+
+            def observe():
+                metrics.http_request_duration.observe(time.perf_counter() - started, endpoint=endpoint,
+                                                      method=method)
+
+            if response.is_streamed:
+                # The body is produced after this returns; time it until the last piece is sent.
+                response.call_on_close(observe)
+            else:
+                observe()
+        return response
         
-    def get_site_root_dir(config):
-        logger.debug(f"Parsing config for root: {config}")
-        for line in config:
-            if line.strip().startswith('root'):
-                parts = line.strip().split()
-                if len(parts) >= 3:
-                    path = parts[2].rstrip('/')
-                    logger.debug(f"Found root path: {path}")
-                    return path
-        return None
-
-    def load_users():
-        if not os.path.exists(USERS_FILE):
-            return {}
-        with open(USERS_FILE, "r") as file:
-            return json.load(file)
-
-    def save_users(users):
-        with open(USERS_FILE, "w") as file:
-            json.dump(users, file)
-
-    users = load_users()
+    def start_relocation(old_root, new_root, on_success=None):
+        """Move a site's files to its new root in the background and return the job.
+
+        Returns None when there is nothing to move. `on_success` runs after
+        the move has been verified and may return extra result fields; if
+        it fails, the files are moved back to `old_root`. The job's "merged"
+        info is true when `new_root` already existed.
+        """
+        if not new_root or not old_root or old_root == new_root or not os.path.exists(old_root):
+            return None
+        merged = os.path.exists(new_root)
+        job = jobs.create("relocate", source=old_root, target=new_root, merged=merged)
+        workers = int(config_store.get().get("relocate_workers", 4))
+
+        def run():
+            job.start()
+            try:
+                logger.debug("Moving files from %s to %s", old_root, new_root)
+                result = relocate_tree(old_root, new_root, job=job, workers=workers)
+                if on_success:
+                    try:
+                        result.update(on_success() or {})
+                    except Exception:
+                        move_back(old_root, new_root, merged)
+                        raise
+                job.succeed(result)
+            except RelocationCancelled:
+                logger.info(f"Moving {old_root} to {new_root} was cancelled")
+                job.cancel()
+            except Exception as e:
+                logger.error(f"Moving {old_root} to {new_root} failed: {e}")
+                job.fail(e)
+
+        threading.Thread(target=run, name="relocate", daemon=True).start()
+        return job
+
+    def move_back(old_root, new_root, merged):
+        """Undo a relocation whose Caddyfile change was not written."""
+        # The Caddyfile still serves old_root, so the files belong there.
+        if merged:
+            logger.error(f"The files of {old_root} were merged into {new_root} and cannot be moved back")
+            return
+        try:
+            relocate_tree(new_root, old_root, workers=int(config_store.get().get("relocate_workers", 4)))
+        except Exception as e:
+            logger.error(f"Moving {new_root} back to {old_root} failed: {e}")
+
+    def work_dir(path, name, exclude=()):
+        """Directory `name` in an app data directory on the filesystem of `path`, or None.
+
+        Never inside a site root or `exclude`; see app/datadirs.py.
+        """
+        roots = [root for root in load_sites(app.config['CADDYFILE']).roots.values() if root] + list(exclude)
+        base = data_dir(path, [DATA_DIR, *config_store.get().get("data_dirs", [])], exclude=roots)
+        if base is None:
+            return None
+        directory = os.path.join(base, name)
+        os.makedirs(directory, exist_ok=True)
+        return directory
+
+    def start_extraction(archive_path, target_dir, name, cleanup=None, max_bytes=None, overwrite=True):
+        """Extract an archive into target_dir in the background and return the job.
+
+        `max_bytes` lowers the configured extraction limit, e.g. to what is left of a quota.
+        """
+        job = jobs.create("extract", archive=name, target=target_dir)
+        limits = ExtractLimits.from_config(config_store.get())
+        if max_bytes is not None:
+            limits.max_bytes = min(limits.max_bytes, max(0, max_bytes))
+
+        def run():
+            job.start()
+            result = error = None
+            try:
+                # Staged outside the site, so half-extracted files are never served.
+                staging_dir = work_dir(target_dir, "staging") or os.path.join(DATA_DIR, "staging")
+                result = extract_archive(archive_path, target_dir, limits, job=job, name=name,
+                                         staging_dir=staging_dir, overwrite=overwrite)
+            except Exception as e:
+                logger.error(f"Extracting {name} into {target_dir} failed: {e}")
+                error = e
+            finally:
+                usage_scanner.invalidate(target_dir, result["bytes"] if result else 0)
+                if cleanup:
+                    cleanup()
+                elif os.path.exists(archive_path):
+                    os.remove(archive_path)
+            # Only once the archive is gone, so a client polling the job never sees it left over.
+            if error is not None:
+                job.fail(error)
+            else:
+                job.succeed(result)
+
+        threading.Thread(target=run, name="extract", daemon=True).start()
+        return job
+
+    def trash_response(entry):
+        return {
+            "trash_id": entry["id"],
+            "undo_until": entry["purge_after"],
+            "purge_job": entry["purge_job"],
+        }
+
+    def index_path(root_dir, path):
+        """Return (root, relative path) as stored in the file index, or None if path is outside root_dir."""
+        root = os.path.abspath(root_dir)
+        relative = os.path.relpath(os.path.abspath(path), root)
+        if relative == os.curdir:
+            return root, ""
+        if relative.startswith(os.pardir):
+            return None
+        return root, relative.replace(os.sep, "/")
+
+    def site_file(root_dir, relative_path):
+        """Return the path of relative_path under root_dir, or None if it resolves outside root_dir.
+
+        Symlinks are followed, so a link pointing out of the site is refused too.
+        """
+        file_path = os.path.normpath(os.path.join(root_dir, relative_path.lstrip("/")))
+        root = os.path.realpath(root_dir)
+        if os.path.commonpath([root, os.path.realpath(file_path)]) != root:
+            return None
+        return file_path
+
+    def listing_response(directory, root_dir=None, **fields):
+        """Return one page of a directory listing as a streamed JSON response.
+
+        Query parameters: sort (name, size or modified), order (asc or
+        desc), q (filter), cursor (from the previous page) and limit.
+        Without limit or cursor, the whole directory is returned.
+        The file index answers when it is enabled and up to date.
+        """
+        options = {
+            "sort": request.args.get("sort", "name"),
+            "descending": request.args.get("order", "asc") == "desc",
+            "pattern": request.args.get("q"),
+            "cursor": request.args.get("cursor"),
+            "limit": request.args.get("limit", type=int),
+        }
+        page = None
+        if file_index and root_dir:
+            location = index_path(root_dir, directory)
+            if location:
+                page = file_index.listing(*location, **options)
+        if page is None:
+            page = list_directory(directory, **options)
+        files, next_cursor, total = page
+        return Response(stream_json(files, next_cursor=next_cursor, total=total, **fields),
+                        mimetype="application/json")
+
+    def quota_check(domain, site, root_dir, incoming):
+        """Check a write of `incoming` bytes against the site's quota.
+
+        Returns (soft quota warning or None, bytes left under the hard quota
+        or None); raises QuotaExceeded when the hard quota would be broken.
+        """
+        soft, hard = site_quota(config_store.get(), domain, site.domain)
+        if soft is None and hard is None:
+            return None, None
+        usage = file_index.dir_size(os.path.abspath(root_dir), "") if file_index else None
+        if usage is None:
+            usage = usage_scanner.usage(root_dir)["bytes"]
+        warning = check_quota(usage, incoming, soft, hard)
+        return warning, (hard - usage if hard is not None else None)
+
+    def find_site(domain):
+        """Look up a site and its root directory in the cached Caddyfile index."""
+        index = load_sites(app.config['CADDYFILE'])
+        return index.get(domain), index.root_dir(domain)
+
+    # Re-read when users.json changes, so every worker sees new users.
+    users_store = JsonFileStore(USERS_FILE, default={})
+    passwords = PasswordChecker.from_config(config, LOGIN_LIMITS_DB)
 
     def login_required(view):
         @wraps(view)
@@ -82,7 +347,7 @@ def create_app():
 
     @app.route("/setup", methods=["GET", "POST"])
     def setup():
-        if not users:
+        if not users_store.get():
             if request.method == "POST":
                 data = request.json
                 username = data.get("username")
@@ -91,9 +356,7 @@ def create_app():
                 if not username or not password:
                     return jsonify({"success": False, "error": "Username and password are required"}), 400
 
-                hashed_password = bcrypt.hashpw(password.encode("utf-8"), bcrypt.gensalt()).decode("utf-8")
-                users[username] = hashed_password
-                save_users(users)
+                users_store.update({username: passwords.hash(password)})
 
                 session["username"] = username
                 return jsonify({"success": True, "message": "User created successfully."})
@@ -111,15 +374,12 @@ def create_app():
                 if not os.path.isfile(caddyfile):
                     return jsonify({"success": False, "error": f"Caddyfile '{caddyfile}' does not exist."}), 400
 
-                app.config['CURRENT_CONFIG'].update({
+                app.config['CURRENT_CONFIG'] = config_store.update({
                     "caddyfile": caddyfile,
                     "port": int(port),
                     "first_run": False,
                 })
 
-                with open(CONFIG_FILE, "w") as file:
-                    json.dump(app.config['CURRENT_CONFIG'], file, indent=4)
-
                 app.config['CADDYFILE'] = caddyfile
                 return jsonify({"success": True, "message": "Configuration saved successfully."})
 
@@ -134,7 +394,17 @@ def create_app():
             username = data.get("username")
             password = data.get("password")
 
-            if username in users and bcrypt.checkpw(password.encode("utf-8"), users[username].encode("utf-8")):
+            if not isinstance(username, str) or not isinstance(password, str):
+                return jsonify({"success": False, "error": "Username and password are required"}), 400
+
+            try:
+                valid = passwords.check(users_store.get(), username, password, request.remote_addr)
+            except LoginThrottled as e:
+                response = jsonify({"success": False, "error": str(e)})
+                response.headers["Retry-After"] = str(e.retry_after)
+                return response, 429
+
+            if valid:
                 session["username"] = username
                 return jsonify({"success": True})
             
@@ -151,40 +421,199 @@ def create_app():
     @app.route("/")
     @login_required
     def home():
+        # Sites are loaded page by page from /api/sites.
+        return render_template("index.html")
+
+    @app.route("/api/sites")
+    @login_required
+    def api_sites():
+        """One page of sites, optionally filtered with `q`; see SiteIndex.search.
+
+        Query parameters: q, offset and limit. The ETag changes with the
+        Caddyfile, so an unchanged list is answered with 304.
+        """
         try:
-            sites = parse_caddyfile(app.config['CADDYFILE'])
-            return render_template("index.html", sites=sites, get_site_root_dir=get_site_root_dir)
+            index = load_sites(app.config['CADDYFILE'])
+            if request.if_none_match.contains(index.version):
+                response = Response(status=304)
+                response.set_etag(index.version)
+                return response
+
+            offset = max(0, request.args.get("offset", 0, type=int))
+            limit = max(1, min(request.args.get("limit", SITES_PAGE_SIZE, type=int), SITES_MAX_PAGE_SIZE))
+            matches = index.search(request.args.get("q", ""))
+            page = []
+            for site in matches[offset:offset + limit]:
+                config = site.config
+                page.append({
+                    "domain": site.domain,
+                    "addresses": site.addresses,
+                    "config": config,
+                    "root": index.root_dir(site.domain),
+                    "file_server": "file_server" in config,
+                })
+            next_offset = offset + limit if offset + limit < len(matches) else None
+
+            response = jsonify({"success": True, "sites": page, "total": len(matches),
+                                "next_offset": next_offset, "version": index.version})
+            response.set_etag(index.version)
+            response.cache_control.no_cache = True
+            return response
         except Exception as e:
             return jsonify({"success": False, "error": str(e)}), 500
 
     @app.route("/reload-caddy", methods=["POST"])
     @login_required
     def reload_caddy():
+        """Lay the Caddyfile out with `caddy fmt` (unless "caddy_fmt" is false), then reload Caddy."""
+        try:
+            warnings = []
+            config = config_store.get()
+            if config.get("caddy_fmt", True):
+                try:
+                    format_caddyfile(app.config['CADDYFILE'], reload_backend(config).format)
+                except (CaddyError, CaddyfileError) as e:
+                    logger.warning(f"caddy fmt skipped: {e}")
+                    warnings.append(f"caddy fmt skipped: {e}")
+            job = reload_queue.request(app.config['CADDYFILE'], delay=0)
+            if not job.wait(timeout=RELOAD_WAIT_SECONDS):
+                return jsonify({"success": True, "message": "Caddy reload is still running.", "reload_job": job.id,
+                                "warnings": warnings}), 202
+            if job.status == "failed":
+                return jsonify({"success": False, "error": job.error, "reload": job.result, "reload_job": job.id,
+                                "warnings": warnings}), 502
+            return jsonify({"success": True, "message": "Caddy reloaded successfully!", "reload": job.result,
+                            "reload_job": job.id, "warnings": warnings})
+        except ValidationError as e:
+            return jsonify({"success": False, "error": str(e), "errors": e.errors}), 400
+        except Exception as e:
+            return jsonify({"success": False, "error": str(e)}), 500
+
+    @app.route("/history")
+    @login_required
+    def list_versions():
+        """Recorded Caddyfile versions, newest first, with the sites each one changed."""
+        history = caddyfile_history(app.config['CADDYFILE'])
+        if history is None:
+            return jsonify({"success": False, "error": "Caddyfile history is disabled"}), 404
+        try:
+            offset = max(0, request.args.get("offset", 0, type=int))
+            limit = max(1, min(request.args.get("limit", HISTORY_PAGE_SIZE, type=int), SITES_MAX_PAGE_SIZE))
+            versions, total = history.versions(offset, limit)
+            next_offset = offset + limit if offset + limit < total else None
+            return jsonify({"success": True, "versions": versions, "total": total, "next_offset": next_offset})
+        except Exception as e:
+            return jsonify({"success": False, "error": str(e)}), 500
+
+    @app.route("/history/<version>")
+    @login_required
+    def version_diff(version):
+        """Per-site diffs of a version against its parent, or against `?against=<version>`."""
+        history = caddyfile_history(app.config['CADDYFILE'])
+        if history is None:
+            return jsonify({"success": False, "error": "Caddyfile history is disabled"}), 404
+        try:
+            diff = history.diff(version, against=request.args.get("against") or None)
+            if request.args.get("raw"):
+                diff["text"] = history.text(version)
+            return jsonify({"success": True, **diff})
+        except HistoryError as e:
+            return jsonify({"success": False, "error": str(e)}), 404
+        except Exception as e:
+            return jsonify({"success": False, "error": str(e)}), 500
+
+    @app.route("/history/<version>/rollback", methods=["POST"])
+    @login_required
+    def rollback_version(version):
+        """Write an earlier version back to the Caddyfile and reload Caddy at once."""
+        history = caddyfile_history(app.config['CADDYFILE'])
+        if history is None:
+            return jsonify({"success": False, "error": "Caddyfile history is disabled"}), 404
+        try:
+            restore_caddyfile(app.config['CADDYFILE'], history.text(version))
+            job = reload_queue.request(app.config['CADDYFILE'], delay=0)
+            return jsonify({"success": True, "message": f"Rolled back to version {version[:12]}",
+                            "version": version, "reload_job": job.id})
+        except ValidationError as e:
+            return jsonify({"success": False, "error": str(e), "errors": e.errors}), 400
+        except HistoryError as e:
+            return jsonify({"success": False, "error": str(e)}), 404
+        except Exception as e:
+            return jsonify({"success": False, "error": str(e)}), 500
+
+    @app.route("/nodes")
+    @login_required
+    def nodes_status():
+        """Reachability, latency and running config digest of every Caddy node in `caddy_nodes`."""
+        try:
+            backend = reload_backend(config_store.get())
+            if not isinstance(backend, FleetBackend):
+                return jsonify({"success": True, "nodes": []})
+            nodes = backend.status()
+            digests = {node["config_sha256"] for node in nodes if node["reachable"]}
+            return jsonify({"success": True, "nodes": nodes, "in_sync": len(digests) <= 1})
+        except Exception as e:
+            return jsonify({"success": False, "error": str(e)}), 500
+
+    @app.route("/jobs/<job_id>")
+    @login_required
+    def job_status(job_id):
+        job = jobs.get(job_id)
+        if job is None:
+            return jsonify({"success": False, "error": "Job not found"}), 404
+        return jsonify({"success": True, "job": job})
+
+    @app.route("/jobs/<job_id>/cancel", methods=["POST"])
+    @login_required
+    def cancel_job(job_id):
+        if not jobs.request_cancel(job_id):
+            return jsonify({"success": False, "error": "Job not found or already finished"}), 404
+        return jsonify({"success": True})
+
+    @app.route("/reload-config", methods=["POST"])
+    @login_required
+    def reload_config():
         try:
-            os.system(f"caddy fmt --overwrite {app.config['CADDYFILE']}")
-            os.system(f"caddy reload --config {app.config['CADDYFILE']}")
-            return jsonify({"success": True, "message": "Caddy reloaded successfully!"})
+            config_store.reload()
+            return jsonify({"success": True, "reloads": config_store.reload_count})
         except Exception as e:
             return jsonify({"success": False, "error": str(e)}), 500
 
+    @app.route("/config-status")
+    @login_required
+    def config_status():
+        return jsonify({"success": True, "path": config_store.path, "reloads": config_store.reload_count})
+
+    @app.route("/metrics", endpoint="metrics")
+    def metrics_endpoint():
+        """Prometheus metrics, for a logged-in user or with `Authorization: Bearer <metrics_token>`."""
+        token = app.config['CURRENT_CONFIG'].get("metrics_token")
+        supplied = request.headers.get("Authorization", "")
+        if "username" not in session and not (
+                token and secrets.compare_digest(supplied.encode("utf-8"), f"Bearer {token}".encode("utf-8"))):
+            return jsonify({"success": False, "error": "Unauthorized"}), 401
+        return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
     @app.route("/add-site", methods=["POST"])
     @login_required
     def add_site():
         try:
             data = request.json
             domain = data["domain"]
-            config = data["config"]
+            config = data["config"].split('\n') if isinstance(data["config"], str) else data["config"]
 
-            sites = parse_caddyfile(app.config['CADDYFILE'])
-            sites.append({"domain": domain, "config": config})
-            update_caddyfile(app.config['CADDYFILE'], sites)
+            add_site_block(app.config['CADDYFILE'], domain, config)
 
             root_dir = get_site_root_dir(config)
             if root_dir:
                 os.makedirs(root_dir, exist_ok=True)
 
-            os.system(f"caddy reload --config {app.config['CADDYFILE']}")
-            return jsonify({"success": True})
+            job = reload_queue.request(app.config['CADDYFILE'])
+            return jsonify({"success": True, "reload_job": job.id})
+        except ValidationError as e:
+            return jsonify({"success": False, "error": str(e), "errors": e.errors}), 400
+        except CaddyfileError as e:
+            return jsonify({"success": False, "error": str(e)}), 400
         except Exception as e:
             return jsonify({"success": False, "error": str(e)}), 500
 
@@ -194,18 +623,32 @@ def create_app():
         try:
             data = request.json
             domain = data["domain"]
-            sites = parse_caddyfile(app.config['CADDYFILE'])
-            
-            site = next((s for s in sites if s["domain"] == domain), None)
-            if site:
-                root_dir = get_site_root_dir(site["config"])
-                if root_dir and os.path.exists(root_dir):
-                    shutil.rmtree(root_dir)
-
-            sites = [s for s in sites if s["domain"] != domain]
-            update_caddyfile(app.config['CADDYFILE'], sites)
-            os.system(f"caddy reload --config {app.config['CADDYFILE']}")
-            return jsonify({"success": True, "message": f"Site '{domain}' deleted."})
+
+            site, root_dir = find_site(domain)
+            if not site:
+                return jsonify({"success": False, "error": "Site not found"}), 404
+
+            entry = None
+            if root_dir and os.path.lexists(root_dir):
+                # The block is kept with the files so a restore brings the site back.
+                entry = trash.move(root_dir, boundary=root_dir,
+                                   site={"domain": site.domain, "config": site.config})
+            try:
+                remove_site_block(app.config['CADDYFILE'], site.domain)
+            except Exception:
+                if entry:
+                    trash.restore(entry["id"])
+                raise
+            deleted = trash_response(entry) if entry else {}
+
+            job = reload_queue.request(app.config['CADDYFILE'])
+            return jsonify({"success": True, "message": f"Site '{domain}' deleted.", "reload_job": job.id, **deleted})
+        except TrashError as e:
+            return jsonify({"success": False, "error": str(e)}), 409
+        except ValidationError as e:
+            return jsonify({"success": False, "error": str(e), "errors": e.errors}), 400
+        except CaddyfileError as e:
+            return jsonify({"success": False, "error": str(e)}), 400
         except Exception as e:
             return jsonify({"success": False, "error": str(e)}), 500
 
@@ -217,115 +660,228 @@ def create_app():
             domain = data["domain"]
             new_config = data.get("config", "").split('\n') if isinstance(data.get("config"), str) else data["config"]
             
-            logger.debug(f"Editing site {domain} with new config: {new_config}")
-            sites = parse_caddyfile(app.config['CADDYFILE'])
-            
-            for site in sites:
-                if site["domain"] == domain:
-                    old_root = get_site_root_dir(site["config"])
-                    new_root = get_site_root_dir(new_config)
-                    logger.debug(f"Old root: {old_root}, New root: {new_root}")
-
-                    if old_root != new_root and new_root:
-                        if os.path.exists(old_root):
-                            logger.debug(f"Moving files from {old_root} to {new_root}")
-                            os.makedirs(new_root, exist_ok=True)
-                            for item in os.listdir(old_root):
-                                src = os.path.join(old_root, item)
-                                dst = os.path.join(new_root, item)
-                                if os.path.isdir(src):
-                                    shutil.copytree(src, dst)
-                                else:
-                                    shutil.copy2(src, dst)
-                            shutil.rmtree(old_root)
-                    
-                    site["config"] = new_config
-                    break
-
-            update_caddyfile(app.config['CADDYFILE'], sites)
-            os.system(f"caddy reload --config {app.config['CADDYFILE']}")
-            return jsonify({"success": True})
+            logger.debug("Editing site %s with new config: %s", domain, new_config)
+            site, old_root = find_site(domain)
+            if not site:
+                return jsonify({"success": False, "error": "Site not found"}), 404
+
+            new_root = get_site_root_dir(new_config)
+            logger.debug("Old root: %s, new root: %s", old_root, new_root)
+
+            # Caddy keeps serving the old root until the files have moved,
+            # so check the new config before moving anything.
+            check_site_config(app.config['CADDYFILE'], site.domain, new_config)
+
+            def update_site():
+                replace_site_block(app.config['CADDYFILE'], site.domain, new_config)
+                return {"reload_job": reload_queue.request(app.config['CADDYFILE']).id}
+
+            relocation = start_relocation(old_root, new_root, on_success=update_site)
+            if relocation:
+                return jsonify({"success": True, "relocate_job": relocation.id}), 202
+            return jsonify({"success": True, **update_site()})
+        except ValidationError as e:
+            return jsonify({"success": False, "error": str(e), "errors": e.errors}), 400
+        except CaddyfileError as e:
+            return jsonify({"success": False, "error": str(e)}), 400
         except Exception as e:
             logger.error(f"Error editing site: {str(e)}")
             return jsonify({"success": False, "error": str(e)}), 500
 
+    @app.route("/sites/batch", methods=["POST"])
+    @login_required
+    def batch_sites():
+        """Apply many create/update/delete operations with one write and one reload.
+
+        The batch is checked first. When sites move to a new root, their
+        files are moved before the Caddyfile is written, as /edit-site does;
+        the write then happens in a "batch" job once every move has
+        succeeded, and if any move fails nothing is written and the moved
+        files go back.
+        """
+        caddyfile_path = app.config['CADDYFILE']
+
+        def finish(applied):
+            deleted = []
+            for operation in applied:
+                if operation["op"] == "create":
+                    if operation["new_root"]:
+                        os.makedirs(operation["new_root"], exist_ok=True)
+                elif operation["op"] == "delete" and operation["old_root"] and os.path.lexists(operation["old_root"]):
+                    try:
+                        deleted.append(trash_response(trash.move(
+                            operation["old_root"], boundary=operation["old_root"],
+                            site={"domain": operation["domain"], "config": operation["old_config"]})))
+                    except TrashError as e:
+                        # The site is gone from the Caddyfile; its files are left where they were.
+                        logger.warning(str(e))
+                        deleted.append({"trash_id": None, "path": operation["old_root"], "error": str(e)})
+            job = reload_queue.request(caddyfile_path) if applied else None
+            return {"applied": len(applied), "reload_job": job.id if job else None, "deleted": deleted}
+
+        try:
+            data = request.json
+            operations = data.get("operations") if isinstance(data, dict) else data
+            if not isinstance(operations, list):
+                return jsonify({"success": False, "error": "Expected a list of operations"}), 400
+
+            planned = apply_site_operations(caddyfile_path, operations, write=False)
+            relocations = [job for job in (start_relocation(operation["old_root"], operation["new_root"])
+                                           for operation in planned if operation["op"] == "update") if job]
+            if not relocations:
+                return jsonify({"success": True, **finish(apply_site_operations(caddyfile_path, operations)),
+                                "relocate_jobs": []})
+
+            batch = jobs.create("batch", operations=len(operations),
+                                relocate_jobs=[relocation.id for relocation in relocations])
+
+            def run():
+                batch.start()
+                for relocation in relocations:
+                    relocation.wait()
+                try:
+                    failed = [relocation for relocation in relocations if relocation.status != "succeeded"]
+                    if failed:
+                        raise RuntimeError(f"{len(failed)} of {len(relocations)} moves did not finish; "
+                                           f"the Caddyfile was not changed")
+                    applied = apply_site_operations(caddyfile_path, operations)
+                except Exception as e:
+                    logger.error(f"Batch of {len(operations)} site operations failed: {e}")
+                    for relocation in relocations:
+                        if relocation.status == "succeeded":
+                            move_back(relocation.info["source"], relocation.info["target"],
+                                      relocation.info["merged"])
+                    batch.fail(e, result={"errors": getattr(e, "errors", [])})
+                    return
+                try:
+                    batch.succeed(finish(applied))
+                except Exception as e:
+                    logger.error(f"Finishing a batch of site operations failed: {e}")
+                    batch.fail(e)
+
+            threading.Thread(target=run, name="batch", daemon=True).start()
+            return jsonify({"success": True, "batch_job": batch.id,
+                            "relocate_jobs": [relocation.id for relocation in relocations]}), 202
+        except SiteOperationError as e:
+            return jsonify({"success": False, "error": str(e), "errors": e.errors}), 400
+        except ValidationError as e:
+            return jsonify({"success": False, "error": str(e), "errors": e.errors}), 400
+        except CaddyfileError as e:
+            return jsonify({"success": False, "error": str(e)}), 400
+        except Exception as e:
+            return jsonify({"success": False, "error": str(e)}), 500
+
     @app.route("/list-files/<path:site_path>", methods=["GET"])
     @login_required
     def list_files(site_path):
         try:
-            logger.debug(f"Caddyfile path: {app.config['CADDYFILE']}")
-            sites = parse_caddyfile(app.config['CADDYFILE'])
-            logger.debug(f"Parsed sites: {sites}")
-            
             domain = site_path.split('/')[0]
-            logger.debug(f"Looking for domain: {domain}")
             relative_path = '/'.join(site_path.split('/')[1:])
-            logger.debug(f"Relative path: {relative_path}")
+            logger.debug("Listing %r in %s", relative_path, domain)
 
-            site = next((s for s in sites if s["domain"] == domain), None)
+            site, root_dir = find_site(domain)
             if not site:
                 logger.error(f"Site not found for domain: {domain}")
                 return jsonify({"success": False, "error": "Site not found"}), 404
 
-            logger.debug(f"Found site config: {site}")
-            root_dir = get_site_root_dir(site["config"])
             if not root_dir:
                 logger.error("No root directory configured in site config")
                 return jsonify({"success": False, "error": "No root directory configured"}), 400
 
-            logger.debug(f"Root directory: {root_dir}")
             target_path = os.path.join(root_dir, relative_path)
             target_path = os.path.normpath(target_path)
-            logger.debug(f"Target path: {target_path}")
-            logger.debug(f"Path exists: {os.path.exists(target_path)}")
 
             if not os.path.exists(target_path):
-                logger.debug(f"Creating directory: {target_path}")
+                logger.debug("Creating directory: %s", target_path)
                 os.makedirs(target_path)
 
-            items = []
-            for entry in os.scandir(target_path):
-                items.append({
-                    "name": entry.name,
-                    "type": "directory" if entry.is_dir() else "file",
-                    "size": os.path.getsize(entry) if not entry.is_dir() else "-",
-                    "modified": os.path.getmtime(entry),
-                })
-            logger.debug(f"Found items: {items}")
-            return jsonify({"success": True, "files": items})
+            return listing_response(target_path, root_dir)
+        except ValueError as e:
+            return jsonify({"success": False, "error": str(e)}), 400
         except Exception as e:
             logger.error(f"Error listing files: {str(e)}")
             return jsonify({"success": False, "error": str(e)}), 500
         
 
+    @app.route("/raw-file/<path:site_path>", methods=["GET"])
+    @login_required
+    def raw_file(site_path):
+        """Stream a file, honouring Range, If-Range and If-None-Match."""
+        try:
+            parts = site_path.split("/", 1)
+            domain = parts[0]
+            relative_path = parts[1] if len(parts) > 1 else ""
+
+            site, root_dir = find_site(domain)
+            if not site:
+                return jsonify({"success": False, "error": "Site not found"}), 404
+
+            if not root_dir:
+                return jsonify({"success": False, "error": "No root directory configured"}), 400
+
+            file_path = site_file(root_dir, relative_path)
+            if file_path is None:
+                return jsonify({"success": False, "error": "Invalid path"}), 400
+            if not os.path.isfile(file_path):
+                return jsonify({"success": False, "error": "File not found"}), 404
+
+            return send_file(file_path, conditional=True, etag=file_etag(os.stat(file_path)), max_age=0,
+                             as_attachment="download" in request.args)
+        except Exception as e:
+            logger.error(f"Error in raw_file: {str(e)}")
+            return jsonify({"success": False, "error": str(e)}), 500
+
     @app.route("/edit-file/<path:site_path>/<filename>", methods=["GET"])
     @login_required
     def get_file_content(site_path, filename):
-        """Fetch the content of a file."""
+        """Fetch the content of a file.
+
+        Files over EDITOR_INLINE_LIMIT are returned one page at a time: pass
+        `offset` (the `end` of the previous page) to get the next one. Pages
+        end on a line break, so they can be edited and saved on their own.
+        """
         try:
-            sites = parse_caddyfile(app.config['CADDYFILE'])
-            domain = site_path.split('/')[0]
+            parts = site_path.split('/', 1)
+            domain = parts[0]
             
-            logger.debug(f"Getting file content for domain: {domain}, filename: {filename}")
+            logger.debug("Getting file content for domain: %s, filename: %s", domain, filename)
             
-            site = next((s for s in sites if s["domain"] == domain), None)
+            site, root_dir = find_site(domain)
             if not site:
                 return jsonify({"success": False, "error": "Site not found"}), 404
 
-            root_dir = get_site_root_dir(site["config"])
             if not root_dir:
                 return jsonify({"success": False, "error": "No root directory configured"}), 400
 
-            file_path = os.path.normpath(os.path.join(root_dir, filename))
-            logger.debug(f"Attempting to read file: {file_path}")
+            relative_path = os.path.join(parts[1], filename) if len(parts) > 1 else filename
+            file_path = site_file(root_dir, relative_path)
+            if file_path is None:
+                return jsonify({"success": False, "error": "Invalid path"}), 400
+            logger.debug("Attempting to read file: %s", file_path)
 
             if not os.path.exists(file_path):
                 logger.error(f"File not found: {file_path}")
                 return jsonify({"success": False, "error": "File not found"}), 404
 
-            with open(file_path, "r", encoding="utf-8") as file:
-                content = file.read()
-            return jsonify({"success": True, "content": content})
+            with open(file_path, "rb") as file:
+                st = os.fstat(file.fileno())
+                result = {"success": True, "etag": file_etag(st), "size": st.st_size}
+                if st.st_size <= EDITOR_INLINE_LIMIT and "offset" not in request.args:
+                    data = file.read()
+                else:
+                    offset = min(max(request.args.get("offset", 0, type=int), 0), st.st_size)
+                    file.seek(offset)
+                    data = file.read(EDITOR_PAGE_SIZE)
+                    if offset + len(data) < st.st_size and not data.endswith(b"\n"):
+                        # Extend the page to the end of its last line.
+                        rest = file.readline(EDITOR_PAGE_SIZE)
+                        data += rest
+                    result.update(paged=True, offset=offset, end=offset + len(data))
+            try:
+                result["content"] = data.decode("utf-8")
+            except UnicodeDecodeError:
+                return jsonify({"success": False, "error": "Only UTF-8 text files can be edited"}), 415
+            return jsonify(result)
         except Exception as e:
             logger.error(f"Error in get_file_content: {str(e)}")
             return jsonify({"success": False, "error": str(e)}), 500
@@ -333,29 +889,57 @@ def create_app():
     @app.route("/save-file/<path:site_path>/<filename>", methods=["POST"])
     @login_required
     def save_file_content(site_path, filename):
-        """Save updated file content."""
+        """Save updated file content.
+
+        Send either {"content"} to replace the whole file or {"edits":
+        [{"offset", "length", "content"}]} to replace byte ranges. With an
+        `etag` (required for edits) the save fails with 409 if the file has
+        changed since it was read. Files are replaced with a temp file and a
+        rename; the response carries the new `etag`.
+        """
         try:
-            sites = parse_caddyfile(app.config['CADDYFILE'])
-            domain = site_path.split('/')[0]
+            parts = site_path.split('/', 1)
+            domain = parts[0]
             
-            site = next((s for s in sites if s["domain"] == domain), None)
+            site, root_dir = find_site(domain)
             if not site:
                 return jsonify({"success": False, "error": "Site not found"}), 404
 
-            root_dir = get_site_root_dir(site["config"])
             if not root_dir:
                 return jsonify({"success": False, "error": "No root directory configured"}), 400
 
-            file_path = os.path.join(root_dir, filename)
-            logger.debug(f"Saving to file: {file_path}")
+            relative_path = os.path.join(parts[1], filename) if len(parts) > 1 else filename
+            file_path = site_file(root_dir, relative_path)
+            if file_path is None:
+                return jsonify({"success": False, "error": "Invalid path"}), 400
+            logger.debug("Saving to file: %s", file_path)
 
             if not os.path.exists(os.path.dirname(file_path)):
                 os.makedirs(os.path.dirname(file_path))
 
-            content = request.json.get("content", "")
-            with open(file_path, "w", encoding="utf-8") as file:
-                file.write(content)
-            return jsonify({"success": True, "message": "File saved successfully!"})
+            data = request.json or {}
+            if "edits" in data:
+                growth = sum(len(edit.get("content", "").encode("utf-8")) - int(edit["length"]) for edit in data["edits"])
+            else:
+                growth = len(data.get("content", "").encode("utf-8"))
+                growth -= os.path.getsize(file_path) if os.path.isfile(file_path) else 0
+            warning, _ = quota_check(domain, site, root_dir, growth)
+
+            if "edits" in data:
+                if not data.get("etag"):
+                    return jsonify({"success": False, "error": "Edits need the etag of the version they apply to"}), 428
+                etag = patch_file(file_path, data["edits"], data["etag"])
+            else:
+                etag = save_file(file_path, data.get("content", ""), data.get("etag"))
+            usage_scanner.invalidate(file_path, growth)
+            return jsonify({"success": True, "message": "File saved successfully!", "etag": etag,
+                            "quota_warning": warning})
+        except QuotaExceeded as e:
+            return jsonify({"success": False, "error": str(e), "usage": e.usage, "quota": e.limit}), 507
+        except FileChangedError as e:
+            return jsonify({"success": False, "error": str(e), "etag": e.etag}), 409
+        except (KeyError, TypeError, ValueError) as e:
+            return jsonify({"success": False, "error": f"Invalid edits: {e}"}), 400
         except Exception as e:
             logger.error(f"Error in save_file_content: {str(e)}")
             return jsonify({"success": False, "error": str(e)}), 500
@@ -365,30 +949,33 @@ def create_app():
     @login_required
     def upload_file(site_path):
         try:
-            sites = parse_caddyfile(app.config['CADDYFILE'])
             parts = site_path.split("/", 1)
             domain = parts[0]
             relative_path = parts[1] if len(parts) > 1 else ""
 
-            site = next((s for s in sites if s["domain"] == domain), None)
+            site, root_dir = find_site(domain)
             if not site:
                 return jsonify({"success": False, "error": "Site not found"}), 404
 
-            root_dir = get_site_root_dir(site["config"])
             if not root_dir:
                 return jsonify({"success": False, "error": "No root directory configured"}), 400
 
             full_path = os.path.normpath(os.path.join(root_dir, relative_path))
             os.makedirs(full_path, exist_ok=True)
 
+            # The request body is a little larger than the files in it.
+            warning, _ = quota_check(domain, site, root_dir, request.content_length or 0)
             if "files" not in request.files:
                 return jsonify({"success": False, "error": "No files in request"}), 400
 
             for file in request.files.getlist("files"):
                 if file.filename:
                     file.save(os.path.join(full_path, file.filename))
+            usage_scanner.invalidate(full_path, request.content_length or 0)
 
-            return jsonify({"success": True, "message": "Files uploaded successfully"})
+            return jsonify({"success": True, "message": "Files uploaded successfully", "quota_warning": warning})
+        except QuotaExceeded as e:
+            return jsonify({"success": False, "error": str(e), "usage": e.usage, "quota": e.limit}), 507
         except Exception as e:
             return jsonify({"success": False, "error": str(e)}), 500
 
@@ -396,16 +983,14 @@ def create_app():
     @login_required
     def upload_zip(site_path):
         try:
-            sites = parse_caddyfile(app.config['CADDYFILE'])
             parts = site_path.split("/", 1)
             domain = parts[0]
             relative_path = parts[1] if len(parts) > 1 else ""
 
-            site = next((s for s in sites if s["domain"] == domain), None)
+            site, root_dir = find_site(domain)
             if not site:
                 return jsonify({"success": False, "error": "Site not found"}), 404
 
-            root_dir = get_site_root_dir(site["config"])
             if not root_dir:
                 return jsonify({"success": False, "error": "No root directory configured"}), 400
 
@@ -416,31 +1001,134 @@ def create_app():
                 return jsonify({"success": False, "error": "No ZIP file in request"}), 400
 
             zip_file = request.files["zip"]
-            zip_path = os.path.join(full_path, zip_file.filename)
-            zip_file.save(zip_path)
-
-            try:
-                with zipfile.ZipFile(zip_path, "r") as zip_ref:
-                    zip_ref.extractall(full_path)
-                os.remove(zip_path)
-                return jsonify({"success": True, "message": "ZIP extracted successfully"})
-            except zipfile.BadZipFile:
-                return jsonify({"success": False, "error": "Invalid ZIP file"}), 400
+            if not is_archive(zip_file.filename):
+                return jsonify({"success": False, "error": "Unsupported archive type"}), 400
+
+            # The extracted size is only known while extracting, so the rest of the quota caps it.
+            warning, remaining = quota_check(domain, site, root_dir, request.content_length or 0)
+            # Kept out of the site root, where it would be served and counted against the quota.
+            archive_path = uploads.staging_path()
+            zip_file.save(archive_path)
+            job = start_extraction(archive_path, full_path, zip_file.filename, max_bytes=remaining,
+                                   overwrite=request.form.get("overwrite", "1") not in ("0", "false"))
+            if not job.wait(EXTRACT_WAIT_SECONDS):
+                return jsonify({"success": True, "message": "Extraction in progress", "extract_job": job.id,
+                                "quota_warning": warning}), 202
+            if job.status == "failed":
+                return jsonify({"success": False, "error": job.error, "extract_job": job.id}), 400
+            return jsonify({"success": True, "message": "Archive extracted successfully", "extract_job": job.id,
+                            "quota_warning": warning})
+        except QuotaExceeded as e:
+            return jsonify({"success": False, "error": str(e), "usage": e.usage, "quota": e.limit}), 507
         except Exception as e:
             return jsonify({"success": False, "error": str(e)}), 500
         
+    @app.route("/upload-init/<path:site_path>", methods=["POST"])
+    @login_required
+    def upload_init(site_path):
+        """Start a chunked upload; send the bytes with PUT /uploads/<id>?offset=N."""
+        try:
+            parts = site_path.split("/", 1)
+            domain = parts[0]
+            relative_path = parts[1] if len(parts) > 1 else ""
+
+            site, root_dir = find_site(domain)
+            if not site:
+                return jsonify({"success": False, "error": "Site not found"}), 404
+
+            if not root_dir:
+                return jsonify({"success": False, "error": "No root directory configured"}), 400
+
+            data = request.json or {}
+            filename = data.get("filename") or ""
+            if os.path.basename(filename) != filename or filename in ("", ".", ".."):
+                return jsonify({"success": False, "error": "Invalid file name"}), 400
+
+            if data.get("extract") and not is_archive(filename):
+                return jsonify({"success": False, "error": "Unsupported archive type"}), 400
+
+            size = data.get("size")
+            warning, _ = quota_check(domain, site, root_dir, size if isinstance(size, int) else 0)
+
+            full_path = os.path.normpath(os.path.join(root_dir, relative_path))
+            upload = uploads.create(
+                os.path.join(full_path, filename),
+                data.get("size"),
+                sha256=data.get("sha256"),
+                extract=data.get("extract", False),
+                overwrite=bool(data.get("overwrite", True)),
+                domain=domain,
+                user=session.get("username"),
+            )
+            return jsonify({"success": True, "chunk_size": UPLOAD_CHUNK_SIZE, "quota_warning": warning, **upload})
+        except QuotaExceeded as e:
+            return jsonify({"success": False, "error": str(e), "usage": e.usage, "quota": e.limit}), 507
+        except UploadError as e:
+            return jsonify({"success": False, "error": str(e)}), e.status
+        except Exception as e:
+            return jsonify({"success": False, "error": str(e)}), 500
+
+    def get_upload(upload_id):
+        upload = uploads.get(upload_id)
+        if upload is None or upload.get("user") != session.get("username"):
+            raise UploadError("Upload not found", status=404)
+        return upload
+
+    @app.route("/uploads/<upload_id>", methods=["GET", "PUT", "DELETE"])
+    @login_required
+    def upload_chunk(upload_id):
+        """Report the offset to resume from, append a chunk, or abort an upload."""
+        try:
+            upload = get_upload(upload_id)
+            if request.method == "DELETE":
+                uploads.discard(upload)
+                return jsonify({"success": True})
+            if request.method == "PUT":
+                offset = request.args.get("offset", type=int)
+                if offset is None:
+                    return jsonify({"success": False, "error": "Missing offset"}), 400
+                offset = uploads.write(upload, offset, request.stream)
+                return jsonify({"success": True, "offset": offset, "size": upload["size"]})
+            return jsonify({"success": True, **uploads.status(upload)})
+        except UploadError as e:
+            return jsonify({"success": False, "error": str(e), "offset": e.offset}), e.status
+        except Exception as e:
+            return jsonify({"success": False, "error": str(e)}), 500
+
+    @app.route("/uploads/<upload_id>/finalize", methods=["POST"])
+    @login_required
+    def upload_finalize(upload_id):
+        """Verify a complete upload and move it into place, or extract it."""
+        try:
+            upload = get_upload(upload_id)
+            if upload.get("extract_job"):
+                return jsonify({"success": True, "extract_job": upload["extract_job"]}), 202
+            part, digest = uploads.finish(upload, (request.get_json(silent=True) or {}).get("sha256"))
+            if upload["extract"]:
+                target_dir, name = os.path.split(upload["target"])
+                job = start_extraction(part, target_dir, name, cleanup=lambda: uploads.discard(upload),
+                                       overwrite=upload.get("overwrite", True))
+                uploads.update(upload, extract_job=job.id)
+                return jsonify({"success": True, "sha256": digest, "size": upload["size"], "extract_job": job.id}), 202
+            os.replace(part, upload["target"])
+            uploads.discard(upload)
+            usage_scanner.invalidate(upload["target"], upload["size"])
+            return jsonify({"success": True, "sha256": digest, "size": upload["size"]})
+        except UploadError as e:
+            return jsonify({"success": False, "error": str(e), "offset": e.offset}), e.status
+        except Exception as e:
+            return jsonify({"success": False, "error": str(e)}), 500
+
     @app.route("/create-dir/<path:site_path>/<dirname>", methods=["POST"])
     @login_required
     def create_directory(site_path, dirname):
         try:
-            sites = parse_caddyfile(app.config['CADDYFILE'])
             domain = site_path.split('/')[0]
 
-            site = next((s for s in sites if s["domain"] == domain), None)
+            site, root_dir = find_site(domain)
             if not site:
                 return jsonify({"success": False, "error": "Site not found"}), 404
 
-            root_dir = get_site_root_dir(site["config"])
             if not root_dir:
                 return jsonify({"success": False, "error": "No root directory configured"}), 400
 
@@ -456,29 +1144,190 @@ def create_app():
     @login_required
     def delete_file(site_path):
         try:
-            sites = parse_caddyfile(app.config['CADDYFILE'])
             parts = site_path.split("/", 1)
             domain = parts[0]
             relative_path = parts[1] if len(parts) > 1 else ""
 
-            site = next((s for s in sites if s["domain"] == domain), None)
+            site, root_dir = find_site(domain)
             if not site:
                 return jsonify({"success": False, "error": "Site not found"}), 404
 
-            root_dir = get_site_root_dir(site["config"])
             if not root_dir:
                 return jsonify({"success": False, "error": "No root directory configured"}), 400
 
             file_path = os.path.normpath(os.path.join(root_dir, relative_path))
+            location = index_path(root_dir, file_path)
+            if location is None or not location[1]:
+                return jsonify({"success": False, "error": "Invalid path"}), 400
+
+            entry = trash.move(file_path, boundary=root_dir)
+            return jsonify({"success": True, "message": "Deleted successfully", **trash_response(entry)})
+        except FileNotFoundError:
+            return jsonify({"success": False, "error": "File not found"}), 404
+        except TrashError as e:
+            return jsonify({"success": False, "error": str(e)}), 409
+        except Exception as e:
+            return jsonify({"success": False, "error": str(e)}), 500
+
+    @app.route("/trash", methods=["GET"])
+    @login_required
+    def list_trash():
+        return jsonify({"success": True, "items": trash.entries()})
+
+    @app.route("/trash/<trash_id>/restore", methods=["POST"])
+    @login_required
+    def restore_trash(trash_id):
+        """Undo a delete that is still within the trash retention window.
+
+        For a deleted site, its Caddyfile block is added back before its files.
+        """
+        try:
+            entry = trash.get(trash_id)
+            if entry is None:
+                return jsonify({"success": False, "error": "Item not found in the trash"}), 404
+            site = entry.get("site")
+            if site:
+                if load_sites(app.config['CADDYFILE']).get(site["domain"]):
+                    return jsonify({"success": False, "error": f"Site '{site['domain']}' exists again"}), 409
+                add_site_block(app.config['CADDYFILE'], site["domain"], site["config"])
+            try:
+                path = trash.restore(trash_id)
+            except Exception:
+                if site:
+                    remove_site_block(app.config['CADDYFILE'], site["domain"])
+                raise
+            job = reload_queue.request(app.config['CADDYFILE']) if site else None
+            return jsonify({"success": True, "path": path, "reload_job": job.id if job else None})
+        except KeyError:
+            return jsonify({"success": False, "error": "Item not found in the trash"}), 404
+        except TrashError as e:
+            return jsonify({"success": False, "error": str(e)}), 409
+        except ValidationError as e:
+            return jsonify({"success": False, "error": str(e), "errors": e.errors}), 400
+        except CaddyfileError as e:
+            return jsonify({"success": False, "error": str(e)}), 400
+        except Exception as e:
+            return jsonify({"success": False, "error": str(e)}), 500
+
+    @app.route("/dir-size/<path:site_path>")
+    @login_required
+    def dir_size(site_path):
+        """Recursive size of a directory, from the file index when it is enabled."""
+        try:
+            parts = site_path.split("/", 1)
+            domain = parts[0]
+            relative_path = parts[1] if len(parts) > 1 else ""
+
+            site, root_dir = find_site(domain)
+            if not site:
+                return jsonify({"success": False, "error": "Site not found"}), 404
 
-            if os.path.isdir(file_path):
-                shutil.rmtree(file_path)
+            if not root_dir:
+                return jsonify({"success": False, "error": "No root directory configured"}), 400
+
+            target_path = os.path.normpath(os.path.join(root_dir, relative_path))
+            if not os.path.isdir(target_path):
+                return jsonify({"success": False, "error": "Directory not found"}), 404
+
+            location = index_path(root_dir, target_path)
+            size = file_index.dir_size(*location) if file_index and location else None
+            if size is not None:
+                return jsonify({"success": True, "size": size, "indexed": True})
+
+            size = 0
+            for dirpath, dirnames, filenames in os.walk(target_path):
+                for filename in filenames:
+                    try:
+                        size += os.lstat(os.path.join(dirpath, filename)).st_size
+                    except OSError:
+                        pass
+            return jsonify({"success": True, "size": size, "indexed": False})
+        except Exception as e:
+            return jsonify({"success": False, "error": str(e)}), 500
+
+    @app.route("/api/usage")
+    @login_required
+    def api_usage():
+        """Disk usage of every site root from the last scan; stale roots are rescanned in the background."""
+        try:
+            index = load_sites(app.config['CADDYFILE'])
+            current = config_store.get()
+            roots = {domain: root for domain, root in index.roots.items() if root}
+            usage_scanner.refresh(set(roots.values()))
+            sites = {}
+            for domain, root in roots.items():
+                result = usage_scanner.cached(root)
+                soft, hard = site_quota(current, domain, *index.get(domain).addresses)
+                sites[domain] = {
+                    "bytes": result["bytes"] if result else None,
+                    "files": result["files"] if result else None,
+                    "scanned": result["scanned"] if result else None,
+                    "soft_quota": soft,
+                    "hard_quota": hard,
+                }
+            return jsonify({"success": True, "sites": sites, "scanning": usage_scanner.scanning})
+        except Exception as e:
+            return jsonify({"success": False, "error": str(e)}), 500
+
+    @app.route("/api/usage/<domain>")
+    @login_required
+    def site_usage(domain):
+        """Usage totals and largest files of one site; `?refresh=1` rescans first."""
+        try:
+            site, root_dir = find_site(domain)
+            if not site:
+                return jsonify({"success": False, "error": "Site not found"}), 404
+
+            if not root_dir:
+                return jsonify({"success": False, "error": "No root directory configured"}), 400
+
+            if not os.path.isdir(root_dir):
+                return jsonify({"success": False, "error": "Directory not found"}), 404
+
+            if request.args.get("refresh"):
+                result = usage_scanner.scan(root_dir)
             else:
-                os.remove(file_path)
-            return jsonify({"success": True, "message": "Deleted successfully"})
+                result = usage_scanner.usage(root_dir)
+            soft, hard = site_quota(config_store.get(), domain, site.domain)
+            return jsonify({"success": True, **result, "soft_quota": soft, "hard_quota": hard})
         except Exception as e:
             return jsonify({"success": False, "error": str(e)}), 500
 
+    @app.route("/search-files/<domain>")
+    @login_required
+    def search_files(domain):
+        """Find files under a site root by name; needs the file index."""
+        try:
+            site, root_dir = find_site(domain)
+            if not site:
+                return jsonify({"success": False, "error": "Site not found"}), 404
+
+            if not root_dir:
+                return jsonify({"success": False, "error": "No root directory configured"}), 400
+
+            query = request.args.get("q", "").strip()
+            if not query:
+                return jsonify({"success": False, "error": "Missing search query"}), 400
+
+            if not file_index:
+                return jsonify({"success": False, "error": "The file index is disabled"}), 400
+
+            results = file_index.search(os.path.abspath(root_dir), query,
+                                        limit=min(request.args.get("limit", 200, type=int), 1000))
+            if results is None:
+                return jsonify({"success": False, "error": "This site has not been indexed yet"}), 409
+            return jsonify({"success": True, "files": results})
+        except Exception as e:
+            return jsonify({"success": False, "error": str(e)}), 500
+
+    @app.route("/index-status")
+    @login_required
+    def index_status():
+        if not file_index:
+            return jsonify({"success": True, "enabled": False, "roots": []})
+        return jsonify({"success": True, "enabled": True, "indexing": file_index.indexing,
+                        "roots": file_index.status()})
+
     @app.route("/list-root-directories")
     @login_required
     def list_root_directories():
@@ -489,20 +1338,15 @@ def create_app():
                 if not os.path.exists(root_path):
                     return jsonify({"success": False, "error": f"Path '{root_path}' does not exist"}), 404
                 
-                items = [{
-                    "name": entry.name,
-                    "type": "directory" if entry.is_dir() else "file",
-                    "size": os.path.getsize(entry) if entry.is_file() else "-",
-                    "modified": os.path.getmtime(entry),
-                } for entry in os.scandir(root_path)]
-
-                return jsonify({"success": True, "path": root_path, "files": items})
+                return listing_response(root_path, path=root_path)
             else:
                 if platform.system() == "Windows":
                     drives = [f"{chr(d)}:\\" for d in range(65, 91) if os.path.exists(f"{chr(d)}:\\")]
                     return jsonify({"success": True, "path": "root", "files": [{"name": drive, "type": "directory"} for drive in drives]})
                 else:
                     return jsonify({"success": True, "path": "root", "files": [{"name": "/", "type": "directory"}]})
+        except ValueError as e:
+            return jsonify({"success": False, "error": str(e)}), 400
         except Exception as e:
             return jsonify({"success": False, "error": str(e)}), 500
 
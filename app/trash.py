@@ -0,0 +1,269 @@
+"""Deleting site files by moving them to a trash directory.
+
+A delete renames the target into a trash directory on the same filesystem,
+which takes constant time however big the tree is. A background thread
+removes trashed items once `retention` seconds have passed, unlinking at
+most `rate` files per second so a large purge does not starve the disk.
+Until then an item can be restored to where it was.
+
+Items go to a `trash` directory in the app data directory of their
+filesystem (see app/datadirs.py), never inside or next to a site root,
+where they could be served. Every trashed item is stored as `<id>/` with
+an `<id>.json` description, and trash directories are listed in a small
+JSON file, so items trashed by another worker or before a restart are
+still restored or purged.
+"""
+import heapq
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+
+from app.utils import JsonFileStore, atomic_write
+
+logger = logging.getLogger(__name__)
+
+# How often trash directories are checked for items left by other processes.
+RESCAN_INTERVAL = 60
+
+
+class TrashError(Exception):
+    """Raised when an item cannot be trashed or restored."""
+
+
+class Trash:
+    """Move paths to the trash, restore them, and purge them in the background.
+
+    `get_dir(path, boundary)` returns the trash directory for `path`: on its
+    filesystem and outside `boundary`, or None if there is none.
+    """
+
+    def __init__(self, jobs, index_path, get_dir, retention=3600, rate=2000):
+        self.jobs = jobs
+        self.get_dir = get_dir
+        self.retention = retention
+        self.rate = rate
+        self._dirs = JsonFileStore(index_path, default={"dirs": []})
+        self._due = []
+        self._purge_jobs = {}
+        self._cond = threading.Condition()
+        self._thread = None
+        self._pid = None
+
+    def move(self, path, boundary=None, **info):
+        """Move path to the trash and return its entry.
+
+        `boundary` is the site root the path belongs to; the trash is never
+        inside it. `info` is kept in the entry, e.g. the Caddyfile block of a
+        deleted site. Raises TrashError if the filesystem of `path` has no
+        trash directory.
+        """
+        path = os.path.abspath(path)
+        if not os.path.lexists(path):
+            raise FileNotFoundError(path)
+        trash_dir = self._trash_dir(path, boundary)
+        now = time.time()
+        trash_id = uuid.uuid4().hex
+        entry = {
+            "id": trash_id,
+            "original": path,
+            "location": os.path.join(trash_dir, trash_id),
+            "trashed": now,
+            "purge_after": now + self.retention,
+            **info,
+        }
+        atomic_write(entry["location"] + ".json", json.dumps(entry))
+        try:
+            os.rename(path, entry["location"])
+        except OSError:
+            os.remove(entry["location"] + ".json")
+            raise
+        logger.debug("Moved %s to %s", path, entry["location"])
+        job = self._schedule(entry)
+        return {**entry, "purge_job": job.id}
+
+    def restore(self, trash_id):
+        """Move a trashed item back to where it was; returns its original path.
+
+        Raises KeyError for an unknown id.
+        """
+        entry = self.get(trash_id)
+        if entry is None:
+            raise KeyError(trash_id)
+        if os.path.lexists(entry["original"]):
+            raise TrashError(f"{entry['original']} exists again; remove it first")
+        os.makedirs(os.path.dirname(entry["original"]), exist_ok=True)
+        try:
+            # Fails if the purge has already claimed the item.
+            os.rename(entry["location"], entry["original"])
+        except FileNotFoundError:
+            raise TrashError("The item is already being purged")
+        os.remove(entry["location"] + ".json")
+        with self._cond:
+            job = self._purge_jobs.pop(trash_id, None)
+        if job is not None:
+            job.cancel()
+        logger.debug("Restored %s from the trash", entry["original"])
+        return entry["original"]
+
+    def entries(self):
+        """Return every item waiting in the trash."""
+        items = []
+        for trash_dir in self._dirs.get()["dirs"]:
+            items.extend(self._read_dir(trash_dir))
+        return sorted(items, key=lambda entry: entry["trashed"], reverse=True)
+
+    def start(self):
+        # Threads do not survive a fork, so a gunicorn worker starts its own.
+        with self._cond:
+            if self._thread is None or not self._thread.is_alive() or self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._run, name="trash-purge", daemon=True)
+                self._thread.start()
+
+    def get(self, trash_id):
+        """Return the entry of a trashed item, or None."""
+        if not all(c in "0123456789abcdef" for c in trash_id):
+            return None
+        for trash_dir in self._dirs.get()["dirs"]:
+            try:
+                with open(os.path.join(trash_dir, trash_id + ".json"), "r") as file:
+                    return json.load(file)
+            except (OSError, ValueError):
+                continue
+        return None
+
+    def _trash_dir(self, path, boundary):
+        trash_dir = self.get_dir(path, boundary)
+        if trash_dir is None:
+            raise TrashError(f"No trash directory on the filesystem of {path}; "
+                             f"add a directory on it to data_dirs in config.json")
+        if trash_dir not in self._dirs.get()["dirs"]:
+            # Other workers may be adding theirs at the same time.
+            self._dirs.modify(lambda data: data if trash_dir in data["dirs"]
+                              else {**data, "dirs": data["dirs"] + [trash_dir]})
+        return trash_dir
+
+    def _read_dir(self, trash_dir):
+        items = []
+        try:
+            names = os.listdir(trash_dir)
+        except OSError:
+            return items
+        for name in names:
+            if name.endswith(".json"):
+                try:
+                    with open(os.path.join(trash_dir, name), "r") as file:
+                        items.append(json.load(file))
+                except (OSError, ValueError):
+                    pass
+        return items
+
+    def _schedule(self, entry):
+        job = self.jobs.create("purge", path=entry["original"], trash_id=entry["id"],
+                               purge_after=entry["purge_after"])
+        with self._cond:
+            self._purge_jobs[entry["id"]] = job
+            heapq.heappush(self._due, (entry["purge_after"], entry["id"], entry["location"]))
+            self._cond.notify()
+        self.start()
+        return job
+
+    def _run(self):
+        next_scan = 0
+        while True:
+            if time.time() >= next_scan:
+                next_scan = time.time() + RESCAN_INTERVAL
+                self._adopt_orphans()
+            with self._cond:
+                while not self._due or self._due[0][0] > time.time():
+                    timeout = min(self._due[0][0] - time.time() if self._due else RESCAN_INTERVAL,
+                                  next_scan - time.time())
+                    if timeout <= 0:
+                        break
+                    self._cond.wait(timeout)
+                if not self._due or self._due[0][0] > time.time():
+                    continue
+                _, trash_id, location = heapq.heappop(self._due)
+                job = self._purge_jobs.pop(trash_id, None)
+            self._purge(location, job)
+
+    def _adopt_orphans(self):
+        """Schedule items trashed by processes that are gone."""
+        with self._cond:
+            scheduled = {trash_id for _, trash_id, _ in self._due}
+        for trash_dir in self._dirs.get()["dirs"]:
+            for entry in self._read_dir(trash_dir):
+                if entry["id"] not in scheduled and entry["purge_after"] <= time.time():
+                    with self._cond:
+                        heapq.heappush(self._due, (entry["purge_after"], entry["id"], entry["location"]))
+        # Items whose purge was interrupted by a restart.
+        for trash_dir in self._dirs.get()["dirs"]:
+            try:
+                for name in os.listdir(trash_dir):
+                    if ".purging-" in name:
+                        pid = int(name.rsplit("-", 1)[-1])
+                        if not _pid_alive(pid):
+                            with self._cond:
+                                heapq.heappush(self._due, (0, name, os.path.join(trash_dir, name)))
+            except (OSError, ValueError):
+                pass
+
+    def _purge(self, location, job):
+        # Claim the item with a rename, so only one process purges it and a
+        # restore arriving now fails cleanly.
+        if ".purging-" in location:
+            claimed = location
+            location = location.split(".purging-")[0]
+        else:
+            claimed = f"{location}.purging-{os.getpid()}"
+            try:
+                os.rename(location, claimed)
+            except FileNotFoundError:
+                if job is not None and not job.done:
+                    job.cancel()
+                return
+        if job is not None:
+            job.start()
+        try:
+            count = self._remove_tree(claimed, job)
+            if os.path.exists(location + ".json"):
+                os.remove(location + ".json")
+            if job is not None:
+                job.succeed({"files": count})
+        except Exception as e:
+            logger.error(f"Purging {location} failed: {e}")
+            if job is not None:
+                job.fail(e)
+
+    def _remove_tree(self, path, job):
+        """Remove a tree bottom-up, unlinking at most `rate` files per second."""
+        if not os.path.isdir(path) or os.path.islink(path):
+            os.remove(path)
+            return 1
+        count = 0
+        started = time.monotonic()
+        for dirpath, dirnames, filenames in os.walk(path, topdown=False):
+            for name in filenames + [d for d in dirnames if os.path.islink(os.path.join(dirpath, d))]:
+                os.remove(os.path.join(dirpath, name))
+                count += 1
+                if self.rate and count % 100 == 0:
+                    ahead = count / self.rate - (time.monotonic() - started)
+                    if ahead > 0:
+                        time.sleep(ahead)
+                    if job is not None:
+                        job.update(files=count)
+            os.rmdir(dirpath)
+        return count
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        return True
+    return True
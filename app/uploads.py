@@ -0,0 +1,209 @@
+"""Chunked, resumable uploads.
+
+An upload is started with the final file name and size, then its bytes are
+sent in any number of PUT requests, each one saying at which offset it
+starts. They are streamed into a `.part` file next to the target, so the
+finished file is moved into place with a rename instead of a copy. After a
+dropped connection the client asks for the current offset and carries on
+from there.
+
+The session metadata is kept as JSON in a shared directory so any gunicorn
+worker can accept the next chunk.
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+
+from app import metrics
+from app.utils import atomic_write
+
+logger = logging.getLogger(__name__)
+
+COPY_BUFFER = 1024 * 1024
+STAGED_PREFIX = ".archive-"
+
+
+class UploadError(Exception):
+    """Raised when an upload request cannot be accepted; carries an HTTP status."""
+
+    def __init__(self, message, status=400, offset=None):
+        super().__init__(message)
+        self.status = status
+        self.offset = offset
+
+
+class UploadStore:
+    """Create, append to and finish upload sessions.
+
+    Sessions that have not been touched for `retention` seconds are removed,
+    together with their partial files.
+    """
+
+    def __init__(self, directory, retention=24 * 3600):
+        self.directory = directory
+        self.retention = retention
+        self._locks = {}
+        self._locks_lock = threading.Lock()
+        # Running sha256 of each part file, valid while the chunks arrive in
+        # this process; `finish` re-reads the file when it is missing.
+        self._hashes = {}
+        os.makedirs(directory, exist_ok=True)
+
+    def create(self, target, size, sha256=None, extract=False, **info):
+        """Start an upload that will end up at `target`."""
+        if not isinstance(size, int) or size < 0:
+            raise UploadError("Size must be a non-negative integer")
+        self.prune()
+        upload_id = uuid.uuid4().hex
+        directory, name = os.path.split(target)
+        os.makedirs(directory, exist_ok=True)
+        upload = {
+            "id": upload_id,
+            "target": target,
+            "part": os.path.join(directory, f".{name}.{upload_id}.part"),
+            "size": size,
+            "sha256": sha256.lower() if sha256 else None,
+            "extract": bool(extract),
+            "created": time.time(),
+            **info,
+        }
+        open(upload["part"], "xb").close()
+        self._save(upload)
+        self._hashes[upload_id] = (0, hashlib.sha256())
+        return self.status(upload)
+
+    def get(self, upload_id):
+        if not all(c in "0123456789abcdef" for c in upload_id):
+            return None
+        try:
+            with open(self._path(upload_id), "r") as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return None
+
+    def status(self, upload):
+        return {
+            "upload_id": upload["id"],
+            "size": upload["size"],
+            "offset": self._offset(upload),
+            "extract": upload["extract"],
+        }
+
+    def update(self, upload, **values):
+        """Store extra values in the upload's metadata."""
+        upload.update(values)
+        self._save(upload)
+
+    def write(self, upload, offset, stream):
+        """Append the bytes of `stream` at `offset`, which must be the current offset."""
+        with self._lock(upload["id"]):
+            current = self._offset(upload)
+            if offset != current:
+                raise UploadError(f"Expected offset {current}, got {offset}", status=409, offset=current)
+            hashed, hasher = self._hashes.get(upload["id"], (None, None))
+            if hashed != current:
+                hasher = None
+            written = 0
+            try:
+                with open(upload["part"], "r+b") as file:
+                    file.seek(offset)
+                    while True:
+                        chunk = stream.read(COPY_BUFFER)
+                        if not chunk:
+                            break
+                        if offset + written + len(chunk) > upload["size"]:
+                            raise UploadError("Chunk goes past the declared size", status=413,
+                                              offset=offset + written)
+                        file.write(chunk)
+                        if hasher is not None:
+                            hasher.update(chunk)
+                        written += len(chunk)
+            finally:
+                # Whatever arrived before a dropped connection is kept, and
+                # the client resumes from the new offset.
+                metrics.upload_bytes.inc(written)
+                if hasher is not None:
+                    self._hashes[upload["id"]] = (offset + written, hasher)
+                else:
+                    self._hashes.pop(upload["id"], None)
+                os.utime(self._path(upload["id"]))
+            return offset + written
+
+    def finish(self, upload, sha256=None):
+        """Check the size and checksum of a complete upload and return its part file path.
+
+        The caller moves or extracts the part file and then calls `discard`.
+        """
+        with self._lock(upload["id"]):
+            offset = self._offset(upload)
+            if offset != upload["size"]:
+                raise UploadError(f"Upload incomplete: {offset} of {upload['size']} bytes received",
+                                  status=409, offset=offset)
+            hashed, hasher = self._hashes.get(upload["id"], (None, None))
+            digest = hasher.hexdigest() if hashed == offset else _file_sha256(upload["part"])
+            expected = (sha256 or upload["sha256"] or "").lower()
+            if expected and expected != digest:
+                raise UploadError("Checksum mismatch", status=422)
+            with open(upload["part"], "rb") as file:
+                os.fsync(file.fileno())
+            return upload["part"], digest
+
+    def discard(self, upload):
+        """Forget an upload and remove its part file if it is still there."""
+        self._hashes.pop(upload["id"], None)
+        with self._locks_lock:
+            self._locks.pop(upload["id"], None)
+        for path in (upload["part"], self._path(upload["id"])):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def staging_path(self):
+        """A new path in the upload directory to keep an archive at until it is extracted."""
+        return os.path.join(self.directory, f"{STAGED_PREFIX}{uuid.uuid4().hex}")
+
+    def prune(self):
+        cutoff = time.time() - self.retention
+        for entry in os.scandir(self.directory):
+            try:
+                if entry.name.endswith(".json") and entry.stat().st_mtime < cutoff:
+                    upload = self.get(entry.name[:-len(".json")])
+                    if upload:
+                        logger.debug("Removing stale upload %s for %s", upload["id"], upload["target"])
+                        self.discard(upload)
+                    else:
+                        os.remove(entry.path)
+                elif entry.name.startswith(STAGED_PREFIX) and entry.stat().st_mtime < cutoff:
+                    # Left behind by an extraction that never finished.
+                    os.remove(entry.path)
+            except OSError:
+                pass
+
+    def _offset(self, upload):
+        try:
+            return os.path.getsize(upload["part"])
+        except FileNotFoundError:
+            raise UploadError("Upload not found", status=404)
+
+    def _lock(self, upload_id):
+        with self._locks_lock:
+            return self._locks.setdefault(upload_id, threading.Lock())
+
+    def _path(self, upload_id):
+        return os.path.join(self.directory, f"{upload_id}.json")
+
+    def _save(self, upload):
+        atomic_write(self._path(upload["id"]), json.dumps(upload))
+
+
+def _file_sha256(path):
+    hasher = hashlib.sha256()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(COPY_BUFFER), b""):
+            hasher.update(chunk)
+    return hasher.hexdigest()
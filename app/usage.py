@@ -0,0 +1,260 @@
+"""Disk usage of site roots, and the quotas checked before writing to them.
+
+A scan walks a root one directory level at a time, reading the directories
+of a level in parallel on a small thread pool (scandir and stat release the
+GIL). What a directory holds directly, its files' bytes and its largest
+files, is cached under its path with the directory's mtime. On the next
+scan an unchanged directory costs one stat() and its files are not
+looked at again.
+
+A directory's mtime changes when entries are created, removed or renamed,
+but not when a file is rewritten in place. Saves and uploads made through
+the app call `invalidate`; for changes made outside it, every root is read
+in full again after `full_rescan` seconds.
+
+Requests never wait for a full scan: `usage` answers from the last result
+and rescans stale roots in the background. Only a root that has never
+been scanned is read while the caller waits, and then only its first
+`first_scan_dirs` directories.
+"""
+import heapq
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from app.datadirs import DIR_NAME
+
+logger = logging.getLogger(__name__)
+
+
+class QuotaExceeded(Exception):
+    """Raised when a write would take a site over its hard quota."""
+
+    def __init__(self, message, usage, limit):
+        super().__init__(message)
+        self.usage = usage
+        self.limit = limit
+
+
+class _Directory:
+    __slots__ = ("mtime_ns", "bytes", "disk_bytes", "files", "subdirs", "largest")
+
+    def __init__(self, mtime_ns, size, disk_bytes, files, subdirs, largest):
+        self.mtime_ns = mtime_ns
+        self.bytes = size
+        self.disk_bytes = disk_bytes
+        self.files = files
+        self.subdirs = subdirs
+        # (size, name) of the biggest files directly in this directory.
+        self.largest = largest
+
+
+class UsageScanner:
+    """Per-root usage totals, kept up to date incrementally; see `from_config`."""
+
+    def __init__(self, workers=4, top=20, max_age=60, full_rescan=3600, first_scan_dirs=2000):
+        self.workers = workers
+        self.top = top
+        self.max_age = max_age
+        self.full_rescan = full_rescan
+        self.first_scan_dirs = first_scan_dirs
+        self._dirs = {}
+        self._results = {}
+        self._scanning = set()
+        self._lock = threading.Lock()
+        self._executor = None
+        self._pid = None
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(
+            workers=int(config.get("usage_workers", 4)),
+            top=int(config.get("usage_top_files", 20)),
+            max_age=float(config.get("usage_max_age", 60)),
+            full_rescan=float(config.get("usage_full_rescan", 3600)),
+            first_scan_dirs=int(config.get("usage_first_scan_dirs", 2000)),
+        )
+
+    def _pool(self):
+        # Threads do not survive a fork, so a gunicorn worker starts its own.
+        if self._executor is None or self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="usage")
+        return self._executor
+
+    def cached(self, root):
+        """The last result for `root`, however old, or None."""
+        return self._results.get(os.path.abspath(root))
+
+    def usage(self, root, max_age=None):
+        """Return the last usage of `root`, rescanning it in the background if older than `max_age` seconds.
+
+        A root without any result is scanned now, but at most
+        `first_scan_dirs` of its directories; a result cut short like that
+        has "complete" false and is finished in the background.
+        """
+        root = os.path.abspath(root)
+        result = self._results.get(root)
+        if result is None:
+            result = self.scan(root, max_dirs=self.first_scan_dirs)
+        self.refresh([root], max_age)
+        return result
+
+    def refresh(self, roots, max_age=None):
+        """Scan the roots whose results are missing or stale in the background; returns how many."""
+        max_age = self.max_age if max_age is None else max_age
+        started = 0
+        for root in roots:
+            root = os.path.abspath(root)
+            result = self._results.get(root)
+            if result is not None and time.time() - result["scanned"] <= max_age:
+                continue
+            with self._lock:
+                if root in self._scanning:
+                    continue
+                self._scanning.add(root)
+            threading.Thread(target=self._background_scan, args=(root,), name="usage-scan", daemon=True).start()
+            started += 1
+        return started
+
+    @property
+    def scanning(self):
+        return bool(self._scanning)
+
+    def _background_scan(self, root):
+        try:
+            self.scan(root)
+        except Exception as e:
+            logger.error(f"Scanning disk usage of {root} failed: {e}")
+        finally:
+            with self._lock:
+                self._scanning.discard(root)
+
+    def invalidate(self, path, added=0):
+        """Forget what is cached for the directory holding `path` (or `path` itself if it is one).
+
+        Results of roots containing `path` are marked stale, so the next
+        `usage()` rescans them in the background (only the changed
+        directories are read). Until then, `added` bytes are counted on top
+        of their last total.
+        """
+        path = os.path.abspath(path)
+        self._dirs.pop(path, None)
+        self._dirs.pop(os.path.dirname(path), None)
+        for root, result in list(self._results.items()):
+            if path == root or path.startswith(root.rstrip(os.sep) + os.sep):
+                self._results[root] = dict(result, scanned=0, bytes=max(0, result["bytes"] + added))
+
+    def scan(self, root, max_dirs=None):
+        """Walk `root` now, reusing directories that have not changed; return its usage.
+
+        With `max_dirs`, stop after that many directories and return what
+        was counted so far, marked incomplete and stale.
+        """
+        root = os.path.abspath(root)
+        started = time.perf_counter()
+        previous = self._results.get(root)
+        full = previous is None or time.time() - previous.get("full_scan", 0) > self.full_rescan
+        pool = self._pool()
+
+        totals = {"bytes": 0, "disk_bytes": 0, "files": 0, "dirs": 0, "read": 0}
+        largest = []
+        level = [root]
+        complete = True
+        while level:
+            if max_dirs is not None and len(level) > max_dirs - totals["dirs"]:
+                level = level[:max(0, max_dirs - totals["dirs"])]
+                complete = False
+            next_level = []
+            for path, entry, was_read in pool.map(lambda path: self._directory(path, full), level):
+                if entry is None:
+                    continue
+                totals["dirs"] += 1
+                totals["read"] += was_read
+                totals["bytes"] += entry.bytes
+                totals["disk_bytes"] += entry.disk_bytes
+                totals["files"] += entry.files
+                largest = heapq.nlargest(self.top, largest + [(size, os.path.join(path, name))
+                                                              for size, name in entry.largest])
+                next_level.extend(os.path.join(path, name) for name in entry.subdirs)
+            level = next_level
+
+        result = {
+            "root": root,
+            "bytes": totals["bytes"],
+            "disk_bytes": totals["disk_bytes"],
+            "files": totals["files"],
+            "dirs": totals["dirs"],
+            "largest": [{"path": os.path.relpath(path, root), "size": size} for size, path in largest],
+            "complete": complete,
+            # An incomplete result is stale from the start, so it is finished in the background.
+            "scanned": time.time() if complete else 0,
+            "full_scan": time.time() if full and complete else (previous or {}).get("full_scan", 0),
+            "dirs_read": totals["read"],
+            "seconds": round(time.perf_counter() - started, 4),
+        }
+        self._results[root] = result
+        logger.debug("Scanned %s: %d bytes in %d dirs, %d read", root, result["bytes"], result["dirs"],
+                     result["dirs_read"])
+        return result
+
+    def _directory(self, path, full):
+        """Return (path, _Directory or None, whether it was read)."""
+        try:
+            mtime_ns = os.stat(path).st_mtime_ns
+        except OSError:
+            self._dirs.pop(path, None)
+            return path, None, False
+        entry = self._dirs.get(path)
+        if not full and entry is not None and entry.mtime_ns == mtime_ns:
+            return path, entry, False
+
+        size = disk_bytes = files = 0
+        subdirs = []
+        sizes = []
+        try:
+            with os.scandir(path) as entries:
+                for item in entries:
+                    try:
+                        if item.is_dir(follow_symlinks=False):
+                            if item.name != DIR_NAME:
+                                subdirs.append(item.name)
+                            continue
+                        st = item.stat(follow_symlinks=False)
+                    except OSError:
+                        continue
+                    files += 1
+                    size += st.st_size
+                    disk_bytes += getattr(st, "st_blocks", 0) * 512 or st.st_size
+                    sizes.append((st.st_size, item.name))
+        except OSError as e:
+            logger.debug("Cannot read %s: %s", path, e)
+            return path, None, False
+        entry = _Directory(mtime_ns, size, disk_bytes, files, subdirs, heapq.nlargest(self.top, sizes))
+        self._dirs[path] = entry
+        return path, entry, True
+
+
+def site_quota(config, *domains):
+    """Return (soft, hard) byte limits for a site known by any of `domains`; either may be None.
+
+    `site_quotas` maps a domain to {"soft": bytes, "hard": bytes};
+    `default_quota` applies to sites not listed there.
+    """
+    quotas = config.get("site_quotas") or {}
+    quota = next((quotas[domain] for domain in domains if domain in quotas), None)
+    quota = quota or config.get("default_quota") or {}
+    soft, hard = quota.get("soft"), quota.get("hard")
+    return (int(soft) if soft is not None else None), (int(hard) if hard is not None else None)
+
+
+def check_quota(usage, incoming, soft, hard):
+    """Raise QuotaExceeded if `incoming` more bytes break the hard limit; return a warning for the soft one."""
+    after = usage + max(0, incoming)
+    if hard is not None and incoming > 0 and after > hard:
+        raise QuotaExceeded(f"This would use {after} bytes, over the site's quota of {hard} bytes", usage, hard)
+    if soft is not None and after > soft:
+        return f"The site uses {after} bytes, over its soft quota of {soft} bytes"
+    return None
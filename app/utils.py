@@ -1,37 +1,687 @@
 import os
+import re
+import json
+import bisect
+import hashlib
+import shutil
+import tempfile
+import threading
+import logging
+from contextlib import contextmanager
+
+from app import metrics
+from app.caddyfile import Caddyfile, CaddyfileError, render_block
+from app.history import CaddyfileHistory
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+_site_cache = {}
+_site_cache_lock = threading.Lock()
+# Held by anything that rewrites the Caddyfile.
+caddyfile_lock = threading.Lock()
+# Serialises ETag checks and writes of files saved from the editor.
+_file_write_lock = threading.Lock()
+# Where version history is kept; None disables it.
+_history_dir = None
+_histories = {}
+# Returns the Validator run before every write; None skips validation.
+_get_validator = None
+
+
+def _load_caddyfile(caddyfile_path):
+    metrics.caddyfile_parses.inc()
+    with metrics.caddyfile_parse_duration.time():
+        return Caddyfile.load(caddyfile_path)
+
 
 def parse_caddyfile(caddyfile_path):
-    """Parse the Caddyfile and extract sites with their configurations."""
-    sites = []
-    with open(caddyfile_path, "r") as file:
-        lines = file.readlines()
+    """Parse the Caddyfile and return its site blocks.
+
+    Each Block reads its domain, addresses, config and line from the file
+    text when asked for; `as_dict()` gives a plain copy to edit and pass
+    to update_caddyfile().
+    """
+    return _load_caddyfile(caddyfile_path).sites
+
+
+
+def update_caddyfile(caddyfile_path, sites):
+    """Write updated sites back to the Caddyfile.
+
+    `sites` is a list of {"domain", "config"} dicts. Only site blocks whose
+    config changed are re-rendered; global options, snippets, imports,
+    comments and unchanged sites are kept as written.
+    """
+    with caddyfile_lock:
+        doc = _load_caddyfile(caddyfile_path)
+        current = {block.domain: block.config for block in doc.sites}
+        wanted = {site["domain"]: site["config"] for site in sites}
+        changes = {domain: None for domain in current if domain not in wanted}
+        changes.update({domain: config for domain, config in wanted.items()
+                        if domain in current and current[domain] != config})
+        additions = [(domain, config) for domain, config in wanted.items() if domain not in current]
+        _write_caddyfile(caddyfile_path, doc.rewrite(changes, additions))
+
+
+def add_site_block(caddyfile_path, domain, config):
+    """Append a site block to the Caddyfile."""
+    with caddyfile_lock:
+        doc = load_sites(caddyfile_path).doc
+        if doc.find_site(domain) is not None:
+            raise CaddyfileError(f"Site '{domain}' already exists")
+        _write_caddyfile(caddyfile_path, doc.add_site(domain, config))
+
+
+def replace_site_block(caddyfile_path, domain, config):
+    """Replace the config of one site block in place."""
+    with caddyfile_lock:
+        doc = load_sites(caddyfile_path).doc
+        _write_caddyfile(caddyfile_path, doc.replace_site(domain, config))
+
+
+def remove_site_block(caddyfile_path, domain):
+    """Remove a site block, together with the comment lines directly above it."""
+    with caddyfile_lock:
+        doc = load_sites(caddyfile_path).doc
+        _write_caddyfile(caddyfile_path, doc.remove_site(domain))
+
+
+class SiteOperationError(CaddyfileError):
+    """Raised when a batch of site operations is rejected; `errors` lists each problem."""
+
+    def __init__(self, errors):
+        super().__init__(f"{len(errors)} operation(s) rejected")
+        self.errors = errors
+
+
+def apply_site_operations(caddyfile_path, operations, write=True):
+    """Apply a list of create/update/delete operations with a single write.
+
+    Each operation is a dict with "op", "domain" and, for create and
+    update, "config" (a list of lines or a string). All operations are
+    checked before anything is written; if any of them is invalid a
+    SiteOperationError is raised and the Caddyfile is left untouched.
+    With `write=False` the result is only validated, e.g. before moving
+    files the new config will point at. Returns one dict per operation
+    with the old and new root directories and the old config.
+    """
+    with caddyfile_lock:
+        index = load_sites(caddyfile_path)
+        changes = {}
+        additions = []
+        applied = []
+        errors = []
+        seen = set()
+        for i, operation in enumerate(operations):
+            try:
+                applied.append(_check_site_operation(index, operation, seen, changes, additions))
+            except (CaddyfileError, TypeError, ValueError) as e:
+                errors.append({"index": i, "domain": operation.get("domain") if isinstance(operation, dict) else None,
+                               "error": str(e)})
+        if errors:
+            raise SiteOperationError(errors)
+        if applied:
+            text = index.doc.rewrite(changes, additions)
+            if write:
+                _write_caddyfile(caddyfile_path, text)
+            else:
+                validate_caddyfile(caddyfile_path, text)
+        return applied
+
+
+def _check_site_operation(index, operation, seen, changes, additions):
+    if not isinstance(operation, dict):
+        raise TypeError("Operation must be an object")
+    op = operation.get("op")
+    domain = operation.get("domain")
+    if op not in ("create", "update", "delete"):
+        raise ValueError(f"Unknown op {op!r}")
+    if not isinstance(domain, str) or not domain.strip():
+        raise ValueError("Domain is required")
+    domain = domain.strip()
+
+    config = None
+    if op != "delete":
+        config = operation.get("config")
+        if isinstance(config, str):
+            config = config.split("\n")
+        if not isinstance(config, list) or not all(isinstance(line, str) for line in config):
+            raise TypeError("Config must be a list of lines or a string")
+        render_block(domain, config)
+
+    site = index.get(domain)
+    key = site.domain if site else domain
+    if key in seen:
+        raise ValueError(f"Site '{domain}' appears more than once")
+    seen.add(key)
+
+    if op == "create":
+        if site:
+            raise CaddyfileError(f"Site '{domain}' already exists")
+        additions.append((domain, config))
+        return {"op": op, "domain": domain, "old_root": None, "old_config": None,
+                "new_root": get_site_root_dir(config)}
+    if not site:
+        raise CaddyfileError(f"Site '{domain}' not found")
+    changes[key] = config
+    return {"op": op, "domain": key, "old_root": index.root_dir(key), "old_config": site.config,
+            "new_root": get_site_root_dir(config) if config is not None else None}
+
+
+def set_validator(get_validator):
+    """Validate every Caddyfile write with the Validator returned by `get_validator()`."""
+    global _get_validator
+    _get_validator = get_validator
+
+
+def validate_caddyfile(caddyfile_path, text):
+    """Run the pre-write checks on `text` as a replacement for the Caddyfile; return the warnings."""
+    validator = _get_validator() if _get_validator else None
+    if validator is None:
+        return []
+    previous = load_sites(caddyfile_path).doc if os.path.exists(caddyfile_path) else None
+    return validator.check(Caddyfile(text), caddyfile_path, previous)
+
+
+def check_site_config(caddyfile_path, domain, config):
+    """Validate replacing the config of one site without writing anything."""
+    return validate_caddyfile(caddyfile_path, load_sites(caddyfile_path).doc.replace_site(domain, config))
+
+
+_NO_WHITESPACE = dict.fromkeys(map(ord, " \t\r\n\f\v"))
+
+
+def format_caddyfile(caddyfile_path, formatter):
+    """Lay the Caddyfile out with `formatter`, e.g. `caddy fmt`, and write it if anything moved.
+
+    Edits only touch the blocks they change, so this is the one place the
+    whole file is reformatted; it runs when asked for, never on a save.
+    Returns True if the file was rewritten. Raises CaddyError if the
+    formatter fails, and CaddyfileError if its output differs from the
+    file in more than whitespace.
+    """
+    with caddyfile_lock:
+        with open(caddyfile_path, "r", encoding="utf-8") as file:
+            text = file.read()
+        formatted = formatter(text)
+        if formatted.translate(_NO_WHITESPACE) != text.translate(_NO_WHITESPACE):
+            raise CaddyfileError("caddy fmt output differs from the Caddyfile in more than whitespace")
+        if formatted == text:
+            return False
+        _write_caddyfile(caddyfile_path, formatted, source="fmt")
+        return True
+
+
+def set_history_dir(directory):
+    """Record every Caddyfile write as a version under `directory` (None to stop)."""
+    global _history_dir
+    _history_dir = directory
+    _histories.clear()
+
+
+def caddyfile_history(caddyfile_path):
+    """Return the CaddyfileHistory of a Caddyfile, or None when history is off."""
+    if _history_dir is None:
+        return None
+    key = hashlib.sha1(os.path.abspath(caddyfile_path).encode("utf-8")).hexdigest()[:16]
+    history = _histories.get(key)
+    if history is None:
+        history = _histories.setdefault(key, CaddyfileHistory(os.path.join(_history_dir, key)))
+    return history
+
+
+def restore_caddyfile(caddyfile_path, text, source="rollback"):
+    """Overwrite the Caddyfile with `text`, e.g. an earlier version from its history."""
+    with caddyfile_lock:
+        _write_caddyfile(caddyfile_path, text, source)
+
+
+def _record_version(history, caddyfile_path, text, source):
+    try:
+        history.record(text, _file_key(caddyfile_path), source)
+    except (OSError, CaddyfileError, ValueError) as e:
+        # History is a convenience; it must never stand in the way of a write.
+        logger.error(f"Could not record Caddyfile version: {e}")
+
+
+def _write_caddyfile(caddyfile_path, text, source="edit"):
+    """Replace the Caddyfile atomically, keeping the previous version as <path>.bak.
+
+    The text is validated first, and ValidationError is raised if it fails. With history enabled, the new
+    text is recorded as a version; if the file was changed outside the app
+    since the last recorded version, its current contents are recorded first.
+    """
+    validate_caddyfile(caddyfile_path, text)
+    history = caddyfile_history(caddyfile_path)
+    if os.path.exists(caddyfile_path):
+        if history is not None and history.recorded_key() != _file_key(caddyfile_path):
+            with open(caddyfile_path, "r", encoding="utf-8") as file:
+                _record_version(history, caddyfile_path, file.read(), "external")
+        backup_path = caddyfile_path + ".bak"
+        tmp_path = f"{backup_path}.{os.getpid()}.tmp"
+        try:
+            # A hard link keeps the old contents without copying them.
+            os.link(caddyfile_path, tmp_path)
+        except OSError:
+            shutil.copy2(caddyfile_path, tmp_path)
+        os.replace(tmp_path, backup_path)
+    # Readers such as the background reload never see a half-written file.
+    atomic_write(caddyfile_path, text)
+    metrics.caddyfile_writes.inc()
+    invalidate_site_cache(caddyfile_path)
+    if history is not None:
+        _record_version(history, caddyfile_path, text, source)
+
+
+def atomic_write(path, text):
+    """Write text to path through a temp file in the same directory and a rename."""
+    _atomic_replace(path, lambda file: file.write(text.encode("utf-8")))
+
+
+def _atomic_replace(path, write):
+    """Call write(file) on a temp file next to path, then fsync it and rename it over path."""
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(prefix=".tmp-", dir=directory)
+    try:
+        with os.fdopen(fd, "wb") as file:
+            write(file)
+            file.flush()
+            os.fsync(file.fileno())
+        if os.path.exists(path):
+            os.chmod(tmp_path, os.stat(path).st_mode & 0o7777)
+        else:
+            # mkstemp creates files readable by the owner only.
+            umask = os.umask(0)
+            os.umask(umask)
+            os.chmod(tmp_path, 0o666 & ~umask)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+class FileChangedError(Exception):
+    """Raised when a file no longer matches the ETag an edit was based on."""
+
+    def __init__(self, etag):
+        super().__init__("The file was changed by someone else; reload it and try again")
+        self.etag = etag
+
 
-    current_site = None
+def file_etag(st):
+    """ETag for a file version, from its os.stat() result."""
+    return f"{st.st_mtime_ns:x}-{st.st_size:x}"
+
+
+def save_file(path, text, etag=None):
+    """Replace a file atomically; when etag is given the file must still match it.
+
+    Returns the ETag of the new version.
+    """
+    with _file_write_lock:
+        if etag is not None:
+            _check_etag(path, etag)
+        atomic_write(path, text)
+        return file_etag(os.stat(path))
+
+
+def patch_file(path, edits, etag):
+    """Apply byte-range edits to a file that must still match etag.
+
+    Each edit is {"offset", "length", "content"}: `length` bytes starting
+    at `offset` are replaced by the UTF-8 encoded content. The unchanged
+    parts are copied in chunks into a temp file that is renamed over the
+    original, so the file is never held in memory. Returns the new ETag.
+    """
+    with _file_write_lock:
+        size = _check_etag(path, etag)
+        edits = sorted(edits, key=lambda edit: int(edit["offset"]))
+        position = 0
+        for edit in edits:
+            offset, length = int(edit["offset"]), int(edit["length"])
+            if offset < position or length < 0 or offset + length > size:
+                raise ValueError("Edits must not overlap and must lie within the file")
+            position = offset + length
+
+        def write(target):
+            with open(path, "rb") as source:
+                position = 0
+                for edit in edits:
+                    offset, length = int(edit["offset"]), int(edit["length"])
+                    _copy_bytes(source, target, offset - position)
+                    target.write(edit.get("content", "").encode("utf-8"))
+                    source.seek(offset + length)
+                    position = offset + length
+                shutil.copyfileobj(source, target, 1024 * 1024)
+
+        _atomic_replace(path, write)
+        return file_etag(os.stat(path))
+
+
+def _check_etag(path, etag):
+    st = os.stat(path)
+    if file_etag(st) != etag:
+        raise FileChangedError(file_etag(st))
+    return st.st_size
+
+
+def _copy_bytes(source, target, count):
+    while count > 0:
+        chunk = source.read(min(count, 1024 * 1024))
+        if not chunk:
+            break
+        target.write(chunk)
+        count -= len(chunk)
+
+
+def merge_tree(source, target, overwrite=True):
+    """Move the contents of source into target with renames, merging existing directories.
+
+    Returns the paths, relative to target, of the files that were replaced.
+    With overwrite=False, FileExistsError is raised instead if there are
+    any. A file that would take the place of a directory, or the other way
+    round, always raises FileExistsError. Either way nothing has been moved
+    when it is raised.
+    """
+    replaced = []
+    _merge_conflicts(source, target, "", replaced)
+    if replaced and not overwrite:
+        raise FileExistsError(f"{len(replaced)} file(s) already exist, e.g. '{replaced[0]}'")
+    _merge_entries(source, target)
+    return replaced
+
+
+def _merge_conflicts(source, target, prefix, replaced):
+    for entry in os.scandir(source):
+        destination = os.path.join(target, entry.name)
+        if not os.path.lexists(destination):
+            continue
+        relative = prefix + entry.name
+        source_is_dir = entry.is_dir(follow_symlinks=False)
+        if source_is_dir != (os.path.isdir(destination) and not os.path.islink(destination)):
+            raise FileExistsError(f"'{relative}' is a directory on one side and a file on the other")
+        if source_is_dir:
+            _merge_conflicts(entry.path, destination, relative + "/", replaced)
+        else:
+            replaced.append(relative)
+
+
+def _merge_entries(source, target):
+    for entry in os.scandir(source):
+        destination = os.path.join(target, entry.name)
+        if entry.is_dir(follow_symlinks=False) and os.path.isdir(destination) \
+                and not os.path.islink(destination):
+            _merge_entries(entry.path, destination)
+        else:
+            os.replace(entry.path, destination)
+
+
+def get_site_root_dir(config):
+    """Return the path of the first `root` directive in a site config."""
+    for line in config:
+        if line.strip().startswith('root'):
+            parts = line.strip().split()
+            if len(parts) >= 3:
+                return parts[2].rstrip('/')
+    return None
+
+
+# What get_site_root_dir takes the root from, "root <matcher> <path>", when it starts a line.
+_ROOT_RE = re.compile(r"root\S*[ \t]+\S+[ \t]+(\S+)")
+
+SITE_SEARCH_FIELDS = ("domain", "directive", "upstream")
+
+
+def _search_fields(site):
+    """Lower-cased addresses, config lines, directive names and upstreams of a site block."""
+    lines = [line.casefold() for line in site.config]
+    directives = set()
+    upstreams = []
     for line in lines:
-        stripped = line.strip()
-        if not stripped:
+        words = line.split()
+        if not words:
             continue
+        directives.add(words[0])
+        if words[0] in ("reverse_proxy", "to"):
+            # Skip path matchers; what is left are upstream addresses.
+            upstreams.extend(word for word in words[1:] if word != "{" and not word.startswith(("/", "@", "*")))
+    return {
+        "domain": [address.casefold() for address in site.addresses],
+        "lines": lines,
+        "directive": directives,
+        "upstream": upstreams,
+    }
+
 
-        if stripped.endswith("{"):
-            current_site = {"domain": stripped[:-1].strip(), "config": []}
-        elif stripped == "}":
-            if current_site is not None:
-                sites.append(current_site)
-            current_site = None
+def _site_matches(fields, field, needle):
+    if field == "directive":
+        return any(directive.startswith(needle) for directive in fields["directive"])
+    if field is not None:
+        return any(needle in value for value in fields[field])
+    return any(needle in value for value in fields["domain"]) or any(needle in line for line in fields["lines"])
+
+
+class SiteIndex:
+    """Parsed sites of one Caddyfile version with lookups by domain.
+
+    `sites` and the values of `by_domain` are the site Blocks of `doc`;
+    their domain, addresses, config and line are read from the file text
+    when asked for, so indexing a large file does not split every body
+    into lines.
+    """
+
+    def __init__(self, key, doc):
+        self.key = key
+        self.doc = doc
+        self.sites = doc.sites
+        self.by_domain = {}
+        self._roots = None
+        self._fields = None
+        self._searches = {}
+        self._search_lock = threading.Lock()
+        by_domain = self.by_domain
+        aliased = []
+        for site in self.sites:
+            keys = site.keys
+            if len(keys) > 1 or "," in keys[0]:
+                aliased.append(site)
+            # Keep the first block for a domain, like the old linear scan did.
+            by_domain.setdefault(site.domain, site)
+        for site in aliased:
+            for address in site.addresses:
+                by_domain.setdefault(address, site)
+
+    @property
+    def roots(self):
+        """Domain -> root directory (or None) of the first block of every domain.
+
+        Found with one search of the whole file rather than by splitting
+        every site's config into lines; the result is the same as
+        get_site_root_dir on each site's config.
+        """
+        if self._roots is None:
+            text = self.doc.text
+            blocks = self.sites
+            starts = [block.open if block.open is not None else block.body_span[0] for block in blocks]
+            found = {}
+            for match in _ROOT_RE.finditer(text):
+                pos = match.start()
+                line_start = text.rfind("\n", 0, pos) + 1
+                i = bisect.bisect_right(starts, pos) - 1
+                if i < 0 or i in found or text[line_start:pos].strip() or match.end() > blocks[i].body_span[1]:
+                    continue
+                found[i] = match.group(1).rstrip("/")
+            roots = dict.fromkeys(site.domain for site in blocks)
+            for i, root in found.items():
+                domain = blocks[i].domain
+                if self.by_domain[domain] is blocks[i]:
+                    roots[domain] = root
+            self._roots = roots
+        return self._roots
+
+    def get(self, domain):
+        return self.by_domain.get(domain)
+
+    @property
+    def version(self):
+        """Changes whenever the Caddyfile does; used as the ETag of site listings."""
+        return "-".join(f"{value:x}" for value in self.key)
+
+    def search(self, query):
+        """Return the sites matching `query`, in Caddyfile order.
+
+        A plain query matches addresses and config lines by substring.
+        `domain:`, `directive:` and `upstream:` restrict it to addresses,
+        directive names (by prefix) or reverse_proxy upstreams.
+        """
+        query = (query or "").strip().casefold()
+        if not query:
+            return self.sites
+        with self._search_lock:
+            if query in self._searches:
+                return self._searches[query]
+        field, _, needle = query.partition(":")
+        if field not in SITE_SEARCH_FIELDS or not needle:
+            field, needle = None, query
+        needle = needle.strip()
+        matches = [site for site, fields in zip(self.sites, self._search_fields())
+                   if _site_matches(fields, field, needle)]
+        with self._search_lock:
+            if len(self._searches) >= 32:
+                self._searches.clear()
+            self._searches[query] = matches
+        return matches
+
+    def _search_fields(self):
+        if self._fields is None:
+            self._fields = [_search_fields(site) for site in self.sites]
+        return self._fields
+
+    def root_dir(self, domain):
+        site = self.by_domain.get(domain)
+        if site is None:
+            return None
+        if self._roots is not None:
+            return self._roots.get(site.domain)
+        # Looking up a few sites should not cost a pass over the whole file.
+        return get_site_root_dir(self.by_domain[site.domain].config)
+
+
+class JsonFileStore:
+    """In-memory copy of a JSON file that is re-read only when the file changes.
+
+    Every gunicorn worker keeps its own copy; they stay consistent because
+    each one compares the file's (mtime_ns, size, inode) before using it,
+    which costs a stat() instead of an open() and json.load() per request.
+    `reload_count` counts how many times the file was actually read.
+    """
+
+    def __init__(self, path, default=None):
+        self.path = path
+        self.default = default if default is not None else {}
+        self.reload_count = 0
+        self._data = None
+        self._key = None
+        self._lock = threading.Lock()
+
+    def _current_key(self):
+        try:
+            return _file_key(self.path)
+        except FileNotFoundError:
+            return None
+
+    def get(self):
+        """Return the shared dict; treat it as read-only and use update() to change it."""
+        key = self._current_key()
+        if self._data is None or key != self._key:
+            with self._lock:
+                if self._data is None or key != self._key:
+                    self._load(key)
+        return self._data
+
+    def reload(self):
+        """Re-read the file even if it looks unchanged."""
+        with self._lock:
+            self._load(self._current_key())
+        return self._data
+
+    def update(self, values):
+        """Merge values into the file and the in-memory copy."""
+        return self.modify(lambda data: {**data, **values})
+
+    def modify(self, change):
+        """Replace the contents with `change(data)`, given a copy of what is in the file now.
+
+        The read and the write hold a lock on `<path>.lock`, so a change
+        made by another process at the same time is not lost.
+        """
+        with self._lock, _locked(self.path + ".lock"):
+            self._load(self._current_key())
+            data = change(dict(self._data))
+            atomic_write(self.path, json.dumps(data, indent=4))
+            self._data = data
+            self._key = self._current_key()
+        return data
+
+    def _load(self, key):
+        if key is None:
+            data = dict(self.default)
         else:
-            if current_site is not None:
-                current_site["config"].append(stripped)
+            with open(self.path, "r") as file:
+                data = json.load(file)
+        self._data = data
+        self._key = key
+        self.reload_count += 1
+        logger.debug("Loaded %s (reload #%d)", self.path, self.reload_count)
 
-    return sites
 
+def _file_key(caddyfile_path):
+    st = os.stat(caddyfile_path)
+    return (st.st_mtime_ns, st.st_size, st.st_ino)
 
 
-def update_caddyfile(caddyfile_path, sites):
-    """Write updated sites back to the Caddyfile."""
-    with open(caddyfile_path, "w") as file:
-        for site in sites:
-            file.write(f"{site['domain']} {{\n")
-            for line in site["config"]:
-                file.write(f"    {line}\n")
-            file.write("}\n")
+def load_sites(caddyfile_path):
+    """Return a cached SiteIndex for the Caddyfile, re-parsing it only when it changed on disk.
+
+    The returned index is shared between requests and must not be mutated;
+    use the sites' as_dict() copies for edits.
+    """
+    key = _file_key(caddyfile_path)
+    index = _site_cache.get(caddyfile_path)
+    if index is not None and index.key == key:
+        return index
+
+    with _site_cache_lock:
+        index = _site_cache.get(caddyfile_path)
+        if index is not None and index.key == key:
+            return index
+        logger.debug("Parsing Caddyfile %s", caddyfile_path)
+        index = SiteIndex(key, _load_caddyfile(caddyfile_path))
+        # The file may have been rewritten while we were parsing it.
+        if _file_key(caddyfile_path) == key:
+            _site_cache[caddyfile_path] = index
+        return index
+
+
+def invalidate_site_cache(caddyfile_path=None):
+    """Drop cached sites for one Caddyfile, or for all of them."""
+    with _site_cache_lock:
+        if caddyfile_path is None:
+            _site_cache.clear()
+        else:
+            _site_cache.pop(caddyfile_path, None)
+
 
+@contextmanager
+def _locked(lock_path):
+    """Hold an exclusive lock on `lock_path` across processes; only threads are excluded without fcntl."""
+    with open(lock_path, "a") as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        yield
@@ -0,0 +1,276 @@
+"""Checks run on a new Caddyfile before it is written.
+
+Every write goes through `Validator.check` with the new text and the file
+it replaces. The cheap checks work on the parsed blocks: each changed site
+must parse, must not share an address with another site, must not use a
+port that is reserved or already serving the other scheme, and its root
+must be a directory or creatable as one. Problems that only involve
+unchanged sites are left alone, so an old mistake elsewhere in the file
+does not block unrelated edits.
+
+With the CLI reload backend, `caddy validate` then runs on a temp copy
+next to the Caddyfile (so relative imports resolve as they would for the
+real file). Its result is cached by content hash, so saving the same text
+again, or validating a text that was already checked before a file move,
+does not run Caddy twice. The admin API backend skips it by default: its
+adapt and load calls validate the config anyway, and Caddy keeps running
+the old one when they fail, so there is no need to hold the Caddyfile
+lock while a subprocess runs on every write.
+"""
+import hashlib
+import logging
+import os
+import re
+import subprocess
+import tempfile
+import threading
+from collections import OrderedDict
+from urllib.parse import urlsplit
+
+from app.caddyfile import CaddyfileError
+
+logger = logging.getLogger(__name__)
+
+CACHE_SIZE = 64
+
+_caddy_results = OrderedDict()
+_caddy_results_lock = threading.Lock()
+
+
+class ValidationError(CaddyfileError):
+    """Raised when a new Caddyfile fails validation; `errors` lists each problem.
+
+    Each problem is a dict with "check", "domain" (None for problems not
+    tied to one site), "line" and "error", plus "status" and "output" for
+    problems reported by `caddy validate`.
+    """
+
+    def __init__(self, errors):
+        first = errors[0]
+        where = f"Site '{first['domain']}': " if first.get("domain") else ""
+        more = f" (and {len(errors) - 1} more)" if len(errors) > 1 else ""
+        super().__init__(f"{where}{first['error']}{more}", first.get("line"))
+        self.errors = errors
+
+
+class Validator:
+    """Validation settings; see `from_config` for the config.json keys."""
+
+    def __init__(self, caddy_bin="caddy", run_caddy=True, reserved_ports=None, timeout=60):
+        self.caddy_bin = caddy_bin
+        self.run_caddy = run_caddy
+        # Port -> what uses it.
+        self.reserved_ports = reserved_ports or {}
+        self.timeout = timeout
+
+    @classmethod
+    def from_config(cls, config):
+        reserved = {int(config.get("port", 5154)): "Caddy Web UI"}
+        admin = urlsplit(config.get("caddy_admin", "http://localhost:2019"))
+        try:
+            reserved[admin.port or 2019] = "the Caddy admin API"
+        except ValueError:
+            pass
+        return cls(
+            caddy_bin=config.get("caddy_bin", "caddy"),
+            run_caddy=config.get("validate_with_caddy", config.get("reload_backend", "admin") == "cli"),
+            reserved_ports=reserved,
+            timeout=float(config.get("validate_timeout", 60)),
+        )
+
+    def check(self, doc, caddyfile_path, previous=None):
+        """Validate the Caddyfile `doc` before it replaces `previous` at `caddyfile_path`.
+
+        Returns a list of warnings; raises ValidationError if anything is wrong.
+        """
+        old_configs = {}
+        for block in previous.sites if previous is not None else ():
+            old_configs.setdefault(block.domain, block.config)
+        changed = {block.domain for block in doc.sites if old_configs.get(block.domain) != block.config}
+
+        errors = []
+        warnings = []
+        sites = []
+        for block in doc.sites:
+            try:
+                block.check()
+            except CaddyfileError as e:
+                if block.domain in changed:
+                    errors.append(_problem("syntax", block, str(e)))
+                continue
+            sites.append(block)
+        errors.extend(self._check_addresses(sites, changed))
+        for block in sites:
+            if block.domain in changed:
+                _check_root(block, errors, warnings)
+
+        if not errors and self.run_caddy:
+            errors.extend(self._run_caddy(doc, caddyfile_path, warnings))
+        if errors:
+            raise ValidationError(errors)
+        for warning in warnings:
+            logger.warning(f"Caddyfile check: {warning['error']}" +
+                           (f" (site '{warning['domain']}')" if warning.get("domain") else ""))
+        return warnings
+
+    def _check_addresses(self, sites, changed):
+        errors = []
+        seen = {}
+        schemes = {}
+        for block in sites:
+            for address in block.addresses:
+                try:
+                    scheme, host, port, path = parse_address(address)
+                except ValueError as e:
+                    if block.domain in changed:
+                        errors.append(_problem("address", block, str(e)))
+                    continue
+                if port is None:
+                    continue
+
+                key = (host, port, path)
+                other = seen.setdefault(key, block)
+                if other is not block and changed & {block.domain, other.domain}:
+                    errors.append(_problem(
+                        "duplicate", block,
+                        f"Address '{address}' is already served by '{other.domain}' (line {other.line})"))
+
+                if block.domain in changed and port in self.reserved_ports:
+                    errors.append(_problem(
+                        "port", block, f"Port {port} in '{address}' is used by {self.reserved_ports[port]}"))
+                # Caddy cannot serve HTTP and HTTPS on the same port.
+                schemes.setdefault((port, scheme), block)
+                other = schemes.get((port, "https" if scheme == "http" else "http"))
+                if other is not None and changed & {block.domain, other.domain}:
+                    errors.append(_problem(
+                        "port", block,
+                        f"Port {port} would serve {scheme.upper()} for '{address}' but is already "
+                        f"serving the other scheme for '{other.domain}' (line {other.line})"))
+        return errors
+
+    def _run_caddy(self, doc, caddyfile_path, warnings):
+        directory = os.path.dirname(os.path.abspath(caddyfile_path))
+        digest = hashlib.sha256(doc.text.encode("utf-8")).hexdigest()
+        key = (self.caddy_bin, directory, digest)
+        with _caddy_results_lock:
+            result = _caddy_results.get(key)
+            if result is not None:
+                _caddy_results.move_to_end(key)
+        if result is None:
+            result = self._caddy_validate(doc.text, directory, caddyfile_path)
+            if result is None:
+                warnings.append({"check": "caddy", "domain": None, "line": None,
+                                 "error": f"{self.caddy_bin} could not be run; skipped `caddy validate`"})
+                return []
+            with _caddy_results_lock:
+                _caddy_results[key] = result
+                while len(_caddy_results) > CACHE_SIZE:
+                    _caddy_results.popitem(last=False)
+
+        status, output = result
+        if status == 0:
+            return []
+        # Caddy names the file and line it stopped at, e.g. "Caddyfile:12".
+        match = re.search(re.escape(os.path.basename(caddyfile_path)) + r":(\d+)", output)
+        line = int(match.group(1)) if match else None
+        block = _block_at(doc, line) if line else None
+        return [{
+            "check": "caddy",
+            "domain": block.domain if block is not None and block.kind == "site" else None,
+            "line": line,
+            "error": f"caddy validate exited with status {status}: {output.splitlines()[-1] if output else ''}",
+            "status": status,
+            "output": output,
+        }]
+
+    def _caddy_validate(self, text, directory, caddyfile_path):
+        """Return (exit status, output) of `caddy validate`, or None if it could not run."""
+        fd, tmp_path = tempfile.mkstemp(prefix=".validate-", dir=directory)
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as file:
+                file.write(text)
+            try:
+                result = subprocess.run(
+                    [self.caddy_bin, "validate", "--config", tmp_path, "--adapter", "caddyfile"],
+                    capture_output=True, text=True, timeout=self.timeout)
+            except (OSError, subprocess.TimeoutExpired) as e:
+                logger.warning(f"Could not run {self.caddy_bin} validate: {e}")
+                return None
+        finally:
+            os.remove(tmp_path)
+        output = (result.stderr or result.stdout).strip().replace(tmp_path, caddyfile_path)
+        return result.returncode, output
+
+
+def parse_address(address):
+    """Split a site address into (scheme, host, port, path).
+
+    The port is the one Caddy listens on (80 for http, 443 otherwise when
+    not given); it is None for addresses that cannot be resolved here,
+    such as ones using placeholders.
+    """
+    if "{" in address:
+        return None, address, None, ""
+    scheme, rest = ("", address)
+    if "://" in address:
+        scheme, rest = address.split("://", 1)
+        scheme = scheme.lower()
+        if scheme not in ("http", "https"):
+            raise ValueError(f"Unsupported scheme in '{address}'")
+    hostport, slash, path = rest.partition("/")
+    path = slash + path
+    if hostport.startswith("["):
+        host, _, port_text = hostport[1:].partition("]")
+        port_text = port_text[1:] if port_text.startswith(":") else ""
+    else:
+        host, _, port_text = hostport.rpartition(":") if ":" in hostport else (hostport, "", "")
+    host = host.lower()
+
+    if port_text:
+        if not port_text.isdigit() or not 0 < int(port_text) < 65536:
+            raise ValueError(f"Invalid port in '{address}'")
+        port = int(port_text)
+    else:
+        port = 80 if scheme == "http" else 443
+    if not scheme:
+        # Caddy serves plain HTTP on port 80 and for addresses without a host.
+        scheme = "http" if port == 80 or not host else "https"
+    return scheme, host, port, path
+
+
+def _root_path(block):
+    for directive in block.directives:
+        if directive.name == "root" and directive.args:
+            return directive.args[-1]
+    return None
+
+
+def _check_root(block, errors, warnings):
+    root = _root_path(block)
+    if not root or "{" in root or not os.path.isabs(root):
+        return
+    if os.path.exists(root):
+        if not os.path.isdir(root):
+            errors.append(_problem("root", block, f"Root '{root}' is not a directory"))
+        return
+    parent = os.path.dirname(os.path.abspath(root))
+    while not os.path.exists(parent):
+        parent = os.path.dirname(parent)
+    if not os.path.isdir(parent):
+        errors.append(_problem("root", block, f"Root '{root}' cannot be created: '{parent}' is not a directory"))
+    else:
+        warnings.append(_problem("root", block, f"Root '{root}' does not exist yet"))
+
+
+def _block_at(doc, line):
+    """The last top-level block starting at or before `line`."""
+    found = None
+    for block in doc.blocks:
+        if block.line > line:
+            break
+        found = block
+    return found
+
+
+def _problem(check, block, error):
+    return {"check": check, "domain": block.domain, "line": block.line, "error": error}
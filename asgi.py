@@ -0,0 +1,13 @@
+import json
+import os
+
+from app.asgi import AsgiAdapter
+from app.routes import CONFIG_FILE, app
+
+config = {}
+if os.path.exists(CONFIG_FILE):
+    with open(CONFIG_FILE, "r") as file:
+        config = json.load(file)
+
+application = AsgiAdapter(app, max_threads=int(config.get("asgi_threads", 32)),
+                          max_body=app.config.get("MAX_CONTENT_LENGTH"))
@@ -0,0 +1,131 @@
+"""Compare the line-based Caddyfile parser with app.caddyfile on a synthetic file.
+
+Usage: python -m benchmarks.bench_caddyfile [--sites N] [--repeat N]
+"""
+import argparse
+import os
+import tempfile
+import time
+
+from app.caddyfile import Caddyfile
+from app.utils import SiteIndex, parse_caddyfile
+
+
+def legacy_parse(text):
+    """The line-based parser app.utils used before app.caddyfile existed."""
+    sites = []
+    current_site = None
+    for line in text.splitlines():
+        stripped = line.strip()
+        if not stripped:
+            continue
+        if stripped.endswith("{"):
+            current_site = {"domain": stripped[:-1].strip(), "config": []}
+        elif stripped == "}":
+            if current_site is not None:
+                sites.append(current_site)
+            current_site = None
+        elif current_site is not None:
+            current_site["config"].append(stripped)
+    return sites
+
+
+def legacy_replace(text, domain, config):
+    """Parse, replace one site and serialize every site again, as update_caddyfile used to."""
+    sites = legacy_parse(text)
+    for site in sites:
+        if site["domain"] == domain:
+            site["config"] = config
+    out = []
+    for site in sites:
+        out.append(f"{site['domain']} {{\n")
+        out.extend(f"    {line}\n" for line in site["config"])
+        out.append("}\n")
+    return "".join(out)
+
+
+def generate_caddyfile(sites, root_base="/var/www"):
+    """Return a Caddyfile with global options, a snippet and `sites` site blocks.
+
+    Every third site serves files from `root_base`/site<i>.
+    """
+    parts = [
+        "{\n\temail admin@example.com\n}\n",
+        "(common) {\n\tencode gzip zstd\n\theader -Server\n}\n",
+    ]
+    for i in range(sites):
+        if i % 3 == 0:
+            parts.append(
+                f"# site {i}\n"
+                f"site{i}.example.com, www.site{i}.example.com {{\n"
+                f"\troot * {root_base}/site{i}\n"
+                f"\timport common\n"
+                f"\tfile_server\n"
+                f"}}\n"
+            )
+        else:
+            parts.append(
+                f"site{i}.example.com {{\n"
+                f"\timport common\n"
+                f"\thandle /api/* {{\n"
+                f"\t\treverse_proxy 10.0.{i % 256}.{i % 200}:8080 {{\n"
+                f"\t\t\theader_up Host {{host}}\n"
+                f"\t\t\theader_up X-Real-IP {{remote_host}}\n"
+                f"\t\t}}\n"
+                f"\t}}\n"
+                f"\trespond /health \"ok {{\" 200\n"
+                f"}}\n"
+            )
+    return "\n".join(parts)
+
+
+def best_of(repeat, func, *args):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*args)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sites", type=int, default=25000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    text = generate_caddyfile(args.sites)
+    doc = Caddyfile(text)
+    domain = doc.sites[len(doc.sites) // 2].domain
+
+    print(f"{args.sites} sites, {len(text.encode()) / 1e6:.1f} MB")
+    print(f"legacy parse:         {best_of(args.repeat, legacy_parse, text) * 1000:8.1f} ms")
+    print(f"caddyfile parse:      {best_of(args.repeat, Caddyfile, text) * 1000:8.1f} ms")
+    print(f"splice one site:      {best_of(args.repeat, doc.replace_site, domain, ['respond hi']) * 1000:8.1f} ms")
+    print(f"legacy rewrite:       {best_of(args.repeat, legacy_replace, text, domain, ['respond hi']) * 1000:8.1f} ms")
+
+    # The paths the app takes, from the file on disk: parse_caddyfile for
+    # edits, load_sites for listings and the roots of every site for the
+    # usage and file indexes.
+    variants = {
+        "caddy fmt": text,
+        "CRLF": text.replace("\n", "\r\n"),
+        "unindented lines": text.replace("\tfile_server\n", "file_server\n"),
+        "heredocs": text.replace("\tfile_server\n}", "\tfile_server\n\trespond /ping <<EOF\n\t\tpong }\n\t\tEOF 200\n}"),
+        # No longer cut at "\n}\n": the exact scanner reads the whole file.
+        "unformatted": text.replace("\n}\n", "\n }\n"),
+    }
+    with tempfile.TemporaryDirectory(prefix="caddy-web-ui-bench-") as workdir:
+        path = os.path.join(workdir, "Caddyfile")
+        for label, variant in variants.items():
+            with open(path, "w", encoding="utf-8", newline="") as file:
+                file.write(variant)
+            parse = best_of(args.repeat, parse_caddyfile, path)
+            index = best_of(args.repeat, lambda: SiteIndex(None, Caddyfile.load(path)))
+            roots = best_of(args.repeat, lambda: SiteIndex(None, Caddyfile.load(path)).roots)
+            print(f"{label + ':':<21} parse_caddyfile {parse * 1000:6.1f} ms  "
+                  f"load_sites {index * 1000:6.1f} ms  + roots {roots * 1000:6.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""Measure directory listing latency while slow uploads are in flight.
+
+Start the app first, for example with `uvicorn asgi:application --port 5154`
+or `gunicorn -w 2 run:app -b :5154`, then:
+
+Usage: python -m benchmarks.bench_concurrency --domain example.com [--url URL]
+       [--user admin --password PW] [--uploads N] [--upload-rate KB/s]
+
+Listing latency is measured twice, once idle and once while `--uploads`
+clients each send a file at `--upload-rate` KB/s through the chunked
+upload API. The uploaded files are deleted afterwards.
+"""
+import argparse
+import statistics
+import threading
+import time
+
+import requests
+
+
+def login(args):
+    session = requests.Session()
+    response = session.post(f"{args.url}/login", json={"username": args.user, "password": args.password})
+    if not response.json().get("success"):
+        raise SystemExit("Login failed")
+    return session
+
+
+def measure_listing(args, session_factory, seconds):
+    """Run `--listers` clients listing the site root for `seconds`; return latencies in ms."""
+    latencies = []
+    lock = threading.Lock()
+    deadline = time.monotonic() + seconds
+
+    def lister():
+        session = session_factory()
+        while time.monotonic() < deadline:
+            start = time.perf_counter()
+            session.get(f"{args.url}/list-files/{args.domain}", params={"limit": 200}).raise_for_status()
+            with lock:
+                latencies.append((time.perf_counter() - start) * 1000)
+
+    threads = [threading.Thread(target=lister) for _ in range(args.listers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies
+
+
+def slow_upload(args, session, name, stop):
+    size = args.upload_kb * 1024
+    response = session.post(f"{args.url}/upload-init/{args.domain}", json={"filename": name, "size": size})
+    upload_id = response.json()["upload_id"]
+    block = b"x" * 1024
+
+    def body():
+        for _ in range(args.upload_kb):
+            if stop.is_set():
+                return
+            time.sleep(1 / args.upload_rate)
+            yield block
+
+    try:
+        session.put(f"{args.url}/uploads/{upload_id}", params={"offset": 0}, data=body())
+    finally:
+        session.delete(f"{args.url}/uploads/{upload_id}")
+
+
+def report(label, latencies):
+    if not latencies:
+        print(f"{label:<16} no listing completed")
+        return
+    latencies.sort()
+    p95 = latencies[int(len(latencies) * 0.95) - 1] if latencies else 0
+    print(f"{label:<16} {len(latencies):6d} requests  p50 {statistics.median(latencies):8.1f} ms"
+          f"  p95 {p95:8.1f} ms  max {latencies[-1]:8.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", default="http://127.0.0.1:5154")
+    parser.add_argument("--user", default="admin")
+    parser.add_argument("--password", default="admin")
+    parser.add_argument("--domain", required=True)
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--listers", type=int, default=4)
+    parser.add_argument("--uploads", type=int, default=16)
+    parser.add_argument("--upload-kb", type=int, default=4096)
+    parser.add_argument("--upload-rate", type=float, default=256, help="KB/s per upload")
+    args = parser.parse_args()
+
+    report("idle", measure_listing(args, lambda: login(args), args.seconds))
+
+    stop = threading.Event()
+    uploaders = [
+        threading.Thread(target=slow_upload, args=(args, login(args), f"bench-upload-{i}.bin", stop))
+        for i in range(args.uploads)
+    ]
+    for thread in uploaders:
+        thread.start()
+    time.sleep(1)
+    report(f"{args.uploads} uploads", measure_listing(args, lambda: login(args), args.seconds))
+    stop.set()
+    for thread in uploaders:
+        thread.join()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""Measure pushing a Caddyfile to a fleet of Caddy nodes, against local stub admin servers.
+
+Usage: python -m benchmarks.bench_fleet [--nodes 6] [--sites 1800] [--latency-ms 50]
+       [--repeat 5] [--fail 1]
+
+Each stub answers the admin API calls FleetBackend makes (/adapt,
+/config/, /load and single-route PATCH/PUT/DELETE) after `--latency-ms`,
+keeping its config in memory. The same edits are pushed with one worker
+(one node after another) and with one worker per node, then `--fail`
+stubs are made to reject every change to show partial-failure reporting.
+"""
+import argparse
+import json
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+from benchmarks.bench_caddyfile import generate_caddyfile
+from benchmarks.check_admin_api import StubAdmin
+
+
+def push(backend, caddyfile, repeat):
+    """Change one site `repeat` times and return the reload times in ms."""
+    samples = []
+    for i in range(repeat):
+        with open(caddyfile, "r") as file:
+            text = file.read()
+        with open(caddyfile, "w") as file:
+            file.write(text.replace("respond ", f"respond {i} ", 1))
+        start = time.perf_counter()
+        backend.reload(caddyfile)
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--nodes", type=int, default=6)
+    parser.add_argument("--sites", type=int, default=1800)
+    parser.add_argument("--latency-ms", type=float, default=50, help="delay added to every stub request")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--fail", type=int, default=1, help="stubs that reject changes in the last run")
+    args = parser.parse_args()
+
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from app.caddy import AdminApiBackend, CaddyError, FleetBackend
+
+    logging.getLogger("app.caddy").setLevel(logging.ERROR)
+    stubs = [StubAdmin(args.latency_ms / 1000) for _ in range(args.nodes)]
+    for stub in stubs:
+        threading.Thread(target=stub.serve_forever, daemon=True).start()
+    nodes = [(f"node{i}", AdminApiBackend(stub.url)) for i, stub in enumerate(stubs)]
+
+    with tempfile.TemporaryDirectory(prefix="caddy-web-ui-fleet-") as workdir:
+        caddyfile = os.path.join(workdir, "Caddyfile")
+        with open(caddyfile, "w") as file:
+            file.write(generate_caddyfile(args.sites))
+
+        # The first push loads the whole config; later ones patch one route.
+        FleetBackend(None, nodes, workers=args.nodes).reload(caddyfile)
+        for label, workers in (("one node at a time", 1), (f"{args.nodes} nodes at once", args.nodes)):
+            samples = push(FleetBackend(None, nodes, workers=workers), caddyfile, args.repeat)
+            print(f"{label:<24} median {statistics.median(samples):8.1f} ms  max {max(samples):8.1f} ms")
+
+        for stub in stubs[:args.fail]:
+            stub.failing = True
+        try:
+            push(FleetBackend(None, nodes, workers=args.nodes), caddyfile, 1)
+            print("no node failed")
+        except CaddyError as e:
+            print(f"partial failure: {e}")
+            for node in e.result["nodes"]:
+                print(f"  {node['node']:<8} {node['status']:<10} {node['seconds'] * 1000:8.1f} ms")
+
+    in_sync = len({json.dumps(stub.config, sort_keys=True) for stub in stubs[args.fail:]}) == 1
+    print(f"healthy nodes in sync: {in_sync}")
+    for stub in stubs:
+        stub.shutdown()
+
+
+if __name__ == "__main__":
+    main()
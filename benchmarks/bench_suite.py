@@ -0,0 +1,289 @@
+"""Benchmark the Caddyfile helpers and the main routes and write the results as JSON.
+
+Usage: python -m benchmarks.bench_suite [--output FILE] [--compare BASELINE]
+       [--sizes 10,100,1000,10000] [--tree-files N] [--workers N]
+
+Everything runs in a temporary directory: a synthetic Caddyfile, a site
+tree of `--tree-files` files and an app/config with `caddy` replaced by a
+stub that always succeeds. Routes are timed through the Flask test client,
+then a load generator runs `--workers` HTTP clients against a threaded
+server for `--load-seconds`.
+
+With `--compare`, every median is compared against an earlier result file
+and the run exits with status 1 if any got slower by more than
+`--threshold`.
+"""
+import argparse
+import io
+import json
+import logging
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import zipfile
+
+import bcrypt
+import requests
+
+from benchmarks.bench_caddyfile import generate_caddyfile
+
+ROOT_SITE = "site0.example.com"
+PLAIN_SITE = "site1.example.com"
+
+
+def summarize(samples):
+    samples = sorted(samples)
+    return {
+        "n": len(samples),
+        "min_ms": samples[0] * 1000,
+        "p50_ms": statistics.median(samples) * 1000,
+        "p95_ms": samples[max(0, int(len(samples) * 0.95) - 1)] * 1000,
+        "max_ms": samples[-1] * 1000,
+    }
+
+
+def run_timed(repeat, func):
+    samples = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        func(i)
+        samples.append(time.perf_counter() - start)
+    return summarize(samples)
+
+
+def make_tree(root, files, per_dir):
+    """Create `files` empty files in directories of `per_dir` entries; return the first directory."""
+    for i in range(files):
+        directory = os.path.join(root, f"d{i // per_dir:05d}")
+        if i % per_dir == 0:
+            os.makedirs(directory, exist_ok=True)
+        open(os.path.join(directory, f"file{i:07d}.html"), "wb").close()
+    return os.path.join(root, "d00000")
+
+
+def make_workspace(workdir, sites):
+    """Write app/config, a Caddyfile and a caddy stub under workdir; return the Caddyfile path."""
+    caddyfile = os.path.join(workdir, "Caddyfile")
+    with open(caddyfile, "w") as file:
+        file.write(generate_caddyfile(sites, root_base=os.path.join(workdir, "www")))
+
+    stub = os.path.join(workdir, "caddy-stub")
+    with open(stub, "w") as file:
+        # `caddy fmt -` echoes the Caddyfile it is given.
+        file.write('#!/bin/sh\nif [ "$1" = fmt ]; then cat; fi\nexit 0\n')
+    os.chmod(stub, 0o755)
+
+    config_dir = os.path.join(workdir, "app", "config")
+    os.makedirs(config_dir)
+    with open(os.path.join(config_dir, "config.json"), "w") as file:
+        json.dump({
+            "first_run": False,
+            "caddyfile": caddyfile,
+            "reload_backend": "cli",
+            "caddy_bin": stub,
+            "log_level": "WARNING",
+        }, file)
+    with open(os.path.join(config_dir, "users.json"), "w") as file:
+        json.dump({"bench": bcrypt.hashpw(b"bench", bcrypt.gensalt(4)).decode()}, file)
+    return caddyfile
+
+
+def bench_caddyfile(workdir, sizes, repeat):
+    from app.utils import parse_caddyfile, update_caddyfile
+
+    results = {}
+    for size in sizes:
+        path = os.path.join(workdir, f"Caddyfile.{size}")
+        with open(path, "w") as file:
+            file.write(generate_caddyfile(size))
+        sites = [site.as_dict() for site in parse_caddyfile(path)]
+
+        def update(i):
+            sites[len(sites) // 2]["config"] = [f"respond \"{i}\""]
+            update_caddyfile(path, sites)
+
+        parse = run_timed(repeat, lambda i: parse_caddyfile(path))
+        results[str(size)] = {
+            "bytes": os.path.getsize(path),
+            "parse": parse,
+            "parse_sites_per_second": size / (parse["p50_ms"] / 1000),
+            "update": run_timed(repeat, update),
+        }
+    return results
+
+
+def bench_routes(app, list_dir, repeat):
+    client = app.test_client()
+    client.post("/login", json={"username": "bench", "password": "bench"})
+    relative_dir = os.path.basename(list_dir)
+    payload = os.urandom(256 * 1024)
+
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, "w") as zf:
+        for i in range(100):
+            zf.writestr(f"assets/file{i}.txt", f"file {i}\n" * 100)
+    archive = archive.getvalue()
+
+    def check(response):
+        if response.status_code >= 400:
+            raise RuntimeError(f"{response.request.path} returned {response.status_code}: {response.data[:200]!r}")
+
+    def upload(i):
+        data = {"files": (io.BytesIO(payload), f"upload{i}.bin")}
+        check(client.post(f"/upload/{ROOT_SITE}/uploads", data=data, content_type="multipart/form-data"))
+
+    def upload_zip(i):
+        data = {"zip": (io.BytesIO(archive), "site.zip")}
+        check(client.post(f"/upload-zip/{ROOT_SITE}/unzipped{i}", data=data, content_type="multipart/form-data"))
+
+    def edit_site(i):
+        check(client.post("/edit-site", json={"domain": PLAIN_SITE, "config": [f"respond \"edit {i}\""]}))
+
+    return {
+        "GET /": run_timed(repeat, lambda i: check(client.get("/"))),
+        "GET /api/sites": run_timed(repeat, lambda i: check(client.get("/api/sites"))),
+        "GET /api/sites?q=": run_timed(repeat, lambda i: check(client.get(f"/api/sites?q=site{i}"))),
+        "GET /list-files": run_timed(repeat, lambda i: check(client.get(f"/list-files/{ROOT_SITE}/{relative_dir}"))),
+        "GET /list-files?sort=modified": run_timed(
+            repeat, lambda i: check(client.get(f"/list-files/{ROOT_SITE}/{relative_dir}?sort=modified&order=desc"))),
+        "POST /upload (256 KiB)": run_timed(repeat, upload),
+        "POST /upload-zip (100 files)": run_timed(repeat, upload_zip),
+        "POST /edit-site": run_timed(repeat, edit_site),
+    }
+
+
+def bench_load(app, list_dir, workers, seconds):
+    from werkzeug.serving import make_server
+
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+    server = make_server("127.0.0.1", 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_port}"
+    paths = {"GET /api/sites": "/api/sites", "GET /list-files": f"/list-files/{ROOT_SITE}/{os.path.basename(list_dir)}"}
+    samples = {name: [] for name in paths}
+    lock = threading.Lock()
+    deadline = time.monotonic() + seconds
+
+    def worker(n):
+        session = requests.Session()
+        session.post(f"{url}/login", json={"username": "bench", "password": "bench"})
+        i = n
+        names = list(paths)
+        while time.monotonic() < deadline:
+            name = names[i % len(names)]
+            i += 1
+            start = time.perf_counter()
+            session.get(url + paths[name]).raise_for_status()
+            with lock:
+                samples[name].append(time.perf_counter() - start)
+
+    try:
+        threads = [threading.Thread(target=worker, args=(n,)) for n in range(workers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        server.shutdown()
+    total = sum(len(values) for values in samples.values())
+    return {
+        "workers": workers,
+        "seconds": seconds,
+        "requests_per_second": total / seconds,
+        **{name: summarize(values) for name, values in samples.items() if values},
+    }
+
+
+def medians(results, prefix=""):
+    """Yield (name, p50_ms) for every timing in a result tree."""
+    for key, value in results.items():
+        if isinstance(value, dict):
+            if "p50_ms" in value:
+                yield prefix + key, value["p50_ms"]
+            else:
+                yield from medians(value, f"{prefix}{key} / ")
+
+
+def compare(baseline, results, threshold):
+    old = dict(medians({k: v for k, v in baseline.items() if k != "meta"}))
+    regressions = 0
+    for name, p50 in medians({k: v for k, v in results.items() if k != "meta"}):
+        if name not in old:
+            continue
+        ratio = p50 / old[name] if old[name] else 1.0
+        flag = "  REGRESSION" if ratio > threshold else ""
+        regressions += bool(flag)
+        print(f"{name:<60} {old[name]:9.2f} -> {p50:9.2f} ms  x{ratio:.2f}{flag}", file=sys.stderr)
+    return regressions
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", default="10,100,1000,10000", help="Caddyfile sizes in sites")
+    parser.add_argument("--sites", type=int, default=1800, help="sites in the Caddyfile used by the routes")
+    parser.add_argument("--tree-files", type=int, default=20000)
+    parser.add_argument("--dir-files", type=int, default=5000, help="files per directory in the site tree")
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--load-seconds", type=float, default=5)
+    parser.add_argument("--output", help="write JSON here instead of stdout")
+    parser.add_argument("--compare", help="earlier result file to compare medians against")
+    parser.add_argument("--threshold", type=float, default=1.25, help="slowdown ratio counted as a regression")
+    args = parser.parse_args()
+
+    sizes = [int(size) for size in args.sizes.split(",")]
+    repo = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    sys.path.insert(0, repo)
+    results = {
+        "meta": {
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "time": time.time(),
+            "args": vars(args),
+        }
+    }
+
+    with tempfile.TemporaryDirectory(prefix="caddy-web-ui-bench-") as workdir:
+        make_workspace(workdir, args.sites)
+        list_dir = make_tree(os.path.join(workdir, "www", "site0"), args.tree_files, args.dir_files)
+        # The app reads app/config relative to the working directory.
+        os.chdir(workdir)
+        from app.routes import app
+
+        print("Caddyfile helpers...", file=sys.stderr)
+        results["caddyfile"] = bench_caddyfile(workdir, sizes, max(3, args.repeat // 4))
+        print("Routes...", file=sys.stderr)
+        results["routes"] = bench_routes(app, list_dir, args.repeat)
+        print("Load...", file=sys.stderr)
+        results["load"] = bench_load(app, list_dir, args.workers, args.load_seconds)
+        os.chdir(repo)
+
+    text = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(text + "\n")
+    else:
+        print(text)
+
+    if args.compare:
+        with open(args.compare, "r") as file:
+            if compare(json.load(file), results, args.threshold):
+                sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
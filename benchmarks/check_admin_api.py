@@ -0,0 +1,176 @@
+"""Check which admin API calls AdminApiBackend makes for each kind of Caddyfile change.
+
+Usage: python -m benchmarks.check_admin_api [--sites 6]
+
+A local stub admin server (bench_fleet uses the same one) keeps its
+config in memory. The script loads a Caddyfile, then changes one site,
+adds one, removes one and changes two at once, and checks after each
+push that the backend sent the expected request (a single-route PATCH,
+PUT or DELETE, or a full /load) and that the stub's config equals the
+adapted Caddyfile. Last, the admin endpoint is made unreachable to check
+the CLI fallback. Exits with status 1 if any step went differently.
+"""
+import argparse
+import json
+import logging
+import os
+import socket
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from benchmarks.bench_caddyfile import generate_caddyfile
+
+
+def adapt(text):
+    """A stand-in for Caddy's adapter: one route per site, matched on its addresses."""
+    from app.caddyfile import Caddyfile
+
+    routes = [{"match": [{"host": block.addresses}],
+               "handle": [{"handler": "static_response", "body": "\n".join(block.config)}]}
+              for block in Caddyfile(text).sites]
+    return {"apps": {"http": {"servers": {"srv0": {"listen": [":443"], "routes": routes}}}}}
+
+
+class StubAdmin(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, latency=0):
+        super().__init__(("127.0.0.1", 0), StubHandler)
+        self.latency = latency
+        self.config = {}
+        self.failing = False
+        self.lock = threading.Lock()
+        self.requests = 0
+        # (method, path) of every request, in order.
+        self.calls = []
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_port}"
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def _reply(self, status, body=None):
+        data = json.dumps(body).encode("utf-8") if body is not None else b""
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _handle(self):
+        server = self.server
+        time.sleep(server.latency)
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else b""
+        with server.lock:
+            server.requests += 1
+            server.calls.append((self.command, self.path))
+            if self.command == "POST" and self.path == "/adapt":
+                return self._reply(200, {"result": adapt(body.decode("utf-8"))})
+            if self.command == "GET" and self.path == "/config/":
+                return self._reply(200, server.config)
+            if server.failing:
+                return self._reply(500, {"error": "stub node is failing"})
+            if self.command == "POST" and self.path == "/load":
+                server.config = json.loads(body)
+                return self._reply(200)
+            prefix = "/config/apps/http/servers/srv0/routes/"
+            if self.path.startswith(prefix):
+                routes = server.config["apps"]["http"]["servers"]["srv0"]["routes"]
+                index = int(self.path[len(prefix):])
+                if self.command == "PATCH":
+                    routes[index] = json.loads(body)
+                elif self.command == "PUT":
+                    routes.insert(index, json.loads(body))
+                elif self.command == "DELETE":
+                    del routes[index]
+                return self._reply(200)
+        self._reply(404, {"error": f"unknown path {self.path}"})
+
+    do_GET = do_POST = do_PATCH = do_PUT = do_DELETE = _handle
+
+
+class RecordingFallback:
+    """Stands in for CliBackend and records the reloads that reach it."""
+
+    def __init__(self):
+        self.reloads = []
+
+    def reload(self, caddyfile_path):
+        self.reloads.append(caddyfile_path)
+        return {"backend": "cli"}
+
+
+def unused_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sites", type=int, default=6)
+    args = parser.parse_args()
+
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from app.caddy import AdminApiBackend
+    from app.caddyfile import Caddyfile
+
+    logging.getLogger("app.caddy").setLevel(logging.ERROR)
+    stub = StubAdmin()
+    threading.Thread(target=stub.serve_forever, daemon=True).start()
+    backend = AdminApiBackend(stub.url, fallback=RecordingFallback())
+    routes = "/config/apps/http/servers/srv0/routes/"
+    last = args.sites - 1
+
+    # (label, edit of the Caddyfile text, expected method, expected (method, path) or None).
+    steps = [
+        ("first load", lambda text: text, "load", ("POST", "/load")),
+        ("no change", lambda text: text, "unchanged", None),
+        ("change one site", lambda text: Caddyfile(text).replace_site("site1.example.com", ['respond "one"']),
+         "patch", ("PATCH", routes + "1")),
+        ("add a site", lambda text: Caddyfile(text).add_site("new.example.com", ['respond "new"']),
+         "put", ("PUT", routes + str(args.sites))),
+        ("remove a site", lambda text: Caddyfile(text).remove_site("site2.example.com"),
+         "delete", ("DELETE", routes + "2")),
+        ("change two sites", lambda text: Caddyfile(Caddyfile(text).replace_site(
+            "site1.example.com", ['respond "two"'])).replace_site(f"site{last}.example.com", ['respond "two"']),
+         "load", ("POST", "/load")),
+    ]
+
+    failures = 0
+    with tempfile.TemporaryDirectory(prefix="caddy-web-ui-admin-") as workdir:
+        caddyfile = os.path.join(workdir, "Caddyfile")
+        text = generate_caddyfile(args.sites)
+        for label, edit, expected, call in steps:
+            text = edit(text)
+            with open(caddyfile, "w") as file:
+                file.write(text)
+            del stub.calls[:]
+            result = backend.reload(caddyfile)
+            changes = [c for c in stub.calls if c[0] != "GET" and c[1] != "/adapt"]
+            ok = (result["method"] == expected and changes == ([call] if call else [])
+                  and stub.config == adapt(text))
+            failures += not ok
+            sent = ", ".join(f"{method} {path}" for method, path in changes) or "nothing"
+            print(f"{label:<18} {result['method']:<10} sent {sent:<50} {'ok' if ok else 'FAILED'}")
+
+        backend.admin_url = f"http://127.0.0.1:{unused_port()}"
+        result = backend.reload(caddyfile)
+        ok = result == {"backend": "cli"} and backend.fallback.reloads == [caddyfile]
+        failures += not ok
+        print(f"{'admin unreachable':<18} {result['backend']:<10} {'':<55} {'ok' if ok else 'FAILED'}")
+
+    stub.shutdown()
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
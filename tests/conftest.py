@@ -0,0 +1,82 @@
+import json
+import os
+import time
+
+import bcrypt
+import pytest
+
+CADDYFILE = """{
+	email admin@example.com
+}
+
+(common) {
+	encode gzip
+}
+
+example.com, www.example.com {
+	root * ROOT
+	import common
+	file_server
+}
+
+api.example.com {
+	reverse_proxy 127.0.0.1:8080
+}
+"""
+
+
+@pytest.fixture
+def site_root(tmp_path):
+    root = tmp_path / "sites" / "example"
+    root.mkdir(parents=True)
+    return root
+
+
+@pytest.fixture
+def caddyfile(tmp_path, site_root):
+    path = tmp_path / "Caddyfile"
+    path.write_text(CADDYFILE.replace("ROOT", str(site_root)))
+    return path
+
+
+@pytest.fixture
+def client(tmp_path, caddyfile, monkeypatch):
+    """A logged-in test client of an app whose config lives under tmp_path.
+
+    `caddy` is replaced by `true`, so reloads succeed without a Caddy server.
+    """
+    monkeypatch.chdir(tmp_path)
+    config_dir = tmp_path / "app" / "config"
+    config_dir.mkdir(parents=True)
+    (config_dir / "config.json").write_text(json.dumps({
+        "caddyfile": str(caddyfile),
+        "first_run": False,
+        "reload_backend": "cli",
+        "caddy_bin": "true",
+        "caddy_fmt": False,
+        "validate_with_caddy": False,
+    }))
+    (config_dir / "users.json").write_text(json.dumps({
+        "admin": bcrypt.hashpw(b"secret", bcrypt.gensalt(4)).decode(),
+    }))
+
+    from app import routes
+
+    # Absolute, so jobs still running after the test cannot write into the working tree.
+    for name, value in vars(routes).copy().items():
+        if name.isupper() and isinstance(value, str) and value.startswith(os.path.join("app", "config", "")):
+            monkeypatch.setattr(routes, name, str(tmp_path / value))
+    client = routes.create_app().test_client()
+    response = client.post("/login", json={"username": "admin", "password": "secret"})
+    assert response.json["success"]
+    return client
+
+
+def wait_for_job(client, job_id, timeout=10):
+    """Poll /jobs/<id> until the job has finished and return it."""
+    deadline = time.monotonic() + timeout
+    while True:
+        job = client.get(f"/jobs/{job_id}").json["job"]
+        if job["status"] in ("succeeded", "failed", "cancelled") or time.monotonic() > deadline:
+            return job
+        time.sleep(0.02)
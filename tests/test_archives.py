@@ -0,0 +1,132 @@
+import io
+import os
+import stat
+import zipfile
+
+import pytest
+
+from app.archives import ArchiveError, extract_archive
+
+
+def make_zip(path, members):
+    with zipfile.ZipFile(path, "w") as archive:
+        for name, data in members:
+            archive.writestr(name, data)
+    return path
+
+
+def symlink_member(name, target):
+    info = zipfile.ZipInfo(name)
+    info.external_attr = (stat.S_IFLNK | 0o777) << 16
+    return info, target
+
+
+def test_extracts_into_the_target(tmp_path):
+    archive = make_zip(tmp_path / "site.zip", [("index.html", "hi"), ("css/site.css", "body {}")])
+    target = tmp_path / "site"
+
+    staging = tmp_path / "staging"
+
+    result = extract_archive(str(archive), str(target), name="site.zip", staging_dir=str(staging))
+
+    assert result == {"files": 2, "bytes": 9, "replaced": 0, "replaced_files": []}
+    assert (target / "index.html").read_text() == "hi"
+    assert (target / "css" / "site.css").read_text() == "body {}"
+    assert sorted(os.listdir(target)) == ["css", "index.html"]
+    assert os.listdir(staging) == []
+
+
+def test_replaced_files_are_reported_or_refused(tmp_path):
+    archive = make_zip(tmp_path / "site.zip", [("index.html", "new"), ("css/site.css", "body {}")])
+    target = tmp_path / "site"
+    (target / "css").mkdir(parents=True)
+    (target / "index.html").write_text("old")
+
+    with pytest.raises(ArchiveError, match="overwrite"):
+        extract_archive(str(archive), str(target), name="site.zip", overwrite=False)
+    assert (target / "index.html").read_text() == "old"
+    assert os.listdir(target / "css") == []
+
+    result = extract_archive(str(archive), str(target), name="site.zip")
+    assert (result["replaced"], result["replaced_files"]) == (1, ["index.html"])
+    assert (target / "index.html").read_text() == "new"
+
+
+def test_a_file_in_place_of_a_directory_is_refused(tmp_path):
+    archive = make_zip(tmp_path / "site.zip", [("index.html", "hi"), ("css/site.css", "body {}")])
+    target = tmp_path / "site"
+    target.mkdir()
+    (target / "css").write_text("not a directory")
+
+    with pytest.raises(ArchiveError, match="directory"):
+        extract_archive(str(archive), str(target), name="site.zip")
+    assert sorted(os.listdir(target)) == ["css"]
+
+
+def test_duplicate_members_reject_the_archive(tmp_path):
+    archive = tmp_path / "dup.zip"
+    with zipfile.ZipFile(archive, "w") as zf, pytest.warns(UserWarning, match="Duplicate name"):
+        zf.writestr("index.html", "one")
+        zf.writestr("./index.html", "two")
+        zf.writestr("index.html", "three")
+    target = tmp_path / "site"
+
+    with pytest.raises(ArchiveError, match="Duplicate member"):
+        extract_archive(str(archive), str(target), name="dup.zip")
+    assert os.listdir(target) == []
+
+
+@pytest.mark.parametrize("member", [
+    ("../escaped.txt", "x"),
+    ("css/../../escaped.txt", "x"),
+    ("/tmp/escaped.txt", "x"),
+    ("..\\escaped.txt", "x"),
+    ("C:/escaped.txt", "x"),
+    symlink_member("link", "/etc/passwd"),
+])
+def test_unsafe_members_reject_the_whole_archive(tmp_path, member):
+    archive = make_zip(tmp_path / "evil.zip", [("index.html", "hi"), member])
+    target = tmp_path / "site"
+
+    with pytest.raises(ArchiveError):
+        extract_archive(str(archive), str(target), name="evil.zip")
+
+    assert os.listdir(target) == []
+    assert not (tmp_path / "escaped.txt").exists()
+
+
+def test_upload_zip_rejects_traversal_and_leaves_nothing_behind(client, tmp_path, site_root):
+    data = io.BytesIO()
+    with zipfile.ZipFile(data, "w") as archive:
+        archive.writestr("index.html", "hi")
+        archive.writestr("../../escaped.txt", "x")
+    data.seek(0)
+
+    response = client.post("/upload-zip/example.com", data={"zip": (data, "site.zip")},
+                           content_type="multipart/form-data")
+
+    assert response.status_code == 400
+    assert "Unsafe path" in response.json["error"]
+    assert os.listdir(site_root) == []
+    assert not (tmp_path / "escaped.txt").exists()
+    assert os.listdir(tmp_path / "app" / "config" / "uploads") == []
+
+
+def test_upload_zip_stages_outside_the_site_and_can_refuse_overwrites(client, tmp_path, site_root):
+    (site_root / "index.html").write_text("old")
+
+    def upload(**form):
+        data = io.BytesIO()
+        with zipfile.ZipFile(data, "w") as archive:
+            archive.writestr("index.html", "new")
+        data.seek(0)
+        return client.post("/upload-zip/example.com", data={"zip": (data, "site.zip"), **form},
+                           content_type="multipart/form-data")
+
+    assert upload(overwrite="0").status_code == 400
+    assert (site_root / "index.html").read_text() == "old"
+
+    assert upload().status_code == 200
+    assert os.listdir(site_root) == ["index.html"]
+    assert (site_root / "index.html").read_text() == "new"
+    assert os.listdir(tmp_path / "app" / "config" / "data" / "staging") == []
@@ -0,0 +1,98 @@
+import asyncio
+import json
+
+from flask import Flask, request
+
+from app.asgi import BUFFER_SIZE, AsgiAdapter
+
+
+def echo_app():
+    app = Flask(__name__)
+
+    @app.route("/upload", methods=["PUT"])
+    def upload():
+        size = 0
+        chunks = 0
+        while True:
+            data = request.stream.read(64 * 1024)
+            if not data:
+                break
+            size += len(data)
+            chunks += 1
+        return {"size": size, "chunks": chunks}
+
+    @app.route("/form", methods=["POST"])
+    def form():
+        return {"name": request.form["name"], "file": len(request.files["file"].read())}
+
+    return app
+
+
+def call(adapter, body_chunks, headers=(), path="/upload", method="PUT"):
+    """Run one request through the adapter; returns (status, body, number of messages received)."""
+    messages = [{"type": "http.request", "body": chunk, "more_body": i < len(body_chunks) - 1}
+                for i, chunk in enumerate(body_chunks)] or [{"type": "http.request", "body": b""}]
+    sent = []
+    received = []
+
+    async def receive():
+        if received and received[-1] is messages[-1]:
+            await asyncio.sleep(3600)
+        received.append(messages[len(received)])
+        return received[-1]
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {"type": "http", "method": method, "path": path, "headers": list(headers), "query_string": b""}
+    asyncio.run(adapter(scope, receive, send))
+    status = sent[0]["status"]
+    body = b"".join(message.get("body", b"") for message in sent[1:])
+    return status, body, len(received)
+
+
+def test_large_bodies_are_streamed_to_the_app_as_they_arrive():
+    chunks = [b"x" * 100_000] * 30
+    adapter = AsgiAdapter(echo_app().wsgi_app, max_threads=2)
+
+    status, body, received = call(adapter, chunks, [(b"content-length", str(sum(map(len, chunks))).encode())])
+
+    assert status == 200
+    assert json.loads(body) == {"size": 3_000_000, "chunks": 60}
+    assert received == 30
+
+
+def test_small_bodies_and_forms_are_received_before_the_app_runs():
+    boundary = "b0undary"
+    form = (f"--{boundary}\r\nContent-Disposition: form-data; name=\"name\"\r\n\r\nsite\r\n"
+            f"--{boundary}\r\nContent-Disposition: form-data; name=\"file\"; filename=\"a.txt\"\r\n\r\n"
+            f"{'y' * 5000}\r\n--{boundary}--\r\n").encode()
+    chunks = [form[:1000], form[1000:]]
+    adapter = AsgiAdapter(echo_app().wsgi_app, max_threads=2)
+
+    status, body, _ = call(adapter, chunks, [(b"content-type", f"multipart/form-data; boundary={boundary}".encode()),
+                                             (b"content-length", str(len(form)).encode())],
+                           path="/form", method="POST")
+
+    assert len(form) <= BUFFER_SIZE
+    assert status == 200
+    assert json.loads(body) == {"name": "site", "file": 5000}
+
+
+def test_a_declared_length_over_the_limit_is_refused_before_reading():
+    adapter = AsgiAdapter(echo_app().wsgi_app, max_threads=2, max_body=1000)
+
+    status, body, received = call(adapter, [b"x" * 2000], [(b"content-length", b"2000")])
+
+    assert status == 413
+    assert json.loads(body)["success"] is False
+    assert received == 0
+
+
+def test_an_undeclared_body_is_cut_off_at_the_limit():
+    adapter = AsgiAdapter(echo_app().wsgi_app, max_threads=2, max_body=250_000)
+
+    status, _, received = call(adapter, [b"x" * 100_000] * 10, [(b"transfer-encoding", b"chunked")])
+
+    assert status == 413
+    assert received == 3
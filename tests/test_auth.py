@@ -0,0 +1,66 @@
+import multiprocessing
+
+import pytest
+
+from app.auth import LoginThrottled, PasswordChecker, RateLimiter, SharedRateLimiter
+
+
+def consume(db_path, times):
+    limiter = SharedRateLimiter(db_path, "ip", rate=60)
+    for _ in range(times):
+        limiter.consume("10.0.0.1")
+
+
+@pytest.mark.parametrize("shared", [False, True])
+def test_a_bucket_empties_and_refills(tmp_path, shared, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr("app.auth.time.time", lambda: now[0])
+    monkeypatch.setattr("app.auth.time.monotonic", lambda: now[0])
+    limiter = SharedRateLimiter(str(tmp_path / "limits.sqlite3"), "ip", 6, burst=2) if shared else RateLimiter(6, 2)
+
+    limiter.consume("a")
+    assert limiter.retry_after("a") == 0
+    limiter.consume("a")
+    assert limiter.retry_after("a") == pytest.approx(10)
+    assert limiter.retry_after("b") == 0
+
+    now[0] += 5
+    assert limiter.retry_after("a") == pytest.approx(5)
+    now[0] += 5
+    assert limiter.retry_after("a") == 0
+
+
+def test_buckets_are_shared_by_every_worker(tmp_path):
+    db_path = str(tmp_path / "limits.sqlite3")
+    workers = [multiprocessing.Process(target=consume, args=(db_path, 15)) for _ in range(4)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    # 60 attempts were made against a burst of 60; a little has refilled since.
+    assert SharedRateLimiter(db_path, "ip", rate=60).retry_after("10.0.0.1") > 0.5
+    assert SharedRateLimiter(db_path, "user", rate=60).retry_after("10.0.0.1") == 0
+
+
+def test_failed_logins_in_one_worker_throttle_the_others(tmp_path):
+    db_path = str(tmp_path / "limits.sqlite3")
+    users = {}
+    first = PasswordChecker(per_ip=100, per_user=2, db_path=db_path)
+    second = PasswordChecker(per_ip=100, per_user=2, db_path=db_path)
+
+    assert not first.check(users, "admin", "guess", "10.0.0.1")
+    assert not first.check(users, "admin", "guess", "10.0.0.2")
+    with pytest.raises(LoginThrottled):
+        second.check(users, "admin", "guess", "10.0.0.3")
+
+
+def test_the_login_route_shares_its_limits_through_the_config_directory(client, tmp_path):
+    for _ in range(5):
+        client.post("/login", json={"username": "admin", "password": "wrong"})
+
+    response = client.post("/login", json={"username": "admin", "password": "wrong"})
+
+    assert response.status_code == 429
+    assert int(response.headers["Retry-After"]) > 0
+    assert (tmp_path / "app" / "config" / "login-limits.sqlite3").exists()
@@ -0,0 +1,94 @@
+from app.caddyfile import Caddyfile
+
+from conftest import wait_for_job
+
+
+def batch(client, *operations):
+    return client.post("/sites/batch", json={"operations": list(operations)})
+
+
+def test_all_operations_are_written_at_once_with_one_reload(client, caddyfile, tmp_path):
+    new_root = tmp_path / "sites" / "new"
+
+    response = batch(client,
+                     {"op": "create", "domain": "new.example.com", "config": [f"root * {new_root}", "file_server"]},
+                     {"op": "update", "domain": "api.example.com", "config": "reverse_proxy 127.0.0.1:9090"},
+                     {"op": "delete", "domain": "www.example.com"})
+
+    assert response.status_code == 200, response.json
+    assert response.json["applied"] == 3 and response.json["reload_job"]
+    sites = {block.domain: block.config for block in Caddyfile.load(str(caddyfile)).sites}
+    assert sites == {"api.example.com": ["reverse_proxy 127.0.0.1:9090"],
+                     "new.example.com": [f"root * {new_root}", "file_server"]}
+    assert new_root.is_dir()
+    assert (tmp_path / "Caddyfile.bak").exists()
+
+
+def test_one_invalid_operation_rejects_the_whole_batch(client, caddyfile):
+    before = caddyfile.read_text()
+
+    response = batch(client,
+                     {"op": "update", "domain": "api.example.com", "config": ["respond ok"]},
+                     {"op": "create", "domain": "example.com", "config": ["respond dup"]},
+                     {"op": "delete", "domain": "missing.example.com"},
+                     {"op": "rename", "domain": "api.example.com"},
+                     {"op": "update", "domain": "api.example.com", "config": ["respond again"]})
+
+    assert response.status_code == 400
+    assert [error["index"] for error in response.json["errors"]] == [1, 2, 3, 4]
+    assert caddyfile.read_text() == before
+
+
+def test_a_batch_must_be_a_list(client):
+    assert client.post("/sites/batch", json={"operations": {"op": "delete"}}).status_code == 400
+
+
+def test_sites_are_moved_before_the_caddyfile_is_written(client, caddyfile, site_root, tmp_path):
+    (site_root / "index.html").write_text("hi")
+    new_root = tmp_path / "sites" / "moved"
+
+    response = batch(client,
+                     {"op": "update", "domain": "example.com",
+                      "config": [f"root * {new_root}", "file_server"]},
+                     {"op": "update", "domain": "api.example.com", "config": ["respond ok"]})
+
+    assert response.status_code == 202, response.json
+    job = wait_for_job(client, response.json["batch_job"])
+    assert job["status"] == "succeeded", job
+    assert job["result"]["applied"] == 2 and job["result"]["reload_job"]
+    assert (new_root / "index.html").read_text() == "hi"
+    assert not site_root.exists()
+    sites = {block.domain: block.config for block in Caddyfile.load(str(caddyfile)).sites}
+    assert sites["example.com, www.example.com"] == [f"root * {new_root}", "file_server"]
+    assert sites["api.example.com"] == ["respond ok"]
+
+
+def test_a_failed_move_writes_nothing_and_moves_the_files_back(client, caddyfile, site_root, tmp_path,
+                                                             monkeypatch):
+    from app import routes
+
+    (site_root / "index.html").write_text("hi")
+    other_root = tmp_path / "sites" / "other"
+    other_root.mkdir()
+    caddyfile.write_text(caddyfile.read_text() + f"\nother.example.com {{\n\troot * {other_root}\n}}\n")
+    before = caddyfile.read_text()
+    relocate_tree = routes.relocate_tree
+
+    def fail_for_other(source, target, **options):
+        if source == str(other_root):
+            raise OSError("disk full")
+        return relocate_tree(source, target, **options)
+
+    monkeypatch.setattr(routes, "relocate_tree", fail_for_other)
+
+    response = batch(client,
+                     {"op": "update", "domain": "example.com",
+                      "config": [f"root * {tmp_path / 'sites' / 'moved'}"]},
+                     {"op": "update", "domain": "other.example.com",
+                      "config": [f"root * {tmp_path / 'sites' / 'elsewhere'}"]})
+
+    assert response.status_code == 202, response.json
+    assert wait_for_job(client, response.json["batch_job"])["status"] == "failed"
+    assert caddyfile.read_text() == before
+    assert (site_root / "index.html").read_text() == "hi"
+    assert not (tmp_path / "sites" / "moved").exists()
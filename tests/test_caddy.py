@@ -0,0 +1,238 @@
+import time
+
+import pytest
+import requests
+
+from app.caddy import (
+    AdminApiBackend,
+    CaddyError,
+    FleetBackend,
+    FleetError,
+    ReloadQueue,
+    reload_backend,
+    route_change,
+)
+from app.caddyfile import absolute_imports
+from app.jobs import JobRegistry
+
+
+def config(*routes, servers=("srv0",), listen=(":443",)):
+    return {"apps": {"http": {"servers": {name: {"listen": list(listen), "routes": list(routes)}
+                                          for name in servers}}}}
+
+
+def route(host, upstream="127.0.0.1:8080"):
+    return {"match": [{"host": [host]}], "handle": [{"handler": "reverse_proxy", "upstreams": [{"dial": upstream}]}]}
+
+
+PATH = "/config/apps/http/servers/srv0/routes/"
+
+
+@pytest.mark.parametrize("running, adapted, change", [
+    (config(route("a"), route("b")), config(route("a"), route("b", "127.0.0.1:9090")),
+     ("PATCH", PATH + "1", route("b", "127.0.0.1:9090"))),
+    (config(route("a"), route("c")), config(route("a"), route("b"), route("c")), ("PUT", PATH + "1", route("b"))),
+    (config(route("a"), route("b")), config(route("b")), ("DELETE", PATH + "0", None)),
+])
+def test_a_single_changed_route_is_patched_in_place(running, adapted, change):
+    assert route_change(running, adapted) == change
+
+
+@pytest.mark.parametrize("running, adapted", [
+    (config(route("a"), route("b")), config(route("x"), route("y"))),
+    (config(route("a")), config(route("a"), route("b"), route("c"))),
+    (config(route("a")), config(route("b"), listen=(":8443",))),
+    (config(route("a")), config(route("a"), route("b"), servers=("srv0", "srv1"))),
+    ({}, config(route("a"))),
+])
+def test_anything_else_needs_a_full_load(running, adapted):
+    assert route_change(running, adapted) is None
+
+
+class Response:
+    def __init__(self, body):
+        self.body = body
+
+    def json(self):
+        return self.body
+
+
+class StubAdmin(AdminApiBackend):
+    """Answers admin API calls from memory and records them."""
+
+    def __init__(self, running):
+        super().__init__()
+        self.running = running
+        self.calls = []
+
+    def _request(self, method, path, **kwargs):
+        self.calls.append((method, path))
+        if path == "/adapt":
+            self.adapted_text = kwargs["data"].decode("utf-8")
+            return Response({"result": config(route("a"), route("b", "127.0.0.1:9090"))})
+        if path == "/config/":
+            return Response(self.running)
+        return Response(None)
+
+
+def test_reload_patches_one_route_and_skips_unchanged_configs(tmp_path):
+    caddyfile = tmp_path / "Caddyfile"
+    caddyfile.write_text("a {\n\treverse_proxy 127.0.0.1:8080\n}\n")
+    admin = StubAdmin(config(route("a"), route("b")))
+
+    assert admin.reload(str(caddyfile)) == {"backend": "admin", "method": "patch", "path": PATH + "1"}
+    assert admin.calls[-1] == ("PATCH", PATH + "1")
+
+    admin.running = config(route("a"), route("b", "127.0.0.1:9090"))
+    assert admin.reload(str(caddyfile))["method"] == "unchanged"
+
+
+def test_relative_imports_are_adapted_from_the_caddyfile_directory(tmp_path):
+    (tmp_path / "sites").mkdir()
+    (tmp_path / "sites" / "blog.caddy").write_text("blog.example.com {\n\trespond hi\n}\n")
+    caddyfile = tmp_path / "Caddyfile"
+    caddyfile.write_text("(common) {\n\tencode gzip\n}\n\nimport sites/*.caddy\n\n"
+                         "example.com {\n\timport common\n}\n")
+    admin = StubAdmin({})
+
+    admin.reload(str(caddyfile))
+
+    assert f"import {tmp_path}/sites/*.caddy\n" in admin.adapted_text
+    assert "\timport common\n" in admin.adapted_text
+
+
+@pytest.mark.parametrize("line, expected", [
+    ("import sites/*.caddy", "import DIR/sites/*.caddy"),
+    ('\timport "my sites/a.caddy" arg', '\timport "DIR/my sites/a.caddy" arg'),
+    ("import common", "import common"),
+    ("import missing.caddy", "import missing.caddy"),
+    ("import /etc/caddy/sites/*.caddy", "import /etc/caddy/sites/*.caddy"),
+    ("import {$SITES}", "import {$SITES}"),
+    ("respond import sites/*.caddy", "respond import sites/*.caddy"),
+])
+def test_absolute_imports(tmp_path, line, expected):
+    for directory in ("sites", "my sites"):
+        (tmp_path / directory).mkdir()
+        (tmp_path / directory / "a.caddy").write_text("")
+    (tmp_path / "common").write_text("")
+    text = f"(common) {{\n\tencode gzip\n}}\n\nexample.com {{\n{line}\n}}\n"
+
+    assert absolute_imports(text, str(tmp_path)) == text.replace(line, expected.replace("DIR", str(tmp_path)))
+
+
+def test_imports_inside_heredocs_are_left_alone(tmp_path):
+    (tmp_path / "sites").mkdir()
+    (tmp_path / "sites" / "a.caddy").write_text("")
+    text = "example.com {\n\trespond <<EOF\nimport sites/a.caddy\n\tEOF 200\n\timport sites/a.caddy\n}\n"
+
+    result = absolute_imports(text, str(tmp_path))
+
+    assert result == text.replace("\timport sites", f"\timport {tmp_path}/sites")
+    assert result.count(str(tmp_path)) == 1
+
+
+class CountingBackend:
+    def __init__(self, error=None):
+        self.reloads = []
+        self.error = error
+
+    def validate(self, caddyfile_path):
+        pass
+
+    def reload(self, caddyfile_path):
+        self.reloads.append((caddyfile_path, time.monotonic()))
+        if self.error:
+            raise CaddyError(self.error)
+        return {"backend": "counting"}
+
+
+def test_requests_within_the_window_share_one_reload():
+    backend = CountingBackend()
+    queue = ReloadQueue(JobRegistry(), lambda: backend, window=0.2, max_delay=5)
+
+    jobs = {queue.request("Caddyfile") for _ in range(20)}
+
+    [job] = jobs
+    assert job.wait(5) and job.status == "succeeded"
+    assert job.info["requests"] == 20
+    assert len(backend.reloads) == 1
+
+
+def test_a_steady_stream_of_requests_still_reloads_by_max_delay():
+    backend = CountingBackend()
+    queue = ReloadQueue(JobRegistry(), lambda: backend, window=0.2, max_delay=0.5)
+    started = time.monotonic()
+
+    first = queue.request("Caddyfile")
+    while not first.done and time.monotonic() - started < 3:
+        queue.request("Caddyfile")
+        time.sleep(0.05)
+
+    assert first.status == "succeeded"
+    assert 0.5 <= backend.reloads[0][1] - started < 1.5
+
+
+def test_immediate_requests_and_failures():
+    backend = CountingBackend(error="caddy reload exited with status 1")
+    queue = ReloadQueue(JobRegistry(), lambda: backend, window=30)
+
+    queue.request("Caddyfile")
+    job = queue.request("Caddyfile", delay=0)
+
+    assert job.wait(5)
+    assert job.status == "failed" and "status 1" in job.error
+    assert queue.request("other/Caddyfile") is not job
+
+
+class DownAdmin(AdminApiBackend):
+    """A node that cannot be reached."""
+
+    def _request(self, method, path, **kwargs):
+        raise requests.ConnectionError(f"{self.admin_url} is down")
+
+
+def test_a_fleet_reports_every_node_and_fails_when_one_did(tmp_path):
+    caddyfile = tmp_path / "Caddyfile"
+    caddyfile.write_text("a {\n\treverse_proxy 127.0.0.1:8080\n}\n")
+    up = StubAdmin(config(route("a"), route("b")))
+    fleet = FleetBackend(None, [("down", DownAdmin("http://down:2019")), ("up", up)])
+
+    with pytest.raises(FleetError) as error:
+        fleet.reload(str(caddyfile))
+
+    nodes = {node["node"]: node for node in error.value.result["nodes"]}
+    assert nodes["up"]["status"] == "succeeded"
+    assert nodes["down"]["status"] == "failed" and "is down" in nodes["down"]["error"]
+    # The unreachable node was skipped for /adapt, and the other one still got the config.
+    assert ("POST", "/adapt") in up.calls and ("PATCH", PATH + "1") in up.calls
+    assert "1 of 2" in str(error.value)
+
+
+def test_a_fleet_without_a_local_caddy_needs_no_binary(tmp_path):
+    caddyfile = tmp_path / "Caddyfile"
+    caddyfile.write_text("a {\n\treverse_proxy 127.0.0.1:8080\n}\n")
+    fleet = FleetBackend(None, [("one", StubAdmin(config(route("a"), route("b"))))])
+
+    assert fleet.format("a {\n}\n") == "a {\n}\n"
+    fleet.validate(str(caddyfile))
+    assert fleet.reload(str(caddyfile))["nodes"][0]["status"] == "succeeded"
+
+
+def test_fleet_status_compares_running_configs():
+    fleet = FleetBackend(None, [("one", StubAdmin(config(route("a")))), ("two", StubAdmin(config(route("a")))),
+                                ("down", DownAdmin("http://down:2019"))])
+
+    nodes = fleet.status()
+
+    assert [node["reachable"] for node in nodes] == [True, True, False]
+    assert nodes[0]["config_sha256"] == nodes[1]["config_sha256"]
+
+
+def test_caddy_nodes_build_a_fleet():
+    nodes = ["http://10.0.0.2:2019", {"name": "edge", "admin": "http://10.0.0.3:2019"}]
+    backend = reload_backend({"caddy_nodes": nodes, "local_caddy": False, "caddy_admin": "http://fleet-test:2019"})
+
+    assert isinstance(backend, FleetBackend) and backend.local is None
+    assert [(name, node.admin_url) for name, node in backend.nodes] == [("10.0.0.2:2019", "http://10.0.0.2:2019"),
+                                                                        ("edge", "http://10.0.0.3:2019")]
+    assert not isinstance(reload_backend({"caddy_admin": "http://fleet-test:2019"}), FleetBackend)
@@ -0,0 +1,94 @@
+from app.caddyfile import Caddyfile, _Scanner
+from app.utils import load_sites, parse_caddyfile
+
+from conftest import CADDYFILE
+
+
+def test_parse_caddyfile_skips_global_options_and_snippets(caddyfile, site_root):
+    sites = parse_caddyfile(str(caddyfile))
+
+    assert [site.domain for site in sites] == ["example.com, www.example.com", "api.example.com"]
+    assert sites[0].addresses == ["example.com", "www.example.com"]
+    assert sites[0].config == [f"root * {site_root}", "import common", "file_server"]
+    assert sites[1].config == ["reverse_proxy 127.0.0.1:8080"]
+
+
+def test_sites_copy_to_plain_dicts(caddyfile):
+    site = parse_caddyfile(str(caddyfile))[1].as_dict()
+
+    assert type(site) is dict
+    assert site == {"domain": "api.example.com", "addresses": ["api.example.com"],
+                    "config": ["reverse_proxy 127.0.0.1:8080"], "line": 15}
+
+
+def test_nested_blocks_stay_in_the_site_config():
+    text = (
+        "example.com {\n"
+        "\thandle /api/* {\n"
+        "\t\treverse_proxy 10.0.0.1:8080 {\n"
+        "\t\t\theader_up Host {host}\n"
+        "\t\t}\n"
+        "\t}\n"
+        "}\n"
+        "other.example.com {\n"
+        "\trespond \"{ not a block\"\n"
+        "}\n"
+    )
+    sites = Caddyfile(text).sites
+
+    assert [block.domain for block in sites] == ["example.com", "other.example.com"]
+    assert sites[0].config == ["handle /api/* {", "reverse_proxy 10.0.0.1:8080 {", "header_up Host {host}",
+                               "}", "}"]
+    assert sites[1].config == ['respond "{ not a block"']
+
+
+def test_crlf_and_unindented_files_parse_like_caddy_fmt_output(site_root):
+    formatted = CADDYFILE.replace("ROOT", str(site_root))
+    expected = [(block.domain, block.config) for block in Caddyfile(formatted).sites]
+
+    crlf = formatted.replace("\n", "\r\n")
+    unindented = "\n".join(line.lstrip("\t") for line in formatted.split("\n"))
+
+    assert [(block.domain, block.config) for block in Caddyfile(crlf).sites] == expected
+    assert [(block.domain, block.config) for block in Caddyfile(unindented).sites] == expected
+
+
+def test_comments_above_a_block_are_kept_on_rewrite():
+    text = "# the api\napi.example.com {\n\treverse_proxy 127.0.0.1:8080\n}\n\n# docs\ndocs.example.com {\n\tfile_server\n}\n"
+    rewritten = Caddyfile(text).replace_site("docs.example.com", ["respond ok"])
+
+    assert rewritten == "# the api\napi.example.com {\n\treverse_proxy 127.0.0.1:8080\n}\n\n# docs\ndocs.example.com {\n\trespond ok\n}\n"
+    assert "# docs" not in Caddyfile(text).remove_site("docs.example.com")
+
+
+def test_load_sites_finds_sites_by_any_address(caddyfile, site_root):
+    index = load_sites(str(caddyfile))
+
+    assert index.get("www.example.com").domain == "example.com, www.example.com"
+    assert index.root_dir("example.com") == str(site_root)
+    assert index.root_dir("api.example.com") is None
+    assert index.roots == {"example.com, www.example.com": str(site_root), "api.example.com": None}
+    assert [site.domain for site in index.search("reverse_proxy")] == ["api.example.com"]
+
+
+def test_load_sites_rereads_a_changed_file(caddyfile):
+    first = load_sites(str(caddyfile))
+    assert load_sites(str(caddyfile)) is first
+
+    caddyfile.write_text(caddyfile.read_text() + "\nnew.example.com {\n\trespond ok\n}\n")
+
+    assert load_sites(str(caddyfile)).get("new.example.com").config == ["respond ok"]
+
+
+def test_heredocs_and_unformatted_files_parse_like_the_exact_scanner(site_root):
+    formatted = CADDYFILE.replace("ROOT", str(site_root))
+    heredoc = formatted.replace("\tfile_server\n", "\tfile_server\n\trespond <<EOF\n\t\t}\n\t\tEOF 200\n")
+    unformatted = heredoc.replace("\n}\n", "\n }\n")
+
+    for text in (heredoc, unformatted):
+        fast = Caddyfile(text)
+        exact = _Scanner(fast)
+        exact._scan_exact()
+        assert [(b.kind, b.keys, b.lead, b.start, b.open, b.end) for b in fast.blocks] == \
+               [(b.kind, b.keys, b.lead, b.start, b.open, b.end) for b in exact.blocks]
+    assert Caddyfile(heredoc).sites[0].config[-3:] == ["respond <<EOF", "}", "EOF 200"]
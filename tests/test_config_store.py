@@ -0,0 +1,48 @@
+import json
+import multiprocessing
+
+from app.utils import JsonFileStore
+
+
+def test_file_is_read_once_until_it_changes(tmp_path):
+    path = tmp_path / "config.json"
+    path.write_text(json.dumps({"port": 5154}))
+    store = JsonFileStore(str(path))
+
+    assert store.get() == {"port": 5154}
+    assert store.get() is store.get()
+    assert store.reload_count == 1
+
+    path.write_text(json.dumps({"port": 8080, "first_run": False}))
+
+    assert store.get() == {"port": 8080, "first_run": False}
+    assert store.reload_count == 2
+
+
+def test_updates_are_seen_by_other_stores(tmp_path):
+    path = tmp_path / "config.json"
+    worker_a = JsonFileStore(str(path), default={"first_run": True})
+    worker_b = JsonFileStore(str(path), default={"first_run": True})
+    assert worker_b.get() == {"first_run": True}
+
+    worker_a.update({"first_run": False, "caddyfile": "/etc/caddy/Caddyfile"})
+
+    assert worker_b.get() == {"first_run": False, "caddyfile": "/etc/caddy/Caddyfile"}
+    assert json.loads(path.read_text()) == worker_b.get()
+
+
+def append_items(path, worker):
+    store = JsonFileStore(path, default={"items": []})
+    for i in range(20):
+        store.modify(lambda data: {**data, "items": data["items"] + [f"{worker}-{i}"]})
+
+
+def test_concurrent_modifications_from_processes_are_not_lost(tmp_path):
+    path = str(tmp_path / "index.json")
+    workers = [multiprocessing.Process(target=append_items, args=(path, worker)) for worker in range(4)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    assert len(json.loads(open(path).read())["items"]) == 80
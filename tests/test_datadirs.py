@@ -0,0 +1,32 @@
+import os
+
+from app.datadirs import data_dir, inside, mount_point
+
+
+def test_the_first_candidate_on_the_same_filesystem_is_used(tmp_path):
+    site = tmp_path / "sites" / "example"
+    site.mkdir(parents=True)
+
+    directory = data_dir(str(site), [str(tmp_path / "data")])
+
+    assert directory == str(tmp_path / "data")
+    assert os.path.isdir(directory)
+
+
+def test_candidates_inside_a_site_root_are_skipped(tmp_path):
+    sites = tmp_path / "sites"
+    (sites / "example").mkdir(parents=True)
+
+    directory = data_dir(str(sites / "example"), [str(sites / "data"), str(tmp_path / "data")],
+                         exclude=[str(sites)])
+
+    assert directory == str(tmp_path / "data")
+    assert not (sites / "data").exists()
+
+
+def test_mount_point_holds_the_path(tmp_path):
+    top = mount_point(str(tmp_path / "not" / "there"))
+
+    assert inside(str(tmp_path), top)
+    assert os.stat(top).st_dev == os.stat(tmp_path).st_dev
+    assert top == os.path.dirname(top) or os.stat(os.path.dirname(top)).st_dev != os.stat(top).st_dev
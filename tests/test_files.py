@@ -0,0 +1,113 @@
+import pytest
+
+from app.utils import FileChangedError, file_etag, patch_file, save_file
+
+
+@pytest.fixture
+def page(site_root):
+    path = site_root / "index.html"
+    path.write_text("<h1>Hello</h1>\n<p>old text</p>\n")
+    return path
+
+
+def etag_of(path):
+    return file_etag(path.stat())
+
+
+def test_patch_file_replaces_byte_ranges(page):
+    etag = patch_file(str(page), [{"offset": 18, "length": 3, "content": "new"},
+                                  {"offset": 4, "length": 5, "content": "Bonjour"}], etag_of(page))
+
+    assert page.read_text() == "<h1>Bonjour</h1>\n<p>new text</p>\n"
+    assert etag == etag_of(page)
+
+
+def test_writes_against_a_stale_etag_are_refused(page):
+    stale = etag_of(page)
+    save_file(str(page), "changed elsewhere\n")
+
+    with pytest.raises(FileChangedError) as error:
+        patch_file(str(page), [{"offset": 0, "length": 7, "content": "mine"}], stale)
+    assert error.value.etag == etag_of(page)
+    with pytest.raises(FileChangedError):
+        save_file(str(page), "mine\n", stale)
+    assert page.read_text() == "changed elsewhere\n"
+
+
+@pytest.mark.parametrize("edits", [
+    [{"offset": 0, "length": 10, "content": ""}, {"offset": 5, "length": 1, "content": ""}],
+    [{"offset": 30, "length": 10, "content": ""}],
+    [{"offset": 0, "length": -1, "content": ""}],
+])
+def test_overlapping_or_out_of_range_edits_are_refused(page, edits):
+    before = page.read_text()
+
+    with pytest.raises(ValueError):
+        patch_file(str(page), edits, etag_of(page))
+    assert page.read_text() == before
+
+
+def test_raw_file_serves_ranges(client, page):
+    response = client.get("/raw-file/example.com/index.html", headers={"Range": "bytes=4-8"})
+
+    assert response.status_code == 206
+    assert response.data == b"Hello"
+    assert response.headers["Content-Range"] == f"bytes 4-8/{page.stat().st_size}"
+    assert response.headers["Accept-Ranges"] == "bytes"
+
+
+def test_raw_file_revalidates_with_its_etag(client, page):
+    etag = client.get("/raw-file/example.com/index.html").headers["ETag"]
+
+    assert client.get("/raw-file/example.com/index.html", headers={"If-None-Match": etag}).status_code == 304
+
+    page.write_text("<h1>Changed</h1>\n")
+    response = client.get("/raw-file/example.com/index.html", headers={"Range": "bytes=0-3", "If-Range": etag})
+    assert response.status_code == 200
+    assert response.data == b"<h1>Changed</h1>\n"
+
+
+def test_save_file_route_applies_edits_and_checks_the_etag(client, page):
+    etag = client.get("/edit-file/example.com/index.html").json["etag"]
+    edit = {"offset": 4, "length": 5, "content": "Hi"}
+
+    response = client.post("/save-file/example.com/index.html", json={"edits": [edit], "etag": etag})
+    assert response.status_code == 200
+    assert page.read_text() == "<h1>Hi</h1>\n<p>old text</p>\n"
+
+    stale = client.post("/save-file/example.com/index.html", json={"edits": [edit], "etag": etag})
+    assert stale.status_code == 409
+    assert stale.json["etag"] == response.json["etag"]
+
+    assert client.post("/save-file/example.com/index.html", json={"edits": [edit]}).status_code == 428
+    assert page.read_text() == "<h1>Hi</h1>\n<p>old text</p>\n"
+
+
+@pytest.mark.parametrize("path", ["/raw-file/example.com/../../outside.txt",
+                                  "/edit-file/example.com/../../outside.txt",
+                                  "/raw-file/example.com/link.txt"])
+def test_files_outside_the_site_root_are_refused(client, site_root, tmp_path, path):
+    (tmp_path / "outside.txt").write_text("secret\n")
+    (site_root / "link.txt").symlink_to(tmp_path / "outside.txt")
+
+    response = client.get(path)
+
+    assert response.status_code == 400
+    assert b"secret" not in response.data
+
+
+def test_saving_outside_the_site_root_is_refused(client, tmp_path):
+    response = client.post("/save-file/example.com/../../outside.txt", json={"content": "x"})
+
+    assert response.status_code == 400
+    assert not (tmp_path / "outside.txt").exists()
+
+
+def test_edits_without_content_delete_the_range(client, page):
+    etag = client.get("/edit-file/example.com/index.html").json["etag"]
+
+    response = client.post("/save-file/example.com/index.html",
+                           json={"edits": [{"offset": 15, "length": 16}], "etag": etag})
+
+    assert response.status_code == 200
+    assert page.read_text() == "<h1>Hello</h1>\n"
@@ -0,0 +1,94 @@
+import pytest
+
+from app.caddyfile import CaddyfileError
+from app.history import CaddyfileHistory
+from app.utils import format_caddyfile
+
+from conftest import CADDYFILE
+
+
+def edit(client, config):
+    response = client.post("/edit-site", json={"domain": "api.example.com", "config": config})
+    assert response.status_code == 200, response.json
+
+
+def test_edits_are_recorded_and_can_be_rolled_back(client, caddyfile):
+    original = caddyfile.read_text()
+    edit(client, ["reverse_proxy 127.0.0.1:9090"])
+    edit(client, ["respond ok"])
+
+    versions = client.get("/history").json["versions"]
+    assert [version["source"] for version in versions] == ["edit", "edit", "external"]
+    assert versions[0]["changed"] == ["api.example.com"]
+
+    response = client.post(f"/history/{versions[-1]['id']}/rollback")
+
+    assert response.status_code == 200
+    assert caddyfile.read_text() == original
+    latest = client.get("/history").json["versions"][0]
+    assert latest["source"] == "rollback"
+    assert latest["id"] == versions[-1]["id"]
+
+
+def test_diff_of_a_version_names_the_changed_site(client):
+    edit(client, ["respond ok"])
+    version = client.get("/history").json["versions"][0]["id"]
+
+    diff = client.get(f"/history/{version}").json
+
+    assert [(site["domain"], site["status"]) for site in diff["sites"]] == [("api.example.com", "changed")]
+    assert "-\treverse_proxy 127.0.0.1:8080\n+\trespond ok\n" in diff["sites"][0]["diff"]
+
+
+def test_unknown_versions_are_not_found(client, caddyfile):
+    before = caddyfile.read_text()
+
+    assert client.post("/history/" + "0" * 64 + "/rollback").status_code == 404
+    assert client.get("/history/" + "0" * 64).status_code == 404
+    assert caddyfile.read_text() == before
+
+
+def test_identical_text_has_the_same_version(tmp_path, site_root):
+    history = CaddyfileHistory(str(tmp_path / "history"))
+    text = CADDYFILE.replace("ROOT", str(site_root))
+
+    first = history.record(text, None)
+    changed = history.record(text.replace("8080", "9090"), None)
+    again = history.record(text, None, source="rollback")
+
+    assert again["id"] == first["id"] != changed["id"]
+    assert changed["changed"] == ["api.example.com"]
+    assert history.text(first["id"]) == text
+
+
+def test_edits_keep_the_rest_of_the_file_as_written(client, caddyfile):
+    caddyfile.write_text(caddyfile.read_text().replace("\treverse_proxy", "    reverse_proxy  "))
+    untouched = caddyfile.read_text().split("api.example.com")[1]
+
+    edit_site = client.post("/edit-site", json={"domain": "example.com, www.example.com",
+                                                "config": ["respond hi"]})
+
+    assert edit_site.status_code == 200, edit_site.json
+    assert caddyfile.read_text().split("api.example.com")[1] == untouched
+
+
+def test_format_writes_the_file_once_as_a_fmt_version(client, caddyfile):
+    caddyfile.write_text(caddyfile.read_text().replace("\t", "    "))
+
+    def fmt(text):
+        return text.replace("    ", "\t")
+
+    assert format_caddyfile(str(caddyfile), fmt)
+    assert not format_caddyfile(str(caddyfile), fmt)
+
+    assert "    " not in caddyfile.read_text()
+    sources = [version["source"] for version in client.get("/history").json["versions"]]
+    assert sources == ["fmt", "external"]
+
+
+def test_format_output_that_changes_more_than_whitespace_is_not_written(client, caddyfile):
+    before = caddyfile.read_text()
+
+    with pytest.raises(CaddyfileError):
+        format_caddyfile(str(caddyfile), lambda text: "")
+    assert caddyfile.read_text() == before
@@ -0,0 +1,86 @@
+import time
+
+import pytest
+
+from app.indexer import FileIndex, _Inotify
+from app.listing import list_directory
+
+
+@pytest.fixture
+def tree(tmp_path):
+    root = tmp_path / "site"
+    (root / "css").mkdir(parents=True)
+    (root / "css" / "site.css").write_text("body {}")
+    (root / "index.html").write_text("hello")
+    (tmp_path / "shared").mkdir()
+    (tmp_path / "shared" / "big.bin").write_bytes(b"x" * 1000)
+    (root / "shared").symlink_to(tmp_path / "shared")
+    (root / "home.html").symlink_to(root / "index.html")
+    (root / "broken").symlink_to(tmp_path / "missing")
+    return root
+
+
+@pytest.fixture
+def index(tmp_path, tree):
+    index = FileIndex(str(tmp_path / "index.sqlite3"), lambda: [str(tree)])
+    conn = index._connect()
+    index._scan_root(conn, str(tree))
+    # Answer listings without the inotify thread, as if it were watching.
+    conn.execute("UPDATE roots SET live = 1, heartbeat = ?", (time.time(),))
+    conn.commit()
+    yield index, conn
+    conn.close()
+
+
+def types(files):
+    return {item["name"]: item["type"] for item in files}
+
+
+def test_symlinks_are_classified_like_directory_listings(index, tree):
+    index, _ = index
+
+    files, cursor, total = index.listing(str(tree), "")
+
+    assert types(files) == types(list_directory(str(tree))[0])
+    assert types(files)["shared"] == "directory"
+    assert types(files)["home.html"] == types(files)["broken"] == "file"
+    assert cursor is None and total == 5
+
+
+def test_symlinked_directories_are_not_descended_into(index, tree):
+    index, _ = index
+
+    assert index.listing(str(tree), "shared") is None
+    assert index.search(str(tree), "big") == []
+    assert index.dir_size(str(tree), "") < 1000
+
+
+def test_refresh_follows_a_symlink_replacing_a_directory(index, tree):
+    index, conn = index
+    (tree / "css" / "site.css").unlink()
+    (tree / "css").rmdir()
+    (tree / "css").symlink_to(tree.parent / "shared")
+
+    index._refresh(conn, str(tree), "css")
+    index._refresh(conn, str(tree), "")
+    conn.commit()
+
+    assert types(index.listing(str(tree), "")[0])["css"] == "directory"
+    assert index.search(str(tree), "site.css") == []
+    assert index.dir_size(str(tree), "css") == 0
+
+
+def test_listings_are_unpaged_unless_asked(index, tree):
+    index, _ = index
+
+    files, cursor, _ = index.listing(str(tree), "")
+    assert len(files) == 5 and cursor is None
+
+    files, cursor, _ = index.listing(str(tree), "", limit=2)
+    rest, last, _ = index.listing(str(tree), "", cursor=cursor)
+    assert [item["name"] for item in files + rest] == ["css", "shared", "broken", "home.html", "index.html"]
+    assert last is None
+
+
+def test_writes_to_open_files_are_watched():
+    assert _Inotify.MASK & _Inotify.IN_MODIFY
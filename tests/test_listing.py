@@ -0,0 +1,120 @@
+import json
+
+import pytest
+
+from app.listing import decode_cursor, encode_cursor, list_directory, stream_json
+
+
+@pytest.fixture
+def directory(tmp_path):
+    for i in range(25):
+        (tmp_path / f"file{i:02d}.txt").write_bytes(b"x" * (i * 10 + 1))
+    for name in ("assets", "css", "js"):
+        (tmp_path / name).mkdir()
+    return tmp_path
+
+
+def all_pages(path, **options):
+    names = []
+    cursor = None
+    while True:
+        files, cursor, total = list_directory(str(path), cursor=cursor, limit=7, **options)
+        names.extend(item["name"] for item in files)
+        if cursor is None:
+            return names, total
+
+
+def test_pages_cover_every_entry_once_with_directories_first(directory):
+    names, total = all_pages(directory)
+    files = [f"file{i:02d}.txt" for i in range(25)]
+
+    assert total == 28
+    assert names == ["assets", "css", "js"] + files
+    assert all_pages(directory, descending=True)[0] == ["js", "css", "assets"] + files[::-1]
+    assert all_pages(directory, sort="size")[0] == ["assets", "css", "js"] + files
+
+
+def test_entries_added_between_pages_are_not_repeated_or_skipped(directory):
+    files, cursor, _ = list_directory(str(directory), limit=10)
+    (directory / "aaa.txt").write_text("before the cursor")
+    (directory / "zzz.txt").write_text("after the cursor")
+
+    rest = []
+    while cursor:
+        page, cursor, _ = list_directory(str(directory), cursor=cursor, limit=10)
+        rest.extend(item["name"] for item in page)
+
+    seen = [item["name"] for item in files] + rest
+    assert len(seen) == len(set(seen))
+    assert "zzz.txt" in rest and "aaa.txt" not in seen
+
+
+def test_cursor_only_works_for_its_own_sort_and_order():
+    cursor = encode_cursor((1, "file07.txt", "file07.txt"), "name", False)
+
+    assert decode_cursor(cursor, "name", False) == (1, "file07.txt", "file07.txt")
+    with pytest.raises(ValueError, match="different order"):
+        decode_cursor(cursor, "name", True)
+    with pytest.raises(ValueError, match="different order"):
+        decode_cursor(cursor, "size", False)
+
+
+@pytest.mark.parametrize("cursor", [
+    "not base64 at all!",
+    encode_cursor((True, "a", "a"), "name", False),
+    encode_cursor((1, 5, "a"), "name", False),
+    encode_cursor((1, "a", None), "name", False),
+])
+def test_malformed_cursors_are_rejected(cursor):
+    with pytest.raises(ValueError, match="Invalid cursor"):
+        decode_cursor(cursor, "name", False)
+
+
+def test_cursor_from_another_order_is_a_bad_request(client, site_root):
+    for i in range(3):
+        (site_root / f"page{i}.html").write_text("hi")
+    first = client.get("/list-files/example.com?limit=1&sort=name")
+    assert first.status_code == 200 and first.json["next_cursor"]
+
+    response = client.get(f"/list-files/example.com?limit=1&sort=size&cursor={first.json['next_cursor']}")
+
+    assert response.status_code == 400
+    assert "different order" in response.json["error"]
+
+
+def test_listings_are_not_paged_unless_asked(directory):
+    files, cursor, total = list_directory(str(directory))
+
+    assert len(list(files)) == total == 28
+    assert cursor is None
+
+
+def test_the_list_files_route_returns_everything_without_a_limit(client, site_root):
+    for i in range(1005):
+        (site_root / f"page{i:04d}.html").touch()
+
+    everything = client.get("/list-files/example.com").json
+    first = client.get("/list-files/example.com?limit=1").json
+    rest = client.get(f"/list-files/example.com?cursor={first['next_cursor']}").json
+
+    assert len(everything["files"]) == everything["total"] == 1005
+    assert everything["next_cursor"] is None
+    assert len(rest["files"]) == 1000 and rest["next_cursor"]
+
+
+def test_stream_json_consumes_files_as_it_goes():
+    consumed = []
+
+    def files():
+        for i in range(250):
+            consumed.append(i)
+            yield {"name": f"file{i}"}
+
+    pieces = stream_json(files(), total=250)
+    head = next(pieces)
+    first = next(pieces)
+
+    assert len(consumed) == 100
+    body = head + first + "".join(pieces)
+    assert len(consumed) == 250
+    assert [item["name"] for item in json.loads(body)["files"]] == [f"file{i}" for i in range(250)]
@@ -0,0 +1,25 @@
+from app import metrics
+
+
+def test_streamed_responses_are_timed_until_the_body_is_sent(client, site_root, monkeypatch):
+    observed = []
+    monkeypatch.setattr(metrics.http_request_duration, "observe",
+                        lambda value, **labels: observed.append(labels["endpoint"]))
+
+    response = client.get("/list-files/example.com", buffered=False)
+    assert observed == []
+    response.get_data()
+    response.close()
+    assert observed == ["list_files"]
+
+    client.get("/jobs/unknown")
+    assert observed == ["list_files", "job_status"]
+
+
+def test_metrics_are_rendered_in_the_prometheus_text_format(client):
+    client.get("/jobs/unknown")
+
+    text = client.get("/metrics").get_data(as_text=True)
+
+    assert "# TYPE caddy_web_ui_http_requests_total counter" in text
+    assert 'endpoint="job_status"' in text
@@ -0,0 +1,106 @@
+import io
+import json
+
+import pytest
+
+from app.usage import QuotaExceeded, UsageScanner, check_quota, site_quota
+
+
+@pytest.fixture
+def quota(tmp_path):
+    """Set the quota of example.com; the app picks the change up from config.json."""
+    def set_quota(**limits):
+        path = tmp_path / "app" / "config" / "config.json"
+        config = json.loads(path.read_text())
+        config["site_quotas"] = {"example.com": limits}
+        path.write_text(json.dumps(config))
+    return set_quota
+
+
+def test_quotas_are_looked_up_by_any_address_of_the_site():
+    config = {"site_quotas": {"www.example.com": {"soft": "10", "hard": 20}}, "default_quota": {"hard": 5}}
+
+    assert site_quota(config, "example.com", "www.example.com") == (10, 20)
+    assert site_quota(config, "other.example.com") == (None, 5)
+    assert site_quota({}, "example.com") == (None, None)
+
+
+def test_only_growth_can_break_the_hard_quota():
+    assert check_quota(90, 10, None, 100) is None
+    assert "soft quota" in check_quota(90, 10, 50, 100)
+    # Shrinking a site that is already over its quota is allowed.
+    assert check_quota(150, -10, None, 100) is None
+    with pytest.raises(QuotaExceeded) as error:
+        check_quota(90, 11, None, 100)
+    assert (error.value.usage, error.value.limit) == (90, 100)
+
+
+def test_scans_count_every_file_and_name_the_largest(tmp_path):
+    (tmp_path / "css").mkdir()
+    (tmp_path / "css" / "site.css").write_bytes(b"x" * 300)
+    (tmp_path / "index.html").write_bytes(b"x" * 100)
+    scanner = UsageScanner(top=1)
+
+    result = scanner.scan(str(tmp_path))
+
+    assert (result["bytes"], result["files"], result["dirs"]) == (400, 2, 2)
+    assert result["largest"] == [{"path": "css/site.css", "size": 300}]
+
+    scanner.invalidate(str(tmp_path / "index.html"), 50)
+    assert scanner.cached(str(tmp_path))["bytes"] == 450
+    assert scanner.cached(str(tmp_path))["scanned"] == 0
+
+
+def test_uploads_over_the_hard_quota_are_refused(client, site_root, quota):
+    (site_root / "big.bin").write_bytes(b"x" * 900)
+    quota(hard=1000)
+
+    response = client.post("/upload/example.com", data={"files": (io.BytesIO(b"y" * 500), "new.bin")},
+                           content_type="multipart/form-data")
+
+    assert response.status_code == 507
+    assert (response.json["usage"], response.json["quota"]) == (900, 1000)
+    assert not (site_root / "new.bin").exists()
+
+    init = client.post("/upload-init/example.com", json={"filename": "new.bin", "size": 200})
+    assert init.status_code == 507
+
+
+def test_going_over_the_soft_quota_only_warns(client, site_root, quota):
+    (site_root / "big.bin").write_bytes(b"x" * 900)
+    quota(soft=1000, hard=10000)
+
+    response = client.post("/upload/example.com", data={"files": (io.BytesIO(b"y" * 500), "new.bin")},
+                           content_type="multipart/form-data")
+
+    assert response.status_code == 200
+    assert "soft quota" in response.json["quota_warning"]
+    assert (site_root / "new.bin").stat().st_size == 500
+
+
+def test_saves_are_checked_by_how_much_they_grow_the_file(client, site_root, quota):
+    page = site_root / "index.html"
+    page.write_text("x" * 900)
+    quota(hard=1000)
+    etag = client.get("/edit-file/example.com/index.html").json["etag"]
+
+    grow = client.post("/save-file/example.com/index.html",
+                       json={"edits": [{"offset": 0, "length": 0, "content": "y" * 200}], "etag": etag})
+    shrink = client.post("/save-file/example.com/index.html",
+                         json={"edits": [{"offset": 0, "length": 100}], "etag": etag})
+
+    assert grow.status_code == 507
+    assert shrink.status_code == 200
+    assert page.stat().st_size == 800
+
+
+def test_usage_routes_report_sizes_and_quotas(client, site_root, quota):
+    (site_root / "index.html").write_bytes(b"x" * 123)
+    quota(soft=100, hard=1000)
+
+    usage = client.get("/api/usage/example.com?refresh=1").json
+
+    assert (usage["bytes"], usage["files"]) == (123, 1)
+    assert (usage["soft_quota"], usage["hard_quota"]) == (100, 1000)
+    sites = client.get("/api/usage").json["sites"]
+    assert sites["example.com, www.example.com"]["hard_quota"] == 1000
@@ -0,0 +1,66 @@
+import os
+
+import pytest
+
+from app.caddyfile import Caddyfile
+from app.jobs import JobRegistry
+from app.trash import Trash, TrashError
+
+
+def domains(caddyfile):
+    return [block.domain for block in Caddyfile.load(str(caddyfile)).sites]
+
+
+def test_deleted_files_go_to_the_app_data_directory_and_can_be_restored(client, site_root, tmp_path):
+    (site_root / "index.html").write_text("hi")
+
+    response = client.delete("/delete-file/example.com/index.html")
+
+    assert response.status_code == 200, response.json
+    trash_dir = tmp_path / "app" / "config" / "data" / "trash"
+    assert os.listdir(site_root) == []
+    assert sorted(os.listdir(trash_dir)) == [response.json["trash_id"], response.json["trash_id"] + ".json"]
+    assert sorted(os.listdir(site_root.parent)) == ["example"]
+
+    assert client.post(f"/trash/{response.json['trash_id']}/restore").status_code == 200
+    assert (site_root / "index.html").read_text() == "hi"
+
+
+def test_deleted_sites_are_trashed_with_their_block(client, caddyfile, site_root, tmp_path):
+    (site_root / "index.html").write_text("hi")
+
+    response = client.post("/delete-site", json={"domain": "example.com"})
+
+    assert response.status_code == 200, response.json
+    assert not site_root.exists()
+    assert sorted(os.listdir(site_root.parent)) == []
+    assert domains(caddyfile) == ["api.example.com"]
+
+    assert client.post(f"/trash/{response.json['trash_id']}/restore").status_code == 200
+    assert (site_root / "index.html").read_text() == "hi"
+    assert sorted(domains(caddyfile)) == ["api.example.com", "example.com, www.example.com"]
+
+
+def test_a_site_is_kept_when_there_is_no_trash_for_it(client, caddyfile, site_root, monkeypatch):
+    from app import routes
+
+    monkeypatch.setattr(routes, "data_dir", lambda *args, **kwargs: None)
+    before = caddyfile.read_text()
+
+    response = client.post("/delete-site", json={"domain": "example.com"})
+
+    assert response.status_code == 409
+    assert "data_dirs" in response.json["error"]
+    assert site_root.is_dir()
+    assert caddyfile.read_text() == before
+
+
+def test_the_trash_is_never_inside_the_boundary(tmp_path):
+    site = tmp_path / "site"
+    site.mkdir()
+    (site / "page.html").write_text("x")
+    trash = Trash(JobRegistry(), str(tmp_path / "trash.json"), lambda path, boundary: None)
+
+    with pytest.raises(TrashError):
+        trash.move(str(site / "page.html"), boundary=str(site))
+    assert (site / "page.html").exists()
@@ -0,0 +1,85 @@
+import hashlib
+import io
+import os
+import zipfile
+
+from conftest import wait_for_job
+
+DATA = bytes(range(256)) * 40
+
+
+def start(client, filename="data.bin", data=DATA, **fields):
+    response = client.post("/upload-init/example.com/files", json={"filename": filename, "size": len(data), **fields})
+    assert response.status_code == 200, response.json
+    return response.json["upload_id"]
+
+
+def put(client, upload_id, offset, data):
+    return client.put(f"/uploads/{upload_id}?offset={offset}", data=data)
+
+
+def test_an_interrupted_upload_resumes_from_the_stored_offset(client, site_root):
+    upload_id = start(client, sha256=hashlib.sha256(DATA).hexdigest())
+
+    assert put(client, upload_id, 0, DATA[:4000]).json["offset"] == 4000
+    assert client.get(f"/uploads/{upload_id}").json["offset"] == 4000
+    stale = put(client, upload_id, 0, DATA[:4000])
+    assert stale.status_code == 409 and stale.json["offset"] == 4000
+    assert client.post(f"/uploads/{upload_id}/finalize").status_code == 409
+
+    assert put(client, upload_id, 4000, DATA[4000:]).json["offset"] == len(DATA)
+    response = client.post(f"/uploads/{upload_id}/finalize")
+
+    assert response.status_code == 200, response.json
+    assert response.json["sha256"] == hashlib.sha256(DATA).hexdigest()
+    assert (site_root / "files" / "data.bin").read_bytes() == DATA
+    assert os.listdir(site_root / "files") == ["data.bin"]
+    assert client.get(f"/uploads/{upload_id}").status_code == 404
+
+
+def test_a_checksum_mismatch_keeps_the_file_out_of_place(client, site_root):
+    upload_id = start(client)
+    put(client, upload_id, 0, DATA)
+
+    response = client.post(f"/uploads/{upload_id}/finalize", json={"sha256": "0" * 64})
+
+    assert response.status_code == 422
+    assert not (site_root / "files" / "data.bin").exists()
+
+
+def test_chunks_past_the_declared_size_are_refused(client):
+    upload_id = start(client, data=b"abc")
+
+    response = put(client, upload_id, 0, b"abcdef")
+
+    assert response.status_code == 413
+    assert client.get(f"/uploads/{upload_id}").json["offset"] == 0
+
+
+def test_aborted_uploads_leave_nothing_behind(client, site_root):
+    upload_id = start(client)
+    put(client, upload_id, 0, DATA[:100])
+
+    assert client.delete(f"/uploads/{upload_id}").status_code == 200
+    assert os.listdir(site_root / "files") == []
+
+
+def test_an_uploaded_archive_is_extracted_in_the_background(client, site_root):
+    data = io.BytesIO()
+    with zipfile.ZipFile(data, "w") as archive:
+        archive.writestr("index.html", "hi")
+    data = data.getvalue()
+    upload_id = start(client, filename="site.zip", data=data, extract=True)
+    put(client, upload_id, 0, data)
+
+    response = client.post(f"/uploads/{upload_id}/finalize")
+
+    assert response.status_code == 202
+    assert wait_for_job(client, response.json["extract_job"])["status"] == "succeeded"
+    assert sorted(os.listdir(site_root / "files")) == ["index.html"]
+
+
+def test_chunked_upload_rejects_file_names_with_a_path(client):
+    for filename in ("../escaped.txt", "css/site.css", ".."):
+        response = client.post("/upload-init/example.com", json={"filename": filename, "size": 1})
+        assert response.status_code == 400
@@ -0,0 +1,109 @@
+import os
+
+import pytest
+
+from app.caddyfile import Caddyfile
+from app.validation import ValidationError, Validator, parse_address
+
+from conftest import CADDYFILE
+
+
+@pytest.fixture
+def current(site_root):
+    return Caddyfile(CADDYFILE.replace("ROOT", str(site_root)))
+
+
+def check(current, text, **options):
+    return Validator(run_caddy=False, **options).check(Caddyfile(text), "/etc/caddy/Caddyfile", current)
+
+
+def test_a_duplicate_address_is_reported_with_its_site_and_line(current):
+    text = current.add_site("api.example.com:443", ["respond hi"])
+
+    with pytest.raises(ValidationError) as error:
+        check(current, text)
+
+    [problem] = error.value.errors
+    assert problem["check"] == "duplicate"
+    assert problem["domain"] == "api.example.com:443"
+    assert problem["line"] == Caddyfile(text).find_site("api.example.com:443").line
+    assert "api.example.com" in problem["error"]
+
+
+def test_reserved_ports_and_mixed_schemes_are_rejected(current):
+    with pytest.raises(ValidationError) as error:
+        check(current, current.add_site("new.example.com:5154", ["respond hi"]), reserved_ports={5154: "the UI"})
+    assert error.value.errors[0]["check"] == "port"
+
+    with pytest.raises(ValidationError) as error:
+        check(current, current.add_site("http://new.example.com:443", ["respond hi"]))
+    assert error.value.errors[0]["check"] == "port"
+
+
+def test_a_root_that_is_a_file_is_rejected_and_a_missing_one_is_a_warning(current, tmp_path):
+    (tmp_path / "file").write_text("x")
+
+    with pytest.raises(ValidationError) as error:
+        check(current, current.add_site("new.example.com", [f"root * {tmp_path / 'file'}"]))
+    assert error.value.errors[0]["check"] == "root"
+
+    warnings = check(current, current.add_site("new.example.com", [f"root * {tmp_path / 'new'}"]))
+    assert [warning["check"] for warning in warnings] == ["root"]
+
+
+def test_problems_in_unchanged_sites_do_not_block_other_edits(current):
+    broken = Caddyfile(current.add_site("api.example.com:443", ["respond hi"]))
+
+    assert check(broken, broken.replace_site("example.com, www.example.com", ["respond hi"])) == []
+
+
+def test_caddy_validate_runs_once_per_text_with_its_status_and_output(current, tmp_path):
+    calls = tmp_path / "calls"
+    caddy = tmp_path / "caddy"
+    caddyfile = tmp_path / "Caddyfile"
+    text = current.replace_site("api.example.com", ["bogus"])
+    line = Caddyfile(text).find_site("api.example.com").line + 1
+    caddy.write_text(f'#!/bin/sh\necho x >> {calls}\necho "Error: $3:{line}: unknown directive" >&2\nexit 1\n')
+    caddy.chmod(0o755)
+
+    for _ in range(2):
+        with pytest.raises(ValidationError) as error:
+            Validator(caddy_bin=str(caddy)).check(Caddyfile(text), str(caddyfile), current)
+        [problem] = error.value.errors
+        assert problem["check"] == "caddy" and problem["status"] == 1
+        assert (problem["line"], problem["domain"]) == (line, "api.example.com")
+        assert problem["output"] == f"Error: {caddyfile}:{line}: unknown directive"
+    assert calls.read_text() == "x\n"
+    assert not [name for name in os.listdir(tmp_path) if name.startswith(".validate-")]
+
+
+@pytest.mark.parametrize("config, runs_caddy", [
+    ({}, False),
+    ({"reload_backend": "admin"}, False),
+    ({"reload_backend": "cli"}, True),
+    ({"reload_backend": "admin", "validate_with_caddy": True}, True),
+    ({"reload_backend": "cli", "validate_with_caddy": False}, False),
+])
+def test_caddy_validate_is_left_to_the_admin_api_by_default(config, runs_caddy):
+    assert Validator.from_config(config).run_caddy is runs_caddy
+
+
+def test_rejected_edits_return_400_and_leave_the_file_alone(client, caddyfile):
+    before = caddyfile.read_text()
+
+    response = client.post("/edit-site", json={"domain": "api.example.com", "config": [f"root * {caddyfile}"]})
+
+    assert response.status_code == 400
+    assert response.json["errors"][0]["check"] == "root"
+    assert caddyfile.read_text() == before
+
+
+@pytest.mark.parametrize("address, parsed", [
+    ("example.com", ("https", "example.com", 443, "")),
+    ("http://example.com", ("http", "example.com", 80, "")),
+    (":8080", ("http", "", 8080, "")),
+    ("[::1]:8443/api", ("https", "::1", 8443, "/api")),
+    ("{$DOMAIN}", (None, "{$DOMAIN}", None, "")),
+])
+def test_parse_address(address, parsed):
+    assert parse_address(address) == parsed